@@ -2,11 +2,17 @@ import sys
 import numpy as np
 import argparse
 
+from src.packed import PackedTensor
+
 class DataType:
     FLOAT32 = "FLOAT32"
     INT4 = "INT4"
+    INT2 = "INT2"
     BIT1 = "BIT1"
 
+# Bits per element for the packed (sub-byte) data types
+PACKED_BITS = {DataType.INT4: 4, DataType.INT2: 2, DataType.BIT1: 1}
+
 class Tensor:
     def __init__(self, shape, dtype=DataType.FLOAT32, data=None):
         self.shape = shape
@@ -17,12 +23,28 @@ class Tensor:
             # Initialize with zeros
             if dtype == DataType.FLOAT32:
                 self.data = np.zeros(shape, dtype=np.float32)
-            elif dtype == DataType.INT4:
-                # Simulated INT4 (stored as int8 for now)
-                self.data = np.zeros(shape, dtype=np.int8)
-            elif dtype == DataType.BIT1:
-                # Simulated 1-bit (stored as bool/uint8)
-                self.data = np.zeros(shape, dtype=np.uint8)
+            elif dtype in PACKED_BITS:
+                # INT4: 2 values per byte, INT2: 4, BIT1: 8
+                self.data = PackedTensor.zeros(shape, bits=PACKED_BITS[dtype])
+
+    @classmethod
+    def quantize(cls, array, dtype=DataType.INT4, group_size=64):
+        """Quantizes a float array into packed storage."""
+        array = np.asarray(array, dtype=np.float32)
+        if dtype == DataType.FLOAT32:
+            return cls(array.shape, dtype, array)
+        packed = PackedTensor.quantize(array, bits=PACKED_BITS[dtype], group_size=group_size)
+        return cls(array.shape, dtype, packed)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def numpy(self):
+        """Returns the (dequantized) values as a float32 array."""
+        if isinstance(self.data, PackedTensor):
+            return self.data.numpy()
+        return self.data
 
     def __repr__(self):
         return f"Tensor(shape={self.shape}, dtype={self.dtype}, data=\n{self.data})"
@@ -0,0 +1,91 @@
+"""Benchmark: native C++ quantization backend vs the torch fallback.
+
+Build the library first with ``python scripts/build_backend.py``.
+
+    python scripts/bench_backend.py [--rows M] [--cols N] [--batch 1 8 32] [--repeat R]
+                                    [--threads 1 2 4 8]
+
+Matmuls use group-wise INT4 weights (PackedTensor.quantize) against X of
+shape (N, K) for each K in --batch; dense fp32 torch.matmul is the reference.
+"""
+import argparse
+import os
+import sys
+import time
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from src.native import TorchBackend, load_backend
+from src.packed import PackedTensor
+from src.parallel import ParallelKernels
+
+
+def timed(fn, repeat):
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantization backends")
+    parser.add_argument("--rows", type=int, default=4096)
+    parser.add_argument("--cols", type=int, default=4096)
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 8, 32],
+                        help="Input columns K (1 = decode, >1 = prefill/batched decode)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threads", type=int, nargs="*", default=[],
+                        help="Also report row-sharded scaling for these pool sizes")
+    args = parser.parse_args()
+
+    backends = [TorchBackend()]
+    native = load_backend()
+    if native is None:
+        print("Native backend not found (run scripts/build_backend.py); timing fallback only.")
+    else:
+        print(f"Native backend: {native.path}")
+        backends.append(native)
+
+    w = torch.randn(args.rows, args.cols)
+    print(f"W: {args.rows}x{args.cols}")
+
+    print("quantize (group-wise INT4):")
+    base = None
+    for backend in backends:
+        ms = timed(lambda: backend.quantize_4bit(w), args.repeat)
+        base = base or ms
+        print(f"  {backend.name:<8}{ms:10.2f} ms ({base / ms:.2f}x)")
+
+    packed = PackedTensor.quantize(w, bits=4)
+    print(f"matmul (group-wise INT4, {packed.nbytes / 2**20:.1f} MiB packed):")
+    for k in args.batch:
+        x = torch.randn(args.cols, k)
+        dense = timed(lambda: torch.matmul(w, x), args.repeat)
+        line = f"  K={k:<4} fp32 {dense:8.2f} ms"
+        for backend in backends:
+            ms = timed(lambda: backend.matmul_4bit(packed, x), args.repeat)
+            line += f" | {backend.name} {ms:8.2f} ms ({dense / ms:.2f}x)"
+        print(line)
+
+    if args.threads:
+        kernels = backends[-1]
+        x = torch.randn(args.cols, args.batch[0])
+        print(f"thread scaling ({kernels.name}, K={args.batch[0]}):")
+        base = {}
+        for n in args.threads:
+            pool = ParallelKernels(kernels, n, max_threads=n)
+            q = timed(lambda: pool.quantize_4bit(w), args.repeat)
+            m = timed(lambda: pool.matmul_4bit(packed, x), args.repeat)
+            pool.shutdown()
+            base.setdefault("q", q)
+            base.setdefault("m", m)
+            print(f"  threads={n:<3} quantize {q:8.2f} ms ({base['q'] / q:.2f}x)"
+                  f"   matmul {m:8.2f} ms ({base['m'] / m:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
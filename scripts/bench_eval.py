@@ -0,0 +1,99 @@
+"""Microbenchmark: statements/sec of APLInterpreter.eval.
+
+Compares the AST path (tokenizer + parser + LRU parse cache) with the old
+string-splitting evaluator, which is kept here verbatim as a reference.
+
+    python scripts/bench_eval.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from src.apl_parser import parse
+from src.interpreter import APLInterpreter
+
+STATEMENTS = [
+    "⍳5",
+    "2 3 ⍴ ⍳6",
+    "A <- 10",
+    "A",
+    "1 2 3 4",
+    "4 4 ⍴ ⍳16",
+]
+
+
+def legacy_eval(interp, code):
+    """The pre-parser eval path (string splitting on every call)."""
+    code = code.strip()
+    if "<-" in code:
+        parts = code.split("<-")
+        interp.variables[parts[0].strip()] = legacy_eval_expr(interp, parts[1].strip())
+        return f"{parts[0].strip()} assigned."
+    return legacy_eval_expr(interp, code)
+
+
+def legacy_eval_expr(interp, expr):
+    if "⍴" in expr:
+        parts = expr.split("⍴")
+        try:
+            shape = [int(x) for x in parts[0].strip().split()]
+            data = legacy_eval_expr(interp, parts[1].strip())
+            if isinstance(data, torch.Tensor):
+                return data.reshape(shape)
+        except:
+            pass
+    if "⍳" in expr:
+        try:
+            n = int(expr.split("⍳")[1].strip())
+            return torch.arange(n, device=interp.device)
+        except:
+            pass
+    try:
+        if " " in expr:
+            return torch.tensor([float(x) for x in expr.split()], device=interp.device)
+        return torch.tensor(float(expr), device=interp.device)
+    except:
+        pass
+    if expr in interp.variables:
+        return interp.variables[expr]
+    return f"Unknown expression: {expr}"
+
+
+def statements_per_second(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for stmt in STATEMENTS:
+            fn(stmt)
+    elapsed = time.perf_counter() - start
+    return repeat * len(STATEMENTS) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark APLInterpreter.eval")
+    parser.add_argument("--repeat", type=int, default=2000, help="Passes over the statement list")
+    args = parser.parse_args()
+
+    interp = APLInterpreter()
+    print(f"Device: {interp.device}, {len(STATEMENTS)} statements x {args.repeat}")
+
+    legacy = statements_per_second(lambda s: legacy_eval(interp, s), args.repeat)
+
+    parse.cache_clear()
+    ast = statements_per_second(interp.eval, args.repeat)
+
+    parse_only = statements_per_second(parse.__wrapped__, args.repeat)
+
+    print(f"{'legacy string-splitting':<28}{legacy:>12,.0f} stmt/s")
+    print(f"{'AST + parse cache':<28}{ast:>12,.0f} stmt/s  ({ast / legacy:.2f}x)")
+    print(f"{'parse only (uncached)':<28}{parse_only:>12,.0f} stmt/s")
+    print(f"Parse cache: {parse.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
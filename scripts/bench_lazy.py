@@ -0,0 +1,65 @@
+"""Benchmark: eager vs lazy (fused) evaluation of elementwise chains.
+
+    python scripts/bench_lazy.py [--size N] [--repeat R] [--compile]
+"""
+import argparse
+import os
+import sys
+import time
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from src.interpreter import APLInterpreter
+
+EXPRESSIONS = [
+    "A × B + C - D",
+    "(A × B) + (C × D) - A ÷ 2",
+    "| A - B ⌈ C ⌊ D",
+]
+
+
+def time_mode(interp, expr, repeat):
+    interp.eval(expr)  # warm-up (plan build / compilation)
+    if interp.device == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        interp.eval(expr)
+    if interp.device == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark lazy elementwise fusion")
+    parser.add_argument("--size", type=int, default=4_000_000, help="Elements per array")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--compile", action="store_true", help="Also time torch.compile plans")
+    args = parser.parse_args()
+
+    modes = ["off", "on"] + (["compile"] if args.compile else [])
+    interps = {}
+    data = {name: torch.rand(args.size) for name in "ABCD"}
+    for mode in modes:
+        interp = APLInterpreter()
+        interp.variables.update({k: v.to(interp.device) for k, v in data.items()})
+        interp.eval(f"Lazy {mode}")
+        interps[mode] = interp
+
+    print(f"{args.size:,} elements, {args.repeat} runs per expression")
+    for expr in EXPRESSIONS:
+        base = None
+        for mode in modes:
+            interp = interps[mode]
+            ms = time_mode(interp, expr, args.repeat) * 1000
+            base = base or ms
+            plans = list(interp.fusion._plans.values())
+            allocs = {"off": "-", "compile": "fused"}.get(mode) or plans[-1].allocations
+            print(f"  {expr:<28} lazy={mode:<8}{ms:9.2f} ms  ({base / ms:.2f}x)  buffers={allocs}")
+
+
+if __name__ == "__main__":
+    main()
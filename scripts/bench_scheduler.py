@@ -0,0 +1,74 @@
+"""Benchmark: concurrent Run requests, sequential vs continuous batching.
+
+    python scripts/bench_scheduler.py [--users 20] [--tokens 16] [--dim 512] [--blocks 4]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.engine import encode
+from src.interpreter import APLInterpreter
+from src.scheduler import BatchScheduler
+
+
+def build(args):
+    interp = APLInterpreter()
+    interp.eval(f"Layer 'Embed' 'Embedding' 256 {args.dim}")
+    for i in range(args.blocks):
+        interp.eval(f"Layer 'Block{i}' 'QuantTransformerBlock' {args.dim}")
+    interp.eval(f"Layer 'Head' 'QuantLinear' {args.dim} 256")
+    interp.eval(f"MaxTokens <- {args.tokens}")
+    return interp
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark continuous batching")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=16)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--blocks", type=int, default=4)
+    args = parser.parse_args()
+    prompts = [f"user {i} asks a question" for i in range(args.users)]
+
+    interp = build(args)
+    engine = interp.get_engine()
+    list(engine.generate(encode("warm-up", 256), 2))
+    start = time.perf_counter()
+    for prompt in prompts:
+        list(engine.generate(encode(prompt, 256), args.tokens))
+    sequential = time.perf_counter() - start
+    passes = args.users * args.tokens
+
+    scheduler = BatchScheduler(interp)
+    results = [None] * args.users
+    def user(i):
+        results[i] = scheduler.eval(f"Run '{prompts[i]}'")
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(args.users)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batched = time.perf_counter() - start
+    st = scheduler.stats()
+    scheduler.close()
+
+    total = args.users * args.tokens
+    print(f"{args.users} users x {args.tokens} tokens, dim {args.dim}, {args.blocks} blocks")
+    print(f"  sequential {sequential * 1000:9.1f} ms  {total / sequential:8.1f} tok/s  "
+          f"{passes} forward passes")
+    print(f"  batched    {batched * 1000:9.1f} ms  {total / batched:8.1f} tok/s  "
+          f"{st['forward_passes']} forward passes ({st['decode_steps']} decode steps, "
+          f"mean batch {st['mean_batch_size']:.1f})  ({sequential / batched:.2f}x)")
+    lat, ttft = st["latency_ms"], st["ttft_ms"]
+    print(f"  latency p50/p95/p99 {lat['p50']:.0f}/{lat['p95']:.0f}/{lat['p99']:.0f} ms, "
+          f"first token p50/p95/p99 {ttft['p50']:.0f}/{ttft['p95']:.0f}/{ttft['p99']:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Startup benchmark: cold import and time-to-first-prompt per entry point.
+
+Every measurement runs in a fresh interpreter process, so module caches
+never carry over (the OS file cache does; run it twice for warm numbers).
+
+* cold import: wall time of ``python -c "import <entry>"``;
+* first prompt: from process start until the entry point is ready for
+  input: the launcher menu prompt, the mounted Textual app, the Gradio
+  server accepting requests, or quick_run's first line of output.
+
+    python scripts/bench_startup.py [--repeat N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PRELUDE = f"import sys; sys.path.insert(0, {ROOT!r}); "
+
+_UI_READY = _PRELUDE + """
+import asyncio
+from src.ui import APLStudio
+async def main():
+    async with APLStudio().run_test() as pilot:
+        await pilot.pause()
+        print("READY", flush=True)
+asyncio.run(main())
+"""
+
+_WEB_READY = _PRELUDE + """
+from src.web_ui import build_demo
+demo = build_demo()
+demo.launch(prevent_thread_lock=True, quiet=True)
+print("READY", flush=True)
+demo.close()
+"""
+
+# name: (module to import, command to launch, marker that means "ready", stdin)
+ENTRY_POINTS = {
+    "launcher.py": ("launcher", [sys.executable, "-u", os.path.join(ROOT, "launcher.py")],
+                    "Select option", b"3\n"),
+    "src/ui.py": ("src.ui", [sys.executable, "-u", "-c", _UI_READY], "READY", None),
+    "src/web_ui.py": ("src.web_ui", [sys.executable, "-u", "-c", _WEB_READY], "READY", None),
+    "scripts/quick_run.py": ("scripts.quick_run",
+                             [sys.executable, "-u", os.path.join(ROOT, "scripts", "quick_run.py"),
+                              "models/demo.apl"], "Initializing", None),
+}
+
+
+def time_import(module):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", _PRELUDE + f"import {module}"], cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def time_until(cmd, marker, stdin=None, timeout=300):
+    """Seconds from spawning ``cmd`` until ``marker`` appears on its stdout."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    seen = b""
+    try:
+        while marker.encode() not in seen:
+            chunk = os.read(proc.stdout.fileno(), 4096)
+            if not chunk:
+                raise RuntimeError(f"{cmd[-1]} exited before printing {marker!r}")
+            seen += chunk
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError(f"{cmd[-1]} not ready after {timeout}s")
+        elapsed = time.perf_counter() - start
+        if stdin:
+            proc.stdin.write(stdin)
+            proc.stdin.flush()
+    finally:
+        proc.stdin.close()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    base = statistics.median(time_import("sys") for _ in range(args.repeat))
+    print(f"Python startup: {base * 1000:.0f} ms (median of {args.repeat})\n")
+    print(f"{'entry point':<24} {'cold import':>12} {'first prompt':>13}")
+    for name, (module, cmd, marker, stdin) in ENTRY_POINTS.items():
+        imp = statistics.median(time_import(module) for _ in range(args.repeat))
+        ready = statistics.median(time_until(cmd, marker, stdin) for _ in range(args.repeat))
+        print(f"{name:<24} {imp * 1000:>9.0f} ms {ready * 1000:>10.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""Benchmark suite for catching performance regressions.
+
+Times the interpreter, quantization, model loading and UI rendering paths
+and writes the results as JSON. A run can be checked against a stored
+baseline, and the exit status is 1 when any case got slower than its
+threshold allows, so a release can be gated on it:
+
+    python scripts/bench_suite.py --output baseline.json
+    python scripts/bench_suite.py --baseline baseline.json --threshold 0.15 \\
+        --threshold-for 'quant.*=0.25'
+
+Each case is timed like ``timeit``: the call is repeated until a sample
+takes at least --min-time seconds, and the median per-call time over
+--repeat samples is reported (with the best sample and the spread).
+Inputs are seeded, so runs differ only by machine noise. --quick shrinks
+the shapes for a smoke run; a case is only compared with a baseline entry
+that used the same parameters.
+
+    python scripts/bench_suite.py [--quick] [--filter 'eval.*'] [--list]
+"""
+import argparse
+import atexit
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from src.interpreter import APLInterpreter
+from src.packed import PackedTensor
+
+FORMAT = 1
+DEFAULT_THRESHOLD = 0.10
+
+# Statements timed through APLInterpreter.eval (parse cache included).
+STATEMENTS = {
+    "scalar": "1 + 2",
+    "vector": "1 2 3 4 × 2",
+    "assign": "A <- 10",
+    "lookup": "A",
+    "reshape": "4 4 ⍴ ⍳16",
+    "chain": "(⍳100) × 2 + 1",
+}
+
+
+class Case:
+    """A named benchmark: ``setup(params)`` returns the callable to time."""
+
+    def __init__(self, name, setup, params, quick=None, unit=None):
+        self.name = name
+        self.setup = setup
+        self.params = params
+        self.quick = quick or params
+        # (label, count): also report count / seconds as e.g. "stmt/s";
+        # count may be a function of the params
+        self.unit = unit
+
+
+def _eval_case(stmt):
+    def setup(params):
+        interp = APLInterpreter()
+        interp.eval("A <- 10")
+        return lambda: interp.eval(stmt)
+    return setup
+
+
+def _iota(params):
+    interp = APLInterpreter()
+    code = f"⍳{params['n']}"
+    return lambda: interp.eval(code)
+
+
+def _reshape(params):
+    interp = APLInterpreter()
+    n = params["n"]
+    rows = int(n ** 0.5)
+    interp.eval(f"V <- ⍳{rows * rows}")
+    code = f"{rows} {rows} ⍴ V"
+    return lambda: interp.eval(code)
+
+
+def _product(params):
+    # Products over n x n matrices A, B and a length-n vector V
+    interp = APLInterpreter()
+    n = params["n"]
+    interp.variables.update(A=torch.rand(n, n), B=torch.rand(n, n), V=torch.rand(n))
+    code = params["expr"]
+    return lambda: interp.eval(code)
+
+
+def _reduction(params):
+    # f/ or f\ over a rows x cols matrix: M is numeric, B boolean
+    interp = APLInterpreter()
+    shape = (params["rows"], params["cols"])
+    interp.variables.update(M=torch.rand(shape) + 0.5, B=torch.rand(shape) > 0.5)
+    code = params["expr"]
+    return lambda: interp.eval(code)
+
+
+def _elements(params):
+    return params["rows"] * params["cols"]
+
+
+# Reduce/scan expressions, reported as elements per second. ≠ on booleans
+# takes the tree path and | the right fold.
+REDUCTIONS = {
+    "plus_reduce": "+/ M",
+    "plus_reduce_first": "+⌿ M",
+    "max_reduce": "⌈/ M",
+    "minus_reduce": "-/ M",
+    "xor_reduce": "≠/ B",
+    "residue_reduce": "|/ M",
+    "plus_scan": "+\\ M",
+    "times_scan": "×\\ M",
+    "max_scan_first": "⌈⍀ M",
+    "xor_scan": "≠\\ B",
+}
+
+
+def _quantize(params):
+    w = torch.randn(params["rows"], params["cols"])
+    return lambda: PackedTensor.quantize(w, bits=4)
+
+
+def _matmul(params):
+    interp = APLInterpreter()
+    kernels = interp.kernels
+    w = PackedTensor.quantize(torch.randn(params["rows"], params["cols"]), bits=4)
+    x = torch.randn(params["cols"], params["k"])
+    return lambda: kernels.matmul_4bit(w, x)
+
+
+def _matmul_bits(params):
+    from src.bitplanes import BitPlanes
+
+    interp = APLInterpreter()
+    kernels = interp.kernels
+    w = PackedTensor.quantize(torch.randn(params["rows"], params["cols"]), bits=params["bits"],
+                              symmetric=True)
+    planes = BitPlanes.from_packed(w, params["act_bits"])
+    x = torch.randn(params["cols"], params["k"])
+    return lambda: kernels.matmul_bits(planes, x)
+
+
+def _load_preset(params):
+    interp = APLInterpreter()
+    code = f"LoadModel '{params['model']}'"
+    return lambda: interp.eval(code)
+
+
+def _load_apl_bin(params):
+    from scripts.convert_model import convert
+
+    tmp = tempfile.mkdtemp(prefix="apl-bench-")
+    atexit.register(shutil.rmtree, tmp, True)
+    hidden = params["hidden"]
+    state = {"embed.weight": torch.randn(256, hidden)}
+    for i in range(params["layers"]):
+        state[f"layers.{i}.weight"] = torch.randn(hidden, hidden)
+        state[f"layers.{i}.bias"] = torch.randn(hidden)
+    source = os.path.join(tmp, "model.pt")
+    torch.save(state, source)
+    out = os.path.join(tmp, "model.apl_bin")
+    convert(source, out, bits=4, log=lambda _: None)
+    interp = APLInterpreter()
+    code = f"LoadModel '{out}'"
+    return lambda: interp.eval(code)
+
+
+def _layers(n):
+    return [{"name": f"Block{i}", "type": "TransformerBlock", "shape": [4096], "bits": 4,
+             "quantization": "4-bit packed (group 64)"} for i in range(n)]
+
+
+def _structure_md(params):
+    from src.web_ui import get_structure_md
+    layers = _layers(params["layers"])
+    return lambda: get_structure_md(layers)
+
+
+def _visualizer(params):
+    from src.ui import ModelVisualizer
+    widget = ModelVisualizer()
+    layers = _layers(params["layers"])
+    return lambda: widget.update_structure(layers)
+
+
+CASES = [Case(f"eval.{name}", _eval_case(stmt), {"stmt": stmt}, unit=("stmt/s", 1))
+         for name, stmt in STATEMENTS.items()] + [
+    Case("eval.iota_large", _iota, {"n": 10_000_000}, {"n": 100_000}),
+    Case("eval.reshape_large", _reshape, {"n": 10_000_000}, {"n": 100_000}),
+    Case("eval.inner_matmul", _product, {"n": 1024, "expr": "A +.× B"},
+         {"n": 128, "expr": "A +.× B"}),
+    Case("eval.inner_maxplus", _product, {"n": 256, "expr": "A ⌈.+ B"},
+         {"n": 64, "expr": "A ⌈.+ B"}),
+    Case("eval.outer_times", _product, {"n": 2048, "expr": "V ∘.× V"},
+         {"n": 256, "expr": "V ∘.× V"}),
+] + [
+    Case(f"op.{name}", _reduction, {"rows": 1024, "cols": 1024, "expr": expr},
+         {"rows": 128, "cols": 128, "expr": expr}, unit=("elem/s", _elements))
+    for name, expr in REDUCTIONS.items()] + [
+    Case("quant.quantize_2048", _quantize, {"rows": 2048, "cols": 2048}, {"rows": 256, "cols": 256}),
+    Case("quant.quantize_4096", _quantize, {"rows": 4096, "cols": 4096}, {"rows": 512, "cols": 512}),
+    Case("quant.matmul_2048_decode", _matmul, {"rows": 2048, "cols": 2048, "k": 1},
+         {"rows": 256, "cols": 256, "k": 1}),
+    Case("quant.matmul_4096_decode", _matmul, {"rows": 4096, "cols": 4096, "k": 1},
+         {"rows": 512, "cols": 512, "k": 1}),
+    Case("quant.matmul_4096_prefill", _matmul, {"rows": 4096, "cols": 4096, "k": 32},
+         {"rows": 512, "cols": 512, "k": 8}),
+    Case("quant.xnor_4096_decode", _matmul_bits,
+         {"rows": 4096, "cols": 4096, "k": 1, "bits": 1, "act_bits": 1},
+         {"rows": 512, "cols": 512, "k": 1, "bits": 1, "act_bits": 1}),
+    Case("quant.ternary_4096_decode", _matmul_bits,
+         {"rows": 4096, "cols": 4096, "k": 1, "bits": 2, "act_bits": 2},
+         {"rows": 512, "cols": 512, "k": 1, "bits": 2, "act_bits": 2}),
+    Case("load.preset_mistral", _load_preset, {"model": "mistral"}),
+    Case("load.apl_bin", _load_apl_bin, {"hidden": 2048, "layers": 8}, {"hidden": 256, "layers": 2}),
+    Case("ui.structure_md", _structure_md, {"layers": 2000}, {"layers": 200}),
+    Case("ui.visualizer", _visualizer, {"layers": 2000}, {"layers": 200}),
+]
+
+
+def measure(fn, repeat, min_time):
+    """Seconds per call of ``fn``: (median, best, stdev) over ``repeat`` samples."""
+    fn()  # warm-up (caches, lazy imports, allocator)
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    spread = statistics.stdev(samples) if len(samples) > 1 else 0.0
+    return statistics.median(samples), min(samples), spread, number
+
+
+def run(cases, quick=False, repeat=5, min_time=0.2, log=print):
+    results = {}
+    for case in cases:
+        params = case.quick if quick else case.params
+        fn = case.setup(params)
+        median, best, spread, number = measure(fn, repeat, min_time)
+        entry = {"params": params, "median_ms": median * 1000, "best_ms": best * 1000,
+                 "stdev_ms": spread * 1000, "calls_per_sample": number, "samples": repeat}
+        line = f"{case.name:<28}{median * 1000:>12.4f} ms  (best {best * 1000:.4f}, ±{spread * 1000:.4f})"
+        if case.unit:
+            label, count = case.unit
+            if callable(count):
+                count = count(params)
+            entry[label] = count / median
+            line += f"  {count / median:>12,.0f} {label}"
+        results[case.name] = entry
+        log(line)
+    return results
+
+
+def environment(quick):
+    return {"python": platform.python_version(), "torch": torch.__version__,
+            "platform": platform.platform(), "machine": platform.machine(),
+            "cpus": os.cpu_count(), "torch_threads": torch.get_num_threads(),
+            "quick": quick, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def threshold_for(name, default, overrides):
+    """The allowed slowdown for ``name``: the last matching override wins."""
+    allowed = default
+    for pattern, value in overrides:
+        if fnmatch.fnmatch(name, pattern):
+            allowed = value
+    return allowed
+
+
+def compare(results, baseline, default=DEFAULT_THRESHOLD, overrides=()):
+    """Rows of (name, status, ratio) against ``baseline["results"]``.
+
+    ``ratio`` is current / baseline median time. ``status`` is "regression"
+    when it exceeds 1 + threshold, "improved" below 1 / (1 + threshold),
+    "ok" in between, and "new" or "changed" (parameters differ) when there
+    is nothing comparable.
+    """
+    rows = []
+    old = baseline.get("results", {})
+    for name, entry in results.items():
+        before = old.get(name)
+        if before is None:
+            rows.append((name, "new", None))
+            continue
+        if before.get("params") != entry["params"]:
+            rows.append((name, "changed", None))
+            continue
+        ratio = entry["median_ms"] / before["median_ms"]
+        allowed = 1 + threshold_for(name, default, overrides)
+        status = "regression" if ratio > allowed else "improved" if ratio < 1 / allowed else "ok"
+        rows.append((name, status, ratio))
+    return rows
+
+
+def _override(text):
+    pattern, sep, value = text.rpartition("=")
+    if not sep or not pattern:
+        raise argparse.ArgumentTypeError(f"expected PATTERN=FRACTION, got {text!r}")
+    return pattern, float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", "-o", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", "-b", help="compare against a JSON file from --output")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown as a fraction of the baseline (default 0.10)")
+    parser.add_argument("--threshold-for", type=_override, action="append", default=[],
+                        metavar="PATTERN=FRACTION",
+                        help="per-case threshold, e.g. 'ui.*=0.3' (repeatable)")
+    parser.add_argument("--filter", "-k", action="append", default=[], metavar="PATTERN",
+                        help="only run cases matching this glob (repeatable)")
+    parser.add_argument("--quick", action="store_true", help="small shapes for a smoke run")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per case")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per sample")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    args = parser.parse_args(argv)
+
+    cases = [c for c in CASES
+             if not args.filter or any(fnmatch.fnmatch(c.name, p) for p in args.filter)]
+    if args.list:
+        for case in cases:
+            print(f"{case.name:<28}{json.dumps(case.quick if args.quick else case.params, ensure_ascii=False)}")
+        return 0
+
+    torch.manual_seed(args.seed)
+    report = {"format": FORMAT, "environment": environment(args.quick),
+              "results": run(cases, args.quick, args.repeat, args.min_time)}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    rows = compare(report["results"], baseline, args.threshold, args.threshold_for)
+    print(f"\nAgainst {args.baseline}:")
+    for name, status, ratio in rows:
+        change = f"{(ratio - 1) * 100:+7.1f}%" if ratio is not None else " " * 8
+        print(f"  {name:<28}{change}  {status}")
+    regressions = [name for name, status, _ in rows if status == "regression"]
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""Builds the C++ quantization backend as a shared library.
+
+The library is written to build/ where src/native.py looks for it:
+
+    python scripts/build_backend.py [--native] [output_dir]
+
+The default build runs on any CPU of the target architecture, so it can
+be bundled and shipped (scripts/build_exe.py). ``--native`` tunes a
+GCC/Clang build for this machine's CPU (``-march=native``, e.g. AVX2 or
+AVX-512): faster locally, but it may crash with an illegal instruction on
+any other CPU.
+
+CMake users can build the ``apl_quant`` target instead.
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(ROOT, "src", "backend", "quantization.cpp")
+
+
+def library_name():
+    if sys.platform == "win32":
+        return "apl_quant.dll"
+    if sys.platform == "darwin":
+        return "libapl_quant.dylib"
+    return "libapl_quant.so"
+
+
+def compile_commands(output, native=False):
+    if sys.platform == "win32" and shutil.which("cl"):
+        yield ["cl", "/nologo", "/O2", "/LD", "/openmp", "/EHsc", SOURCE, f"/Fe{output}"]
+        yield ["cl", "/nologo", "/O2", "/LD", "/EHsc", SOURCE, f"/Fe{output}"]
+        return
+    cxx = os.environ.get("CXX") or shutil.which("c++") or shutil.which("g++") or "clang++"
+    arch = ["-march=native"] if native else []
+    base = [cxx, "-O3"] + arch + ["-std=c++17", "-shared", "-fPIC", SOURCE, "-o", output]
+    # Prefer an OpenMP build, fall back to a plain one if it is unavailable.
+    yield base + ["-fopenmp"]
+    yield base
+
+
+def build(output_dir=None, native=False):
+    output_dir = output_dir or os.path.join(ROOT, "build")
+    os.makedirs(output_dir, exist_ok=True)
+    output = os.path.join(output_dir, library_name())
+    for cmd in compile_commands(output, native):
+        print(" ".join(cmd))
+        if subprocess.run(cmd).returncode == 0:
+            print(f"Built {output}")
+            return output
+    raise SystemExit("Failed to build the quantization backend")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    native = "--native" in args
+    args = [a for a in args if a != "--native"]
+    build(args[0] if args else None, native)
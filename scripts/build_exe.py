@@ -2,33 +2,54 @@ import PyInstaller.__main__
 import os
 import shutil
 
+# Imported through Deferred placeholders or inside functions.
+LAZY_MODULES = ('primitives', 'lazy', 'packed', 'apl_bin', 'engine', 'kv_cache', 'native',
+                'parallel', 'programs', 'deferred', 'sessions', 'scheduler', 'profiler',
+                'operators')
+
+# PyInstaller's work directory (its default, build/, is where the native
+# library is built).
+WORK_DIR = os.path.join('build', 'pyinstaller')
+
 def build():
     print("Building AI-APL Studio Executable...")
     
-    # Clean previous builds
-    if os.path.exists("dist"):
-        shutil.rmtree("dist")
-    if os.path.exists("build"):
-        shutil.rmtree("build")
+    # Bundle the native quantization backend if it has been built
+    # (python scripts/build_backend.py, without --native so it runs on any
+    # CPU); otherwise the torch fallback is used.
+    binaries = []
+    for lib in ('build/apl_quant.dll', 'build/libapl_quant.so', 'build/libapl_quant.dylib'):
+        if os.path.exists(lib):
+            binaries.append(f'--add-binary={lib}{os.pathsep}.')
+
+    # Clean previous builds. build/ holds the library above, so PyInstaller
+    # works in a directory of its own.
+    for path in ("dist", WORK_DIR):
+        if os.path.exists(path):
+            shutil.rmtree(path)
 
     PyInstaller.__main__.run([
         'launcher.py',
         '--name=AI-APL-Studio',
         '--onedir',  # Directory based build (faster startup, easier debugging)
         '--clean',
+        f'--workpath={WORK_DIR}',
         '--collect-all=gradio',
         '--collect-all=gradio_client',
         '--collect-all=textual',
-        '--collect-all=torch',
         '--collect-all=safehttpx',
         '--collect-all=groovy',
         '--collect-all=huggingface_hub',
         '--add-data=src;src',  # Include source files
         '--add-data=models;models', # Include models directory
+        # torch is bundled by its PyInstaller hook (only what it needs,
+        # not every submodule and test). It and these src modules are
+        # imported lazily (src/deferred.py), so the analysis cannot see them.
+        '--hidden-import=torch',
         '--hidden-import=src.interpreter',
         '--hidden-import=src.web_ui',
         '--hidden-import=src.ui',
-    ])
+    ] + [f'--hidden-import=src.{m}' for m in LAZY_MODULES] + binaries)
     
     print("\nBuild Complete!")
     print(f"Executable is located at: {os.path.abspath('dist/AI-APL-Studio/AI-APL-Studio.exe')}")
@@ -1,35 +1,387 @@
+"""Convert a PyTorch / safetensors checkpoint into a quantized .apl_bin file.
+
+    python scripts/convert_model.py --model path/to/model.safetensors --bits 4
+    python scripts/convert_model.py --model path/to/hf_dir --bits 2 --workers 4
+
+Tensors are read one at a time from memory-mapped checkpoints and quantized
+a block of rows at a time, with each block streamed straight into the
+output file, so peak memory stays near the size of the largest tensor
+rather than the whole model. With --workers, independent tensors are
+quantized in a process pool; at most ``workers`` results are in flight.
+
+Weights (2-D and higher floating tensors) are stored packed with per-group
+scales (src/packed.py); other tensors are stored unquantized. A JSON
+manifest with every tensor's offsets, shapes and dtypes is written next to
+the output (see src/apl_bin.py for the format).
+
+With --calibrate, each group's clipping range is searched to minimize the
+error (src/calibration.py), weighted by sample activations from
+--calibration-data when given. That is a .npz or torch file mapping a
+weight's name (or its layer, without ".weight") to input samples of shape
+(..., in_features) or to per-feature mean squares. --report prints the
+reconstruction error and bytes per parameter of every quantized tensor
+and adds them to the manifest.
+
+    python scripts/convert_model.py --model m.safetensors --bits 2 --group-size 32 \\
+        --calibrate --calibration-data acts.pt --report
+"""
 import argparse
+import glob
 import json
 import os
+import struct
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import torch
+
+from src.apl_bin import AplBinWriter, packed_dtype
+from src.calibration import (ErrorStats, column_weights, dequantize_groups, format_report,
+                             quantize_calibrated)
+from src.packed import DEFAULT_GROUP_SIZE, SUPPORTED_BITS, pack_codes
+
+# Float32 source bytes quantized per block of rows.
+CHUNK_BYTES = 16 << 20
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16,
+    "BF16": torch.bfloat16, "I64": torch.int64, "I32": torch.int32,
+    "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+
+# --- Reading checkpoints ----------------------------------------------------
+
+def find_checkpoints(model):
+    """Checkpoint files for a file, a local directory, or a Hub model ID."""
+    if os.path.isfile(model):
+        return [model]
+    if not os.path.isdir(model):
+        try:
+            from huggingface_hub import snapshot_download
+        except ImportError:
+            raise SystemExit(f"{model} is not a local path (install huggingface_hub "
+                             "to download models by ID)")
+        model = snapshot_download(model, allow_patterns=["*.safetensors", "*.bin", "*.json"])
+    files = sorted(glob.glob(os.path.join(model, "*.safetensors")))
+    if not files:
+        files = sorted(glob.glob(os.path.join(model, "*.bin")) +
+                       glob.glob(os.path.join(model, "*.pt")) +
+                       glob.glob(os.path.join(model, "*.pth")))
+    if not files:
+        raise SystemExit(f"No .safetensors/.bin/.pt checkpoints in {model}")
+    return files
+
+
+def _open_safetensors(path):
+    with open(path, "rb") as f:
+        (size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size))
+    start = 8 + size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        tensors[name] = (path, start + begin, end - begin, dtype, tuple(info["shape"]))
+    return tensors
+
+
+def _load_safetensor(path, offset, nbytes, dtype, shape):
+    # Copy-on-write map: zero-copy and writable (torch requires it), and
+    # pages are only read when a block of rows is quantized.
+    if nbytes == 0:
+        return torch.empty(shape, dtype=dtype)
+    raw = np.memmap(path, dtype=np.uint8, mode="c", offset=offset, shape=(nbytes,))
+    return torch.from_numpy(raw).view(dtype).reshape(shape)
+
+
+def _flatten(state, prefix=""):
+    for key, value in state.items():
+        if isinstance(value, torch.Tensor):
+            yield prefix + key, value
+        elif isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+
+
+def _open_torch(path):
+    try:
+        state = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except RuntimeError:
+        # Legacy (non-zip) checkpoints cannot be memory-mapped.
+        state = torch.load(path, map_location="cpu", weights_only=True)
+    if isinstance(state, dict) and "state_dict" in state:
+        state = state["state_dict"]
+    return dict(_flatten(state))
+
+
+class Checkpoint:
+    """Name -> tensor access over one or more memory-mapped checkpoint files."""
+
+    def __init__(self, files):
+        self.files = files
+        self._safetensors = {}
+        self._torch = {}
+        for path in files:
+            if path.endswith(".safetensors"):
+                self._safetensors.update(_open_safetensors(path))
+            else:
+                self._torch.update(_open_torch(path))
+
+    def names(self):
+        return list(self._safetensors) + list(self._torch)
+
+    def __getitem__(self, name):
+        if name in self._safetensors:
+            return _load_safetensor(*self._safetensors[name])
+        return self._torch[name]
+
+
+# --- Quantization -----------------------------------------------------------
+
+def should_quantize(t):
+    return t.is_floating_point() and t.dim() >= 2 and t.numel() > 0
+
+
+def quantize_blocks(t, bits, group_size, symmetric, calibrate=False, weights=None,
+                    stats=None):
+    """Yields (packed, scales, zeros) for successive blocks of rows of ``t``.
+
+    ``calibrate`` searches clipping per group, weighting errors by
+    ``weights`` (per-feature activation mean squares); ``stats``, an
+    ErrorStats, accumulates the reconstruction error.
+    """
+    cols = t.shape[-1]
+    rows = t.reshape(-1, cols)
+    step = max(1, CHUNK_BYTES // (4 * cols))
+    for r0 in range(0, rows.shape[0], step):
+        block = rows[r0:r0 + step].to(torch.float32).numpy()
+        codes, scales, zeros = quantize_calibrated(block, bits, group_size, symmetric,
+                                                   weights, calibrate)
+        if stats is not None:
+            stats.add(block, dequantize_groups(codes, scales, zeros, group_size), weights)
+        yield pack_codes(codes, bits), scales, zeros
+
+
+def load_activations(path):
+    """Calibration samples: {name: array} from a .npz or torch file."""
+    if path.endswith(".npz"):
+        with np.load(path) as f:
+            return {name: f[name] for name in f.files}
+    data = torch.load(path, map_location="cpu")
+    return {name: t.float().numpy() if isinstance(t, torch.Tensor) else np.asarray(t)
+            for name, t in data.items()}
+
+
+def _column_weights(activations, name, t):
+    # Samples are looked up by tensor name, then by layer ("fc" for "fc.weight").
+    if not activations or not should_quantize(t):
+        return None
+    samples = activations.get(name)
+    if samples is None:
+        samples = activations.get(name.rsplit(".", 1)[0])
+    return None if samples is None else column_weights(samples, t.shape[-1])
+
+
+def _entry(name, t, options=None):
+    entry = {"name": name, "shape": list(t.shape),
+             "source_dtype": str(t.dtype).replace("torch.", "")}
+    if options is None:
+        entry["dtype"] = _raw(t).dtype.name
+    else:
+        bits, group_size, symmetric = options
+        entry.update(dtype=packed_dtype(bits), bits=bits, group_size=group_size,
+                     symmetric=symmetric)
+    return entry
+
+
+def _raw(t):
+    # NumPy has no bfloat16, so unquantized floats are stored as float32.
+    if t.is_floating_point():
+        t = t.to(torch.float32)
+    return t.contiguous().numpy()
+
+
+def write_tensor(writer, name, t, options, calibrate=False, weights=None, stats=None):
+    """Quantizes (if it is a weight) and streams one tensor into ``writer``."""
+    if not should_quantize(t):
+        entry = _entry(name, t)
+        entry["data"] = writer.write_array(_raw(t))
+        writer.add_tensor(entry)
+        return entry
+    entry = _entry(name, t, options)
+    cols = t.shape[-1]
+    rows = t.numel() // cols
+    scales, zeros = [], []
+    writer.begin_blob(np.uint8, (rows, (cols * options[0] + 7) // 8))
+    for packed, s, z in quantize_blocks(t, *options, calibrate, weights, stats):
+        writer.write(packed)
+        scales.append(s)
+        zeros.append(z)
+    entry["data"] = writer.end_blob()
+    entry["scales"] = writer.write_array(np.concatenate(scales))
+    entry["zeros"] = writer.write_array(np.concatenate(zeros))
+    writer.add_tensor(entry)
+    return entry
+
+
+# --- Worker processes -------------------------------------------------------
+
+_worker_checkpoint = None
+_worker_activations = None
+
+
+def _init_worker(files, activations=None):
+    global _worker_checkpoint, _worker_activations
+    torch.set_num_threads(1)
+    _worker_checkpoint = Checkpoint(files)
+    _worker_activations = activations
+
+
+def _quantize_task(name, options, calibrate=False, report=False):
+    t = _worker_checkpoint[name]
+    if not should_quantize(t):
+        return _entry(name, t), _raw(t), None, None, None
+    stats = ErrorStats() if report else None
+    weights = _column_weights(_worker_activations, name, t)
+    blocks = list(quantize_blocks(t, *options, calibrate, weights, stats))
+    return (_entry(name, t, options), *(np.concatenate(parts) for parts in zip(*blocks)),
+            stats)
+
+
+def _write_result(writer, entry, data, scales, zeros):
+    entry["data"] = writer.write_array(data)
+    if scales is not None:
+        entry["scales"] = writer.write_array(scales)
+        entry["zeros"] = writer.write_array(zeros)
+    writer.add_tensor(entry)
+    return entry
+
+
+def convert(model, output, bits=4, group_size=DEFAULT_GROUP_SIZE, symmetric=False,
+            workers=1, log=print, calibrate=False, activations=None, report=False):
+    """Converts ``model`` into ``output`` and writes ``output + '.json'``.
+
+    ``activations`` maps weight or layer names to calibration samples (see
+    load_activations); ``report`` adds each quantized tensor's error and
+    bytes per parameter to the manifest under "report". Returns the
+    manifest dict.
+    """
+    if bits not in SUPPORTED_BITS:
+        raise ValueError(f"Unsupported bit width: {bits}")
+    # 1-bit weights are always sign-binarized (see quantize_groups).
+    options = (bits, group_size, symmetric or bits == 1)
+    files = find_checkpoints(model)
+    info = {"source": model, "bits": bits, "group_size": group_size}
+    if calibrate:
+        info["calibration"] = "activations" if activations else "weights"
+    rows = {}
+
+    def record(entry, stats):
+        _log_entry(log, entry)
+        if stats is not None and stats.params:
+            nbytes = sum(entry[key]["nbytes"] for key in ("data", "scales", "zeros"))
+            rows[entry["name"]] = stats.summary(nbytes)
+
+    with AplBinWriter(output, model=info) as writer:
+        if workers > 1:
+            names = Checkpoint(files).names()
+            with Pool(workers, initializer=_init_worker, initargs=(files, activations)) as pool:
+                # Results are written in order; only `workers` are in flight.
+                pending = deque()
+
+                def write_next():
+                    *result, stats = pending.popleft().get()
+                    record(_write_result(writer, *result), stats)
+
+                for name in names:
+                    pending.append(pool.apply_async(_quantize_task,
+                                                    (name, options, calibrate, report)))
+                    if len(pending) >= workers:
+                        write_next()
+                while pending:
+                    write_next()
+        else:
+            checkpoint = Checkpoint(files)
+            for name in checkpoint.names():
+                t = checkpoint[name]
+                stats = ErrorStats() if report and should_quantize(t) else None
+                entry = write_tensor(writer, name, t, options, calibrate,
+                                     _column_weights(activations, name, t), stats)
+                record(entry, stats)
+        tensors = writer.tensors
+
+    manifest = {
+        "model": model,
+        "file": os.path.basename(output),
+        "quantization": f"{bits}-bit",
+        "group_size": group_size,
+        "file_size": os.path.getsize(output),
+        "layers": tensors,
+    }
+    if report:
+        manifest["report"] = rows
+        log(format_report(rows))
+    with open(output + ".json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _log_entry(log, entry):
+    log(f"  {entry['name']:<48} {str(entry['shape']):<16} {entry['dtype']}")
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
 
 def main():
     parser = argparse.ArgumentParser(description="Convert and quantize models for AI-APL Interpreter")
     parser.add_argument("--model", type=str, required=True, help="HuggingFace model ID or local path")
     parser.add_argument("--bits", type=int, default=4, choices=[1, 2, 4, 8], help="Target quantization bits")
     parser.add_argument("--output", type=str, default="model.apl_bin", help="Output file path")
-    
+    parser.add_argument("--group-size", type=int, default=DEFAULT_GROUP_SIZE,
+                        help="Elements per quantization group (one scale/zero each)")
+    parser.add_argument("--symmetric", action="store_true", help="Symmetric (zero-centred) quantization")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Quantize tensors in this many processes")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="Search per-group clipping that minimizes the quantization error")
+    parser.add_argument("--calibration-data", type=str, default=None,
+                        help="Sample activations per layer (.npz or torch file); implies --calibrate")
+    parser.add_argument("--report", action="store_true",
+                        help="Print reconstruction error and bytes/param per tensor")
+
     args = parser.parse_args()
-    
+
     print(f"Converting model: {args.model}")
-    print(f"Quantization: {args.bits}-bit")
-    
-    # Placeholder for actual conversion logic:
-    # 1. Load model using transformers
-    # 2. Quantize weights
-    # 3. Pack into binary format compatible with Tensor class
-    # 4. Save to disk
-    
-    print(f"Model saved to {args.output}")
-    
-    # Create a manifest file
-    manifest = {
-        "model": args.model,
-        "quantization": f"{args.bits}-bit",
-        "layers": []
-    }
-    
-    with open(args.output + ".json", "w") as f:
-        json.dump(manifest, f, indent=2)
-        
+    print(f"Quantization: {args.bits}-bit, group {args.group_size}")
+
+    start = time.perf_counter()
+    activations = load_activations(args.calibration_data) if args.calibration_data else None
+    manifest = convert(args.model, args.output, args.bits, args.group_size,
+                       args.symmetric, args.workers, calibrate=args.calibrate or bool(activations),
+                       activations=activations, report=args.report)
+    elapsed = time.perf_counter() - start
+
+    print(f"Model saved to {args.output} ({len(manifest['layers'])} tensors, "
+          f"{manifest['file_size'] / 1e6:.1f} MB, {elapsed:.1f}s)")
+    peak = _peak_rss_mb()
+    if peak is not None:
+        print(f"Peak RSS: {peak:.0f} MB")
+
+
 if __name__ == "__main__":
     main()
@@ -1,25 +1,71 @@
+"""Load a model (preset name or .apl script) and run one prompt.
+
+When a daemon (``python scripts/quick_run.py --serve``) is running, this is a
+thin client: the model stays loaded in the daemon between calls, so a run
+costs one round-trip instead of starting Python, torch and the model again.
+Without one (or with ``--local``) everything runs in this process.
+"""
 import sys
 import os
 
 # Add project root to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.interpreter import APLInterpreter
+USAGE = """Usage: python quick_run.py [--local] <model_name_or_file> [input_text]
+       python quick_run.py --serve [daemon options]
+Examples:
+  python quick_run.py tinyllama
+  python quick_run.py models/demo.apl"""
+
+
+def print_structure(layers):
+    print(f"Model Structure ({len(layers)} layers):")
+    for l in layers[:5]:
+        print(f" - {l['name']} ({l['type']})")
+    if len(layers) > 5:
+        print(f" ... and {len(layers)-5} more")
+
+
+def setup_command(target):
+    """The session key and the command that loads ``target`` into a session."""
+    if target.endswith(".apl"):
+        path = os.path.abspath(target)
+        # A script that changed on disk gets a fresh session.
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+        return f"{path}@{mtime}", f"Source '{path}'"
+    return target, f"LoadModel '{target}'"
+
+
+def run_remote(client, target, input_text):
+    session, setup = setup_command(target)
+    print(f"Connected to AI-APL daemon at {client.path}")
+    print(f"Running inference with input: '{input_text}'")
+    print("-" * 40)
+    pieces = []
+
+    def show(piece):
+        pieces.append(piece)
+        sys.stdout.write(piece)
+        sys.stdout.flush()
+
+    reply = client.eval(f"Run '{input_text}'", session=session, setup=setup, on_piece=show)
+    if not pieces:
+        sys.stdout.write(reply["output"])
+    if not reply["output"].endswith("\n"):
+        print()
+    if reply["setup"] is not None:
+        # First use of this session: the model was loaded before the run.
+        print(f"(loaded {target}: {reply['setup']})")
+    print("-" * 40)
+    print_structure(reply["layers"])
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python quick_run.py <model_name_or_file> [input_text]")
-        print("Examples:")
-        print("  python quick_run.py tinyllama")
-        print("  python quick_run.py models/demo.apl")
-        return
 
-    target = sys.argv[1]
-    input_text = sys.argv[2] if len(sys.argv) > 2 else "Hello AI"
-    
+def run_local(target, input_text):
+    from src.interpreter import APLInterpreter
+
     interp = APLInterpreter()
     print(f"Initializing AI-APL Interpreter on {interp.device}...")
-    
+
     if target.endswith(".apl"):
         print(f"Executing source file: {target}")
         res = interp.eval(f"Source '{target}'")
@@ -28,19 +74,42 @@ def main():
         print(f"Loading preset model: {target}")
         res = interp.eval(f"LoadModel '{target}'")
         print(res)
-        
+
     print("-" * 40)
     print(f"Running inference with input: '{input_text}'")
     res = interp.eval(f"Run '{input_text}'")
     print(res)
     print("-" * 40)
-    
+
     # Print structure summary
-    print(f"Model Structure ({len(interp.layers)} layers):")
-    for l in interp.layers[:5]:
-        print(f" - {l['name']} ({l['type']})")
-    if len(interp.layers) > 5:
-        print(f" ... and {len(interp.layers)-5} more")
+    print_structure(interp.layers)
+
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ["--serve"]:
+        from src.daemon import main as serve
+        serve(args[1:])
+        return
+    local = "--local" in args
+    args = [a for a in args if a != "--local"]
+    if not args:
+        print(USAGE)
+        return
+
+    target = args[0]
+    input_text = args[1] if len(args) > 1 else "Hello AI"
+
+    if not local:
+        from src.daemon import DaemonClient
+        client = DaemonClient.connect()
+        if client is not None:
+            try:
+                run_remote(client, target, input_text)
+                return
+            finally:
+                client.close()
+    run_local(target, input_text)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,206 @@
+"""The ``.apl_bin`` weight file: a fixed header, aligned blobs, and an index.
+
+Layout (all integers little-endian)::
+
+    offset 0    header (HEADER_SIZE bytes)
+                  magic          8s   b"APLBIN\\0\\0"
+                  version        u32
+                  alignment      u32  every blob starts at a multiple of this
+                  header_size    u32
+                  tensor_count   u32
+                  index_offset   u64
+                  index_nbytes   u64
+    offset 64   blobs: packed codes, scales and zero points, each aligned
+    index       UTF-8 JSON: {"model": ..., "tensors": [entry, ...]}
+
+The index is written last, so a converter can stream tensors to disk one at
+a time and patch the header when it is done. Each index entry records the
+tensor's name, shape and dtype plus the ``offset``/``nbytes`` of its blobs::
+
+    {"name": "layers.0.attn.q_proj.weight", "shape": [4096, 4096],
+     "dtype": "int4", "bits": 4, "group_size": 64, "symmetric": false,
+     "source_dtype": "float16",
+     "data":   {"offset": 4096, "nbytes": 8388608, "dtype": "uint8", "shape": [4096, 2048]},
+     "scales": {...}, "zeros": {...}}
+
+Unquantized tensors (biases, norms) have a plain ``data`` blob of their
+NumPy dtype and no scales/zeros. Packed blobs use the PackedTensor layout of
+src/packed.py, so they can be wrapped without any conversion.
+
+AplBinFile maps the file copy-on-write (clean pages are shared with the
+page cache) and returns tensors as zero-copy NumPy views or PackedTensors
+over the mapping. Nothing is read at open time
+beyond the header and index: a tensor's pages are faulted in when its
+values are first used, and every process mapping the same file shares
+those pages.
+"""
+import json
+import mmap
+import struct
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from .packed import PackedTensor
+except ImportError:
+    from packed import PackedTensor
+
+MAGIC = b"APLBIN\0\0"
+VERSION = 1
+ALIGNMENT = 64
+HEADER_SIZE = 64
+HEADER = struct.Struct("<8sIIIIQQ")
+
+
+def packed_dtype(bits):
+    """Index dtype name for packed weights ("int4", "int2", "bit1", ...)."""
+    return "bit1" if bits == 1 else f"int{bits}"
+
+
+class AplBinWriter:
+    """Streams tensors into an ``.apl_bin`` file.
+
+    Blobs are written as they arrive (``write_array`` or, for data produced
+    in pieces, ``begin_blob``/``write``/``end_blob``), so only the piece being
+    written needs to be in memory. ``close`` appends the index and fills in
+    the header.
+    """
+
+    def __init__(self, path, model=None):
+        self.path = path
+        self.model = model
+        self.tensors = []
+        self._file = open(path, "wb")
+        self._file.write(b"\0" * HEADER_SIZE)
+        self._blob = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def _align(self):
+        pos = self._file.tell()
+        pad = -pos % ALIGNMENT
+        if pad:
+            self._file.write(b"\0" * pad)
+        return pos + pad
+
+    def begin_blob(self, dtype, shape):
+        self._blob = {"offset": self._align(), "dtype": np.dtype(dtype).name,
+                      "shape": [int(d) for d in shape]}
+
+    def write(self, array):
+        """Appends a C-contiguous piece of the current blob."""
+        if array.dtype.name != self._blob["dtype"]:
+            raise ValueError(f"blob is {self._blob['dtype']}, got {array.dtype.name}")
+        self._file.write(memoryview(np.ascontiguousarray(array)).cast("B"))
+
+    def end_blob(self):
+        blob, self._blob = self._blob, None
+        blob["nbytes"] = self._file.tell() - blob["offset"]
+        return blob
+
+    def write_array(self, array):
+        """Writes a whole array as one blob and returns its index record."""
+        self.begin_blob(array.dtype, array.shape)
+        self.write(array)
+        return self.end_blob()
+
+    def add_tensor(self, entry):
+        """Records a tensor whose blobs have been written."""
+        self.tensors.append(entry)
+
+    def close(self):
+        if self._file.closed:
+            return
+        index = json.dumps({"model": self.model, "tensors": self.tensors}).encode("utf-8")
+        offset = self._align()
+        self._file.write(index)
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, ALIGNMENT, HEADER_SIZE,
+                                     len(self.tensors), offset, len(index)))
+        self._file.close()
+
+
+class AplBinFile:
+    """A memory-mapped ``.apl_bin`` file with lazy, zero-copy tensor access."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            # ACCESS_COPY: writable views for torch.from_numpy, while clean
+            # pages stay shared with the page cache (and other processes).
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        if len(self._map) < HEADER_SIZE:
+            raise ValueError(f"{path} is not an .apl_bin file")
+        magic, version, self.alignment, header_size, count, offset, nbytes = \
+            HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an .apl_bin file")
+        if version != VERSION:
+            raise ValueError(f"{path}: unsupported .apl_bin version {version}")
+        index = json.loads(self._map[offset:offset + nbytes].decode("utf-8"))
+        self.model = index.get("model")
+        self.index = OrderedDict((e["name"], e) for e in index["tensors"])
+        if len(self.index) != count:
+            raise ValueError(f"{path}: index lists {len(self.index)} of {count} tensors")
+        self._buffer = np.frombuffer(self._map, dtype=np.uint8)
+        self._tensors = {}
+
+    @property
+    def nbytes(self):
+        return len(self._map)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def _blob(self, record):
+        offset, nbytes = record["offset"], record["nbytes"]
+        view = self._buffer[offset:offset + nbytes]
+        return view.view(record["dtype"]).reshape(record["shape"])
+
+    def __getitem__(self, name):
+        """A NumPy view (unquantized) or PackedTensor (packed) over the file."""
+        tensor = self._tensors.get(name)
+        if tensor is None:
+            entry = self.index[name]
+            data = self._blob(entry["data"])
+            if "bits" in entry:
+                tensor = PackedTensor(data, entry["shape"], entry["bits"],
+                                      self._blob(entry["scales"]), self._blob(entry["zeros"]),
+                                      entry["group_size"], entry["symmetric"])
+            else:
+                tensor = data.reshape(entry["shape"])
+            self._tensors[name] = tensor
+        return tensor
+
+    def layers(self):
+        """Tensor names grouped by layer: {"blocks.0.fc": {"weight": name, ...}}."""
+        layers = OrderedDict()
+        for name in self.index:
+            layer, _, param = name.rpartition(".")
+            layers.setdefault(layer or param, {})[param] = name
+        return layers
+
+    def close(self):
+        self._tensors.clear()
+        self._buffer = None
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # views are still alive; the mapping closes with them
@@ -0,0 +1,376 @@
+"""Lexer and right-to-left parser for the AI-APL language.
+
+Source lines are turned into a small immutable AST. Parsing is pure and
+depends only on the source text, so parsed programs are memoised in a
+bounded LRU cache: replaying the same statement (scripts, the web UI,
+benchmarks) skips lexing and parsing entirely.
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple, Union
+
+# Maximum number of distinct source lines kept in the parse cache.
+PARSE_CACHE_SIZE = 4096
+
+# Studio commands. They take the whole line and have shell-like arguments,
+# e.g. ``Source models/demo.apl`` or ``Layer 'FC1' 'Linear' 1024 128``.
+COMMANDS = frozenset({"help", "Source", "LoadModel", "Run", "Layer", "Lazy", "Threads",
+                       "KVCache", "Profile"})
+
+# Primitive function glyphs recognised by the lexer. Which of them are
+# actually implemented is decided by the evaluator.
+FUNCTION_GLYPHS = frozenset("+-×÷*⍟⌈⌊|!○~∧∨⍲⍱<≤=≥>≠≡≢⍴⍳,⍪⌽⊖⍉↑↓⊂⊃⊆⌷⍋⍒⊤⊥∊⍷∪∩⌹⍎⍕⊣⊢")
+OPERATOR_GLYPHS = frozenset("/\\⌿⍀.∘¨⍨⍤⍣")
+# Reduce and scan: f/ and f\ along the last axis, f⌿ and f⍀ along the first.
+REDUCE_OPS = frozenset("/\\⌿⍀")
+
+
+class APLError(Exception):
+    """An error raised while parsing or evaluating APL code."""
+
+
+class APLSyntaxError(APLError):
+    """The source text could not be tokenized or parsed."""
+
+
+class Token(NamedTuple):
+    kind: str
+    value: object
+    pos: int
+
+
+# --- AST --------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class Num:
+    """A numeric literal: a scalar, or a vector written as a strand."""
+    values: Tuple[float, ...]
+    scalar: bool = True
+
+
+@dataclass(frozen=True)
+class Str:
+    value: str
+
+
+@dataclass(frozen=True)
+class Name:
+    name: str
+
+
+@dataclass(frozen=True)
+class Strand:
+    """A strand with an item that is not a scalar literal, e.g. ``A 1 B``."""
+    items: Tuple["Node", ...]
+
+
+@dataclass(frozen=True)
+class Prim:
+    """A primitive (or system) function, identified by its glyph."""
+    glyph: str
+
+
+@dataclass(frozen=True)
+class Derived:
+    """A function derived by an operator: ``f.g`` (inner product), ``∘.g``
+    (outer product, with ``left`` as Prim("∘")), or a reduce/scan ``f/``,
+    ``f\\``, ``f⌿``, ``f⍀`` with an optional ``[axis]``."""
+    op: str
+    left: Prim
+    right: Optional[Prim] = None
+    axis: Optional[int] = None
+
+    @property
+    def glyph(self):
+        right = self.right.glyph if self.right is not None else ""
+        axis = f"[{self.axis}]" if self.axis is not None else ""
+        return f"{self.left.glyph}{self.op}{right}{axis}"
+
+
+@dataclass(frozen=True)
+class Monadic:
+    fn: Union[Prim, Derived]
+    arg: "Node"
+
+
+@dataclass(frozen=True)
+class Dyadic:
+    fn: Union[Prim, Derived]
+    left: "Node"
+    right: "Node"
+
+
+@dataclass(frozen=True)
+class Assign:
+    name: str
+    value: "Node"
+
+
+@dataclass(frozen=True)
+class Command:
+    name: str
+    args: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class Program:
+    statements: Tuple["Node", ...]
+
+
+Node = Union[Num, Str, Name, Strand, Monadic, Dyadic, Assign, Command]
+
+
+# --- Lexer ------------------------------------------------------------------
+
+_NUMBER = re.compile(r"¯?(?:\d+\.?\d*|\.\d+)(?:[eE]¯?\d+)?")
+_NAME = re.compile(r"(?:⎕)?[A-Za-z_∆⍙][A-Za-z0-9_∆⍙]*|⎕")
+_COMMAND = re.compile(r"\s*([A-Za-z]+)(?:\s+(.*))?$", re.S)
+
+
+def _number(text: str) -> float:
+    return float(text.replace("¯", "-"))
+
+
+def tokenize(source: str):
+    """Splits a line into tokens. Raises APLSyntaxError on bad input."""
+    tokens = []
+    i, n = 0, len(source)
+    while i < n:
+        ch = source[i]
+        if ch.isspace():
+            i += 1
+        elif ch == "⍝":
+            break
+        elif ch in "'\"":
+            value, i = _scan_string(source, i)
+            tokens.append(Token("STR", value, i))
+        elif ch == "←":
+            tokens.append(Token("ASSIGN", ch, i))
+            i += 1
+        elif source.startswith("<-", i):
+            tokens.append(Token("ASSIGN", "<-", i))
+            i += 2
+        elif ch in "()[]⋄":
+            tokens.append(Token(ch, ch, i))
+            i += 1
+        elif ch == "." and not (i + 1 < n and source[i + 1].isdigit()):
+            tokens.append(Token("OP", ch, i))
+            i += 1
+        elif ch.isdigit() or ch in "¯.":
+            m = _NUMBER.match(source, i)
+            if not m:
+                raise APLSyntaxError(f"bad number at column {i + 1}")
+            tokens.append(Token("NUM", _number(m.group()), i))
+            i = m.end()
+        elif ch.isalpha() or ch in "_∆⍙⎕":
+            m = _NAME.match(source, i)
+            tokens.append(Token("NAME", m.group(), i))
+            i = m.end()
+        elif ch in FUNCTION_GLYPHS:
+            tokens.append(Token("FN", ch, i))
+            i += 1
+        elif ch in OPERATOR_GLYPHS:
+            tokens.append(Token("OP", ch, i))
+            i += 1
+        else:
+            raise APLSyntaxError(f"unexpected character {ch!r} at column {i + 1}")
+    return tokens
+
+
+def _scan_string(source: str, i: int):
+    quote = source[i]
+    out = []
+    i += 1
+    while i < len(source):
+        ch = source[i]
+        if ch == quote:
+            # A doubled quote is an escaped quote character.
+            if i + 1 < len(source) and source[i + 1] == quote:
+                out.append(quote)
+                i += 2
+                continue
+            return "".join(out), i + 1
+        out.append(ch)
+        i += 1
+    raise APLSyntaxError("unterminated string")
+
+
+def split_args(text: str) -> Tuple[str, ...]:
+    """Splits command arguments on whitespace, honouring quoted strings."""
+    args = []
+    i, n = 0, len(text)
+    while i < n:
+        if text[i].isspace():
+            i += 1
+        elif text[i] in "'\"":
+            value, i = _scan_string(text, i)
+            args.append(value)
+        else:
+            j = i
+            while j < n and not text[j].isspace():
+                j += 1
+            args.append(text[i:j])
+            i = j
+    return tuple(args)
+
+
+# --- Parser -----------------------------------------------------------------
+
+class _Parser:
+    """Recursive-descent parser producing right-associative APL trees.
+
+    APL has no precedence: a function takes everything to its right as its
+    right argument, so ``2 × 3 + 4`` is ``2 × (3 + 4)``.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self) -> Optional[Token]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> Token:
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def expect(self, kind: str):
+        tok = self.peek()
+        if tok is None or tok.kind != kind:
+            found = "end of line" if tok is None else repr(tok.value)
+            raise APLSyntaxError(f"expected {kind!r}, found {found}")
+        return self.take()
+
+    def statement(self):
+        tok = self.peek()
+        if (tok is not None and tok.kind == "NAME"
+                and self.pos + 1 < len(self.tokens)
+                and self.tokens[self.pos + 1].kind == "ASSIGN"):
+            self.pos += 2
+            return Assign(tok.value, self.expression())
+        return self.expression()
+
+    def expression(self):
+        if self.at_function():
+            fn = self.function()
+            return Monadic(fn, self.expression())
+        left = self.strand()
+        if self.at_end_of_expression():
+            return left
+        if not self.at_function():
+            tok = self.peek()
+            raise APLSyntaxError(f"unexpected {tok.value!r} at column {tok.pos + 1}")
+        fn = self.function()
+        return Dyadic(fn, left, self.expression())
+
+    def at_end_of_expression(self) -> bool:
+        tok = self.peek()
+        return tok is None or tok.kind in (")", "⋄")
+
+    def at_function(self) -> bool:
+        tok = self.peek()
+        if tok is None:
+            return False
+        if tok.kind == "FN":
+            return True
+        if tok.kind == "OP":
+            return tok.value == "∘" and self._op_at(self.pos + 1, ".")
+        return tok.kind == "NAME" and tok.value.startswith("⎕")
+
+    def _op_at(self, pos, value) -> bool:
+        return (pos < len(self.tokens) and self.tokens[pos].kind == "OP"
+                and self.tokens[pos].value == value)
+
+    def function(self):
+        tok = self.take()
+        fn = Prim(tok.value)
+        if tok.kind == "OP":  # ∘.g
+            self.take()
+            return Derived(".", fn, self._operand(tok))
+        if self._op_at(self.pos, "."):
+            dot = self.take()
+            return Derived(".", fn, self._operand(dot))
+        op = self.peek()
+        if op is not None and op.kind == "OP":
+            if op.value not in REDUCE_OPS:
+                raise APLSyntaxError(f"operator {op.value!r} is not supported")
+            self.take()
+            return Derived(op.value, fn, axis=self._axis())
+        return fn
+
+    def _axis(self):
+        # An optional axis: [k] with a literal non-negative integer k.
+        tok = self.peek()
+        if tok is None or tok.kind != "[":
+            return None
+        self.take()
+        tok = self.expect("NUM")
+        if tok.value < 0 or tok.value != int(tok.value):
+            raise APLSyntaxError(f"axis must be a non-negative integer, got {tok.value:g}")
+        self.expect("]")
+        return int(tok.value)
+
+    def _operand(self, op):
+        # The right operand of ``.``: a primitive function glyph.
+        tok = self.peek()
+        if tok is None or tok.kind != "FN":
+            raise APLSyntaxError(f"operator {op.value!r} at column {op.pos + 1} "
+                                 f"needs a function on its right")
+        return Prim(self.take().value)
+
+    def strand(self):
+        items = []
+        while True:
+            tok = self.peek()
+            if tok is None:
+                break
+            if tok.kind == "NUM":
+                items.append(Num((self.take().value,)))
+            elif tok.kind == "STR":
+                items.append(Str(self.take().value))
+            elif tok.kind == "NAME" and not tok.value.startswith("⎕"):
+                items.append(Name(self.take().value))
+            elif tok.kind == "(":
+                self.take()
+                items.append(self.expression())
+                self.expect(")")
+            else:
+                break
+        if not items:
+            tok = self.peek()
+            found = "end of line" if tok is None else repr(tok.value)
+            raise APLSyntaxError(f"expected a value, found {found}")
+        if len(items) == 1:
+            return items[0]
+        if all(isinstance(item, Num) and item.scalar for item in items):
+            return Num(tuple(item.values[0] for item in items), scalar=False)
+        return Strand(tuple(items))
+
+
+def _parse(source: str) -> Program:
+    m = _COMMAND.match(source)
+    if m and m.group(1) in COMMANDS:
+        rest = m.group(2) or ""
+        if not rest.lstrip().startswith(("←", "<-")):
+            return Program((Command(m.group(1), split_args(rest)),))
+
+    tokens = tokenize(source)
+    statements = []
+    parser = _Parser(tokens)
+    while parser.peek() is not None:
+        if parser.peek().kind == "⋄":
+            parser.take()
+            continue
+        statements.append(parser.statement())
+        tok = parser.peek()
+        if tok is not None and tok.kind != "⋄":
+            raise APLSyntaxError(f"unexpected {tok.value!r} at column {tok.pos + 1}")
+    return Program(tuple(statements))
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse(source: str) -> Program:
+    """Parses one line of source into a Program (cached by source text)."""
+    return _parse(source)
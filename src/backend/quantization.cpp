@@ -3,66 +3,259 @@
 #include <cmath>
 #include <algorithm>
 
+#if defined(_MSC_VER)
+#include <intrin.h>
+#endif
+
 // Simple 4-bit quantization simulation for demonstration
 // In a real scenario, this would use AVX2/AVX512 or CUDA kernels
+//
+// Built as a shared library (CMake target apl_quant, or
+// scripts/build_backend.py) and loaded from Python with ctypes, see
+// src/native.py. Each packed row takes (cols + 1) / 2 bytes.
 
-extern "C" {
+#if defined(_WIN32)
+#define APL_EXPORT __declspec(dllexport)
+#else
+#define APL_EXPORT __attribute__((visibility("default")))
+#endif
 
-    void quantize_4bit_cpu(const float* input, uint8_t* output, float* scales, int rows, int cols) {
-        // Pack 2 4-bit values into 1 byte
-        // Layout: Row-major
-        
-        for (int r = 0; r < rows; ++r) {
-            // Find max absolute value in row for scaling
-            float max_val = 0.0f;
-            for (int c = 0; c < cols; ++c) {
-                max_val = std::max(max_val, std::abs(input[r * cols + c]));
+namespace {
+
+    inline int popcount64(uint64_t v) {
+#if defined(_MSC_VER)
+        return static_cast<int>(__popcnt64(v));
+#else
+        return __builtin_popcountll(v);
+#endif
+    }
+
+    // Unpacks codes n0..n1 of a packed row into floats (high nibble first),
+    // minus the group's zero point.
+    inline void unpack_nibbles(const uint8_t* row, int n0, int n1, float zero, float* out) {
+        int n = n0;
+        if (n & 1) {
+            *out++ = static_cast<float>(row[n >> 1] & 0x0F) - zero;
+            ++n;
+        }
+        const uint8_t* src = row + (n >> 1);
+        const int pairs = (n1 - n) / 2;
+        for (int i = 0; i < pairs; ++i) {
+            const uint8_t b = src[i];
+            out[2 * i] = static_cast<float>(b >> 4) - zero;
+            out[2 * i + 1] = static_cast<float>(b & 0x0F) - zero;
+        }
+        if ((n1 - n) & 1) out[2 * pairs] = static_cast<float>(src[pairs] >> 4) - zero;
+    }
+
+    // Dot product with 8 independent partial sums so it vectorizes
+    // without -ffast-math.
+    inline float dot(const float* a, const float* b, int len) {
+        float part[8] = {0, 0, 0, 0, 0, 0, 0, 0};
+        int i = 0;
+        for (; i + 8 <= len; i += 8) {
+            for (int j = 0; j < 8; ++j) part[j] += a[i + j] * b[i + j];
+        }
+        float sum = 0.0f;
+        for (; i < len; ++i) sum += a[i] * b[i];
+        for (int j = 0; j < 8; ++j) sum += part[j];
+        return sum;
+    }
+
+    // K == 1 (decode): one dot product per (row, group) on unpacked codes.
+    void matvec_4bit_grouped(const uint8_t* w_packed, const float* scales, const float* zeros,
+                             int group_size, const float* x, float* y, int M, int N) {
+        const int row_bytes = (N + 1) / 2;
+        const int groups = (N + group_size - 1) / group_size;
+
+        std::vector<float> panel(group_size);
+        for (int m = 0; m < M; ++m) {
+            const uint8_t* row = w_packed + static_cast<size_t>(m) * row_bytes;
+            const float* s = scales + static_cast<size_t>(m) * groups;
+            const float* z = zeros + static_cast<size_t>(m) * groups;
+            float acc = 0.0f;
+            for (int g = 0; g < groups; ++g) {
+                const int n0 = g * group_size;
+                const int n1 = std::min(N, n0 + group_size);
+                unpack_nibbles(row, n0, n1, z[g], panel.data());
+                acc += s[g] * dot(panel.data(), x + n0, n1 - n0);
+            }
+            y[m] = acc;
+        }
+    }
+
+    // K > 1 (prefill / batched decode). X is first copied into a panel
+    // padded to a multiple of kColBlock columns. Then for each block of
+    // kRowBlock rows and each group, the codes of those rows are unpacked
+    // into a small float panel and multiplied against the X group panel in
+    // kRowBlock x kColBlock register tiles, so each row of X is loaded once
+    // per row block and reused from registers by all rows in the block.
+    void matmul_4bit_tiled(const uint8_t* w_packed, const float* scales, const float* zeros,
+                           int group_size, const float* x, float* y, int M, int N, int K) {
+        constexpr int kRowBlock = 4;
+        constexpr int kColBlock = 16;
+        const int row_bytes = (N + 1) / 2;
+        const int groups = (N + group_size - 1) / group_size;
+        const int kpad = (K + kColBlock - 1) / kColBlock * kColBlock;
+
+        std::vector<float> xp(static_cast<size_t>(N) * kpad, 0.0f);
+        for (int n = 0; n < N; ++n) {
+            std::copy(x + static_cast<size_t>(n) * K, x + static_cast<size_t>(n + 1) * K,
+                      &xp[static_cast<size_t>(n) * kpad]);
+        }
+
+        std::vector<float> panel(static_cast<size_t>(kRowBlock) * group_size, 0.0f);
+        std::vector<float> panel_t(panel.size());
+        std::vector<float> out(static_cast<size_t>(kRowBlock) * kpad);
+
+        for (int m0 = 0; m0 < M; m0 += kRowBlock) {
+            const int rows = std::min(kRowBlock, M - m0);
+            std::fill(out.begin(), out.end(), 0.0f);
+
+            for (int g = 0; g < groups; ++g) {
+                const int n0 = g * group_size;
+                const int len = std::min(N, n0 + group_size) - n0;
+                for (int r = 0; r < rows; ++r) {
+                    const uint8_t* row = w_packed + static_cast<size_t>(m0 + r) * row_bytes;
+                    const float zero = zeros[static_cast<size_t>(m0 + r) * groups + g];
+                    unpack_nibbles(row, n0, n0 + len, zero, &panel[static_cast<size_t>(r) * group_size]);
+                }
+                // Transpose to (n, row) so the tile loop reads codes contiguously.
+                for (int n = 0; n < len; ++n) {
+                    for (int r = 0; r < kRowBlock; ++r) {
+                        panel_t[static_cast<size_t>(n) * kRowBlock + r] = panel[static_cast<size_t>(r) * group_size + n];
+                    }
+                }
+
+                for (int kc = 0; kc < kpad; kc += kColBlock) {
+                    float acc[kRowBlock][kColBlock] = {};
+                    for (int n = 0; n < len; ++n) {
+                        const float* xv = &xp[static_cast<size_t>(n0 + n) * kpad + kc];
+                        const float* q = &panel_t[static_cast<size_t>(n) * kRowBlock];
+                        for (int r = 0; r < kRowBlock; ++r) {
+                            #pragma omp simd
+                            for (int j = 0; j < kColBlock; ++j) acc[r][j] += q[r] * xv[j];
+                        }
+                    }
+                    for (int r = 0; r < rows; ++r) {
+                        const float s = scales[static_cast<size_t>(m0 + r) * groups + g];
+                        float* o = &out[static_cast<size_t>(r) * kpad + kc];
+                        for (int j = 0; j < kColBlock; ++j) o[j] += s * acc[r][j];
+                    }
+                }
             }
-            
-            scales[r] = max_val / 7.0f; // 4-bit signed range is -7 to 7 (approx)
-            if (scales[r] == 0) scales[r] = 1.0f;
 
-            for (int c = 0; c < cols; c += 2) {
-                float v1 = input[r * cols + c];
-                float v2 = (c + 1 < cols) ? input[r * cols + c + 1] : 0.0f;
+            for (int r = 0; r < rows; ++r) {
+                std::copy(&out[static_cast<size_t>(r) * kpad], &out[static_cast<size_t>(r) * kpad] + K,
+                          y + static_cast<size_t>(m0 + r) * K);
+            }
+        }
+    }
 
-                int8_t q1 = static_cast<int8_t>(std::round(v1 / scales[r]));
-                int8_t q2 = static_cast<int8_t>(std::round(v2 / scales[r]));
+}
 
-                // Clamp to -7..7
-                q1 = std::max((int8_t)-7, std::min((int8_t)7, q1));
-                q2 = std::max((int8_t)-7, std::min((int8_t)7, q2));
+extern "C" {
 
-                // Pack: q1 in high nibble, q2 in low nibble (offset by 8 to make unsigned)
-                uint8_t packed = ((q1 + 8) << 4) | (q2 + 8);
-                output[r * (cols / 2) + (c / 2)] = packed;
+    // Group-wise asymmetric INT4 quantization, the format of PackedTensor
+    // .quantize(x, bits=4) in src/packed.py (and so of ⎕Q4): each row is
+    // split into groups of `group_size` with
+    //   scale = (max - min) / 15,  zero = -min / scale,
+    //   code = clamp(round_half_even(x / scale + zero), 0, 15)
+    // and packed 2 codes per byte, high nibble first. The arithmetic is
+    // done in the same float32 steps as the NumPy code, so both produce
+    // identical bytes. scales/zeros are rows x groups.
+    APL_EXPORT void quantize_4bit_grouped(const float* input, uint8_t* output, float* scales,
+                                          float* zeros, int rows, int cols, int group_size) {
+        const int row_bytes = (cols + 1) / 2;
+        const int groups = (cols + group_size - 1) / group_size;
+        for (int r = 0; r < rows; ++r) {
+            const float* x = input + static_cast<size_t>(r) * cols;
+            uint8_t* out = output + static_cast<size_t>(r) * row_bytes;
+            std::fill(out, out + row_bytes, 0);
+            for (int g = 0; g < groups; ++g) {
+                const int n0 = g * group_size;
+                const int n1 = std::min(cols, n0 + group_size);
+                float lo = x[n0], hi = x[n0];
+                for (int n = n0 + 1; n < n1; ++n) {
+                    lo = std::min(lo, x[n]);
+                    hi = std::max(hi, x[n]);
+                }
+                float scale = (hi - lo) / 15.0f;
+                float zero;
+                if (scale != 0.0f) {
+                    zero = -lo / scale;
+                } else {
+                    zero = -lo;
+                    scale = 1.0f;
+                }
+                scales[static_cast<size_t>(r) * groups + g] = scale;
+                zeros[static_cast<size_t>(r) * groups + g] = zero;
+                for (int n = n0; n < n1; ++n) {
+                    const float q = std::nearbyint(x[n] / scale + zero);
+                    const int code = static_cast<int>(std::min(15.0f, std::max(0.0f, q)));
+                    out[n >> 1] |= static_cast<uint8_t>((n & 1) ? code : code << 4);
+                }
             }
         }
     }
 
-    // Assembly-optimized placeholder (would be actual ASM in a .S file)
-    void matmul_4bit_fast(const uint8_t* w_packed, const float* scales, const float* x, float* y, int M, int N, int K) {
-        // M: Rows of W
-        // N: Cols of W (and rows of X)
-        // K: Cols of X (batch size, usually 1 for inference)
-        
-        // Naive implementation of dequantize-on-the-fly matmul
+    // Dequantize-on-the-fly matmul for group-quantized INT4 weights.
+    //
+    //   W: M x N packed codes (2 per byte, high nibble first), each row split
+    //      into groups of `group_size` with a scale and zero point:
+    //      w[m][n] = (code - zero[m][g]) * scale[m][g]
+    //   X: N x K row-major (K = number of input columns: 1 for decode,
+    //      the prompt length for prefill or the batch for batched decode)
+    //   Y: M x K row-major
+    //
+    // The scale is factored out of the inner loop:
+    //   sum_n w x = scale * sum_n (code - zero) * x
+    // and the zero point is subtracted as the codes are unpacked. (Folding
+    // it in afterwards, as scale * (sum code * x - zero * sum x), cancels
+    // two nearly equal sums and loses precision for large groups.)
+    APL_EXPORT void matmul_4bit_grouped(const uint8_t* w_packed, const float* scales, const float* zeros,
+                                        int group_size, const float* x, float* y, int M, int N, int K) {
+        if (K == 1) {
+            matvec_4bit_grouped(w_packed, scales, zeros, group_size, x, y, M, N);
+        } else {
+            matmul_4bit_tiled(w_packed, scales, zeros, group_size, x, y, M, N, K);
+        }
+    }
+
+    // Bit-serial dot products of bit-plane weights and activations (see
+    // src/bitplanes.py). Each operand is split into planes of one bit per
+    // element, packed 64 per word, and every group spans W whole words:
+    //   w: M x P x G x W words (row m, weight bit p, group g)
+    //   x: K x Q x G x W words (column k, activation bit q, group g)
+    //   s: M x K x G, s[m][k][g] = sum_p sum_q 2^(p+q) popcount(w_p & x_q)
+    // which is sum(code_w * code_x) over the group; the caller applies the
+    // scales and zero points.
+    APL_EXPORT void bitserial_dot_u64(const uint64_t* w, const uint64_t* x, int32_t* s,
+                                      int P, int Q, int M, int K, int G, int W) {
+        const size_t plane = static_cast<size_t>(G) * W;
         for (int m = 0; m < M; ++m) {
-            float sum = 0.0f;
-            float scale = scales[m];
-            
-            for (int n = 0; n < N; n += 2) {
-                uint8_t packed = w_packed[m * (N / 2) + (n / 2)];
-                
-                int8_t q1 = (packed >> 4) - 8;
-                int8_t q2 = (packed & 0x0F) - 8;
-                
-                sum += (q1 * scale) * x[n];
-                if (n + 1 < N) {
-                    sum += (q2 * scale) * x[n + 1];
+            const uint64_t* wm = w + static_cast<size_t>(m) * P * plane;
+            for (int k = 0; k < K; ++k) {
+                const uint64_t* xk = x + static_cast<size_t>(k) * Q * plane;
+                int32_t* out = s + (static_cast<size_t>(m) * K + k) * G;
+                std::fill(out, out + G, 0);
+                // Plane pairs outside, groups inside: the group loop runs
+                // over contiguous words and vectorizes.
+                for (int p = 0; p < P; ++p) {
+                    const uint64_t* wp = wm + p * plane;
+                    for (int q = 0; q < Q; ++q) {
+                        const uint64_t* xq = xk + q * plane;
+                        const int shift = p + q;
+                        for (int g = 0; g < G; ++g) {
+                            int32_t count = 0;
+                            for (int i = 0; i < W; ++i) {
+                                count += popcount64(wp[g * W + i] & xq[g * W + i]);
+                            }
+                            out[g] += count << shift;
+                        }
+                    }
                 }
             }
-            y[m] = sum;
         }
     }
 }
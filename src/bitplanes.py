@@ -0,0 +1,190 @@
+"""Bit-plane weights and the popcount (XNOR) matmul for 1/2-bit layers.
+
+A 1- or 2-bit PackedTensor is rearranged into bit-planes: plane ``p`` holds
+bit ``p`` of every code, packed 64 weights per uint64 word and padded so a
+word never straddles two quantization groups. Activations are quantized
+per column and group the same way, to ``act_bits`` unsigned codes
+(``act_bits == 1`` is the XNOR-Net sign binarization: each value becomes
+``±mean|x|`` of its group).
+
+The dot product of a weight row and an activation column over one group
+then needs only AND and popcount on whole words::
+
+    sum(c * u) = sum_p sum_q 2**(p+q) * popcount(W_p & X_q)
+
+and the scales and zero points are applied once per group::
+
+    sum(w * x) = sw * sx * (sum(c * u) - zx * sum(c) - zw * sum(u) + n * zw * zx)
+
+For 1-bit weights and activations this is the XNOR-popcount identity
+``sum(sign_w * sign_x) = n - 2 * popcount(w XOR x)``, written with AND so
+that padding bits and multi-bit planes need no special cases. One word op
+covers 64 multiply-adds, and weights take 1/32 (1-bit) or 1/16 (2-bit) of
+their fp32 size.
+
+``popcount_dot`` is the NumPy kernel (``np.bitwise_count`` on uint64
+words). The native backend has the same loop in C++ (src/native.py).
+"""
+import math
+
+import numpy as np
+
+try:
+    from .packed import quantize_groups
+except ImportError:
+    from packed import quantize_groups
+
+# Weight bit widths with a popcount kernel.
+PLANE_BITS = (1, 2)
+# Words in the (rows, K, groups, words) popcount intermediate per row block.
+BLOCK_ELEMENTS = 1 << 20
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:  # NumPy < 2.0: count through a byte table
+    _BYTE_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words):
+        counts = _BYTE_COUNTS[words.view(np.uint8)]
+        return counts.reshape(words.shape + (-1,)).sum(axis=-1, dtype=np.uint8)
+
+
+def _word_dtype(group_bytes):
+    # The widest word that tiles a group exactly.
+    for dtype in (np.uint64, np.uint32, np.uint16):
+        if group_bytes % np.dtype(dtype).itemsize == 0:
+            return dtype
+    return np.uint8
+
+
+def to_planes(codes, bits, group_size):
+    """(rows, cols) uint8 codes -> (rows, bits, groups, words) bit-planes."""
+    rows, cols = codes.shape
+    groups = max(1, math.ceil(cols / group_size))
+    group_bytes = (group_size + 7) // 8
+    pad = groups * group_size - cols
+    if pad:
+        codes = np.pad(codes, ((0, 0), (0, pad)))
+    codes = codes.reshape(rows, groups, group_size)
+    planes = np.empty((rows, bits, groups, group_bytes), dtype=np.uint8)
+    for p in range(bits):
+        planes[:, p] = np.packbits((codes >> p) & 1, axis=2, bitorder="little")
+    return planes.view(_word_dtype(group_bytes))
+
+
+def group_counts(planes):
+    """sum(codes) per (row, group): sum_p 2**p * popcount(plane p)."""
+    counts = _popcount(planes).sum(axis=-1, dtype=np.int32)
+    weights = (1 << np.arange(planes.shape[1], dtype=np.int32))[:, None]
+    return (counts * weights).sum(axis=1)
+
+
+def popcount_dot(w_planes, x_planes):
+    """sum(c * u) per (row, column, group) as int32, shape (M, K, G)."""
+    M, P, G, _ = w_planes.shape
+    K, Q = x_planes.shape[:2]
+    out = np.zeros((M, K, G), dtype=np.int32)
+    for p in range(P):
+        wp = w_planes[:, None, p]
+        for q in range(Q):
+            counts = _popcount(wp & x_planes[None, :, q]).sum(axis=-1, dtype=np.int32)
+            if p + q:
+                counts <<= p + q
+            out += counts
+    return out
+
+
+class ActivationPlanes:
+    """The columns of X (N, K), quantized per group and split into bit-planes."""
+
+    def __init__(self, x, bits, group_size):
+        cols = np.ascontiguousarray(x.T, dtype=np.float32)  # (K, N)
+        codes, self.scales, self.zeros = quantize_groups(cols, bits, group_size,
+                                                         symmetric=bits == 1)
+        self.planes = to_planes(codes, bits, group_size)
+        self.counts = group_counts(self.planes)
+
+
+class BitPlanes:
+    """A 1/2-bit weight matrix stored as bit-planes for popcount matmuls."""
+
+    def __init__(self, planes, shape, scales, zeros, group_size, act_bits=1):
+        self.planes = planes
+        self.shape = tuple(shape)
+        self.scales = np.ascontiguousarray(scales, dtype=np.float32)
+        self.zero_points = np.ascontiguousarray(zeros, dtype=np.float32)
+        self.group_size = group_size
+        self.act_bits = act_bits
+        self.counts = group_counts(planes)
+        # Real (unpadded) elements per group: the last one may be ragged.
+        groups = self.scales.shape[1]
+        self.sizes = np.full(groups, group_size, dtype=np.float32)
+        self.sizes[-1] = self.shape[1] - (groups - 1) * group_size
+
+    @classmethod
+    def from_packed(cls, w, act_bits=1):
+        if w.ndim != 2 or w.bits not in PLANE_BITS:
+            raise ValueError(f"bit-plane kernels need 2-D 1/2-bit weights, got {w!r}")
+        return cls(to_planes(w.codes(), w.bits, w.group_size), w.shape, w.scales,
+                   w.zero_points, w.group_size, act_bits)
+
+    @property
+    def bits(self):
+        return self.planes.shape[1]
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def nbytes(self):
+        return self.planes.nbytes + self.scales.nbytes + self.zero_points.nbytes
+
+    def __getitem__(self, rows):
+        """A row slice sharing the planes (used to shard the output rows)."""
+        view = object.__new__(BitPlanes)
+        view.__dict__.update(self.__dict__)
+        view.planes = self.planes[rows]
+        view.scales, view.zero_points = self.scales[rows], self.zero_points[rows]
+        view.counts = self.counts[rows]
+        view.shape = (view.scales.shape[0], self.shape[1])
+        return view
+
+    def __repr__(self):
+        return (f"BitPlanes(shape={list(self.shape)}, bits={self.bits}, "
+                f"act_bits={self.act_bits}, group_size={self.group_size})")
+
+    def activations(self, x):
+        """Quantizes x (N, K) to match these weights' groups."""
+        return ActivationPlanes(x, self.act_bits, self.group_size)
+
+    def matmul(self, acts, dot=popcount_dot):
+        """Y (M, K) = W @ X for quantized activations, one row block at a time.
+
+        ``dot(w_planes, x_planes)`` computes the popcount sums (popcount_dot
+        or the native kernel).
+        """
+        M = self.shape[0]
+        K, _, G, W = acts.planes.shape
+        y = np.empty((M, K), dtype=np.float32)
+        block = max(1, BLOCK_ELEMENTS // max(1, K * G * W))
+        for r0 in range(0, M, block):
+            rows = self[r0:r0 + block]
+            y[r0:r0 + block] = rows.combine(dot(rows.planes, acts.planes), acts)
+        return y
+
+    def combine(self, dots, acts):
+        """Y (M, K) from popcount_dot sums, applying scales and zero points.
+
+        Only the sum(c * u) term needs the full (M, K, G) array; the zero
+        point terms factor into three (M, G) @ (G, K) products.
+        """
+        sw, zw = self.scales, self.zero_points
+        sx, zx = acts.scales, acts.zeros
+        terms = dots.astype(np.float32)
+        terms *= sx[None]
+        y = np.matmul(terms, sw[:, :, None])[:, :, 0]
+        y -= (sw * self.counts) @ (sx * zx).T
+        y -= (sw * zw) @ (sx * acts.counts).T
+        y += (sw * zw * self.sizes) @ (sx * zx).T
+        return y
@@ -0,0 +1,151 @@
+"""Clipping calibration and quality reports for group-wise quantization.
+
+Quantizing a group over its full min..max range wastes levels on rare
+outliers. Clipping the range a little gives every other weight a finer
+step, which usually lowers the error, and more so at 1-2 bits and with
+large groups. ``search_clipping`` picks the clip ratio of each group from
+CLIP_RATIOS by trying each ratio on the whole matrix at once and keeping,
+per group, the one with the smallest error.
+
+The error is the squared weight error weighted by the mean square of each
+input feature over sample activations (``column_weights``). This is the
+layer's expected output error, assuming independent features. A weight
+that sees large activations is kept precise, and one that multiplies
+near-zero inputs can be clipped harder. Without activations every feature
+counts the same, so the search minimizes the plain weight MSE.
+
+``ErrorStats`` gathers a layer's reconstruction error block by block
+(the converter quantizes large tensors in row blocks), and
+``format_report`` prints one line per layer with its bytes per parameter.
+"""
+import math
+
+import numpy as np
+
+try:
+    from .packed import DEFAULT_GROUP_SIZE, quantize_groups
+except ImportError:
+    from packed import DEFAULT_GROUP_SIZE, quantize_groups
+
+# Candidate clip ratios, from the full range down to half of it.
+CLIP_RATIOS = tuple(round(1.0 - 0.05 * i, 2) for i in range(11))
+
+
+def column_weights(activations, cols):
+    """Mean square of each of ``cols`` input features over sample activations.
+
+    ``activations`` holds samples of the layer's input, shape (..., cols),
+    or an already reduced (cols,) vector of mean squares.
+    """
+    a = np.asarray(activations, dtype=np.float32)
+    if a.ndim == 1:
+        if a.shape[0] != cols:
+            raise ValueError(f"expected {cols} per-feature weights, got {a.shape[0]}")
+        return a
+    if a.shape[-1] != cols:
+        raise ValueError(f"activations have {a.shape[-1]} features, the layer takes {cols}")
+    a = a.reshape(-1, cols)
+    return np.einsum("ij,ij->j", a, a) / a.shape[0]
+
+
+def dequantize_groups(codes, scales, zeros, group_size=DEFAULT_GROUP_SIZE):
+    """Float values of unpacked (rows, cols) codes; inverse of quantize_groups."""
+    rows, cols = codes.shape
+    n_groups = scales.shape[1]
+    pad = n_groups * group_size - cols
+    c = np.pad(codes, ((0, 0), (0, pad))) if pad else codes
+    g = c.reshape(rows, n_groups, group_size).astype(np.float32)
+    g -= zeros[:, :, None]
+    g *= scales[:, :, None]
+    return g.reshape(rows, -1)[:, :cols]
+
+
+def group_errors(x, approx, group_size, weights=None):
+    """Per-group weighted squared error, shape (rows, n_groups)."""
+    rows, cols = x.shape
+    n_groups = max(1, math.ceil(cols / group_size))
+    err = np.square(x - approx)
+    if weights is not None:
+        err *= weights
+    pad = n_groups * group_size - cols
+    if pad:
+        err = np.pad(err, ((0, 0), (0, pad)))
+    return err.reshape(rows, n_groups, group_size).sum(axis=2)
+
+
+def search_clipping(x, bits, group_size=DEFAULT_GROUP_SIZE, symmetric=False, weights=None,
+                    ratios=CLIP_RATIOS):
+    """The clip ratio with the smallest error for each group, shape (rows, n_groups)."""
+    x = np.asarray(x, dtype=np.float32)
+    best_err = best = None
+    for ratio in ratios:
+        codes, scales, zeros = quantize_groups(x, bits, group_size, symmetric, clip=ratio)
+        err = group_errors(x, dequantize_groups(codes, scales, zeros, group_size), group_size,
+                           weights)
+        if best is None:
+            best_err, best = err, np.full(err.shape, ratio, dtype=np.float32)
+            continue
+        better = err < best_err
+        best_err[better] = err[better]
+        best[better] = ratio
+    return best
+
+
+def quantize_calibrated(x, bits, group_size=DEFAULT_GROUP_SIZE, symmetric=False,
+                        weights=None, calibrate=True):
+    """quantize_groups with each group's clip ratio chosen by search_clipping."""
+    clip = search_clipping(x, bits, group_size, symmetric, weights) if calibrate else None
+    return quantize_groups(x, bits, group_size, symmetric, clip)
+
+
+class ErrorStats:
+    """Reconstruction error of one tensor, accumulated over row blocks."""
+
+    def __init__(self):
+        self.params = 0
+        self.sq_error = 0.0
+        self.sq_signal = 0.0
+        self.max_error = 0.0
+        self.weighted_error = 0.0
+        self.weighted_signal = 0.0
+
+    def add(self, x, approx, weights=None):
+        diff = np.square(x - approx)
+        self.params += x.size
+        self.sq_error += float(diff.sum(dtype=np.float64))
+        self.sq_signal += float(np.square(x).sum(dtype=np.float64))
+        self.max_error = max(self.max_error, float(np.sqrt(diff.max(initial=0.0))))
+        if weights is not None:
+            self.weighted_error += float((diff * weights).sum(dtype=np.float64))
+            self.weighted_signal += float((np.square(x) * weights).sum(dtype=np.float64))
+
+    def summary(self, nbytes):
+        """A report row: errors, and ``nbytes`` (codes + scales + zeros) per parameter."""
+        params = max(self.params, 1)
+        row = {"params": self.params, "bytes": nbytes, "bytes_per_param": nbytes / params,
+               "rmse": math.sqrt(self.sq_error / params),
+               "relative_error": math.sqrt(self.sq_error / self.sq_signal)
+               if self.sq_signal else 0.0,
+               "max_error": self.max_error,
+               "snr_db": 10 * math.log10(self.sq_signal / self.sq_error)
+               if self.sq_error else math.inf}
+        if self.weighted_signal:
+            row["output_error"] = math.sqrt(self.weighted_error / self.weighted_signal)
+        return row
+
+
+def format_report(rows):
+    """A text table of ``{name: ErrorStats.summary()}`` rows, with totals."""
+    lines = [f"{'tensor':<44}{'params':>12}{'B/param':>9}{'rel err':>9}{'SNR dB':>8}"
+             f"{'out err':>9}"]
+    params = nbytes = 0
+    for name, r in rows.items():
+        out = f"{r['output_error']:>9.4f}" if "output_error" in r else f"{'-':>9}"
+        lines.append(f"{name:<44}{r['params']:>12,}{r['bytes_per_param']:>9.3f}"
+                     f"{r['relative_error']:>9.4f}{r['snr_db']:>8.1f}{out}")
+        params += r["params"]
+        nbytes += r["bytes"]
+    if params:
+        lines.append(f"{'total':<44}{params:>12,}{nbytes / params:>9.3f}"
+                     f"  ({nbytes / 2**20:.1f} MiB vs {params * 4 / 2**20:.1f} MiB fp32)")
+    return "\n".join(lines)
@@ -0,0 +1,265 @@
+"""Headless interpreter daemon on a local Unix socket.
+
+A long-lived process keeps interpreters, their models and the imported
+torch warm, so a client such as ``scripts/quick_run.py`` costs one
+round-trip instead of a full startup. Start it with::
+
+    python -m src.daemon [--socket PATH] [--max-sessions N] [--memory-mb MB]
+
+The protocol is JSON lines, one object per line in each direction. A
+request is::
+
+    {"id": 1, "session": "tinyllama", "code": "Run 'hi'",
+     "setup": "LoadModel 'tinyllama'", "stream": true}
+
+``session`` names an interpreter (default "default"); it is created on
+first use and kept until it is closed, evicted (LRU beyond
+``max_sessions``, or by the memory cap) or the daemon exits. ``setup`` is
+run only when the session is created, e.g. to load the model once. With
+``stream``, the output arrives first as ``{"id": 1, "piece": "..."}``
+lines. Every request ends with one reply::
+
+    {"id": 1, "output": "...", "layers": [...], "setup": "<setup output or null>"}
+    {"id": 1, "error": "..."}
+
+Other requests: ``{"op": "stats"}``, ``{"op": "close", "session": ...}``
+and ``{"op": "shutdown"}``. One connection may send many requests without
+waiting; they run concurrently and replies carry the request's ``id``.
+Each session runs on SessionHost (src/sessions.py), so evaluations for a
+session run in order and different sessions run in parallel.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import tempfile
+from collections import OrderedDict
+
+try:
+    from .sessions import SessionHost
+except ImportError:
+    from sessions import SessionHost
+
+DEFAULT_MAX_SESSIONS = 16
+
+
+def default_socket_path():
+    """$APL_DAEMON_SOCKET, or a per-user socket in the temp directory."""
+    path = os.environ.get("APL_DAEMON_SOCKET")
+    if path:
+        return path
+    user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), f"ai-apl-{user}.sock")
+
+
+class Daemon:
+    """Serves APL sessions to clients on a Unix socket."""
+
+    def __init__(self, path=None, max_sessions=DEFAULT_MAX_SESSIONS, memory_mb=None):
+        self.path = path or default_socket_path()
+        self.max_sessions = max_sessions
+        self.host = SessionHost(memory_mb)
+        self._recent = OrderedDict()  # session id -> None, least recently used first
+        self._setup_locks = {}
+        self._server = None
+        self._stopped = None
+        self._writers = set()
+        self.requests = 0
+
+    async def run(self):
+        """Serves until a shutdown request (or ``stop``)."""
+        if os.path.exists(self.path):
+            if DaemonClient.connect(self.path) is not None:
+                raise RuntimeError(f"a daemon is already listening on {self.path}")
+            os.unlink(self.path)  # left behind by a daemon that died
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        # Owner-only from the moment the socket exists: chmod after bind
+        # would leave a window for other local users to connect.
+        umask = os.umask(0o077)
+        try:
+            self._server = await asyncio.start_unix_server(self._client, self.path)
+        finally:
+            os.umask(umask)
+        try:
+            async with self._server:
+                await self._stopped.wait()
+                for writer in list(self._writers):
+                    writer.close()
+        finally:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            await asyncio.to_thread(self.host.shutdown)
+
+    def stop(self):
+        """Stops ``run`` (thread-safe)."""
+        self._loop.call_soon_threadsafe(self._stopped.set)
+
+    async def _client(self, reader, writer):
+        def send(message):
+            if not writer.is_closing():
+                writer.write(json.dumps(message).encode() + b"\n")
+
+        tasks = set()
+        self._writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    send({"id": None, "error": f"invalid JSON: {e}"})
+                    continue
+                task = asyncio.create_task(self._handle(request, send))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _handle(self, request, send):
+        rid = request.get("id")
+        op = request.get("op", "eval")
+        sid = str(request.get("session", "default"))
+        try:
+            if op == "eval":
+                send(await self._eval(rid, sid, request, send))
+            elif op == "close":
+                await self._close(sid)
+                send({"id": rid, "closed": sid})
+            elif op == "stats":
+                send({"id": rid, "sessions": list(self._recent), "requests": self.requests,
+                      "max_sessions": self.max_sessions})
+            elif op == "shutdown":
+                send({"id": rid, "stopping": True})
+                self._stopped.set()
+            else:
+                send({"id": rid, "error": f"unknown op {op!r}"})
+        except Exception as e:
+            send({"id": rid, "error": f"{type(e).__name__}: {e}"})
+
+    async def _eval(self, rid, sid, request, send):
+        self.requests += 1
+        setup = await self._ensure_session(sid, request.get("setup"))
+        code = str(request.get("code", ""))
+        if request.get("stream"):
+            loop = asyncio.get_running_loop()
+            emit = lambda piece: loop.call_soon_threadsafe(send, {"id": rid, "piece": piece})
+            value = await asyncio.to_thread(self.host.handle, "stream", sid, code, emit)
+        else:
+            value = await asyncio.to_thread(self.host.handle, "eval", sid, code, None)
+        for evicted in value.pop("evicted", ()):
+            self._forget(evicted)
+        return {"id": rid, **value, "setup": setup}
+
+    async def _ensure_session(self, sid, setup):
+        """Creates the session (running ``setup``) if it does not exist yet."""
+        lock = self._setup_locks.setdefault(sid, asyncio.Lock())
+        async with lock:
+            if sid in self.host.sessions:
+                self._recent.move_to_end(sid)
+                return None
+            self._recent[sid] = None
+            output = None
+            if setup:
+                value = await asyncio.to_thread(self.host.handle, "eval", sid, setup, None)
+                output = value["output"]
+            else:
+                await asyncio.to_thread(self.host.session, sid)
+        while len(self._recent) > self.max_sessions:
+            await self._close(next(iter(self._recent)))
+        return output
+
+    async def _close(self, sid):
+        self._forget(sid)
+        await asyncio.to_thread(self.host.close, sid)
+
+    def _forget(self, sid):
+        self._recent.pop(sid, None)
+        self._setup_locks.pop(sid, None)
+
+
+class DaemonClient:
+    """A blocking client for one daemon connection."""
+
+    def __init__(self, sock, path):
+        self.path = path
+        self._sock = sock
+        self._file = sock.makefile("rwb")
+        self._ids = itertools.count()
+
+    @classmethod
+    def connect(cls, path=None):
+        """A client, or None when no daemon is listening on ``path``."""
+        path = path or default_socket_path()
+        if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            return None
+        return cls(sock, path)
+
+    def request(self, on_piece=None, **fields):
+        """Sends one request and returns its final reply.
+
+        Streamed pieces are passed to ``on_piece``; an error reply raises
+        RuntimeError.
+        """
+        rid = next(self._ids)
+        self._file.write(json.dumps({"id": rid, **fields}).encode() + b"\n")
+        self._file.flush()
+        while True:
+            line = self._file.readline()
+            if not line:
+                raise RuntimeError("the daemon closed the connection")
+            reply = json.loads(line)
+            if reply.get("id") != rid:
+                continue
+            if "piece" in reply:
+                if on_piece is not None:
+                    on_piece(reply["piece"])
+                continue
+            if "error" in reply:
+                raise RuntimeError(reply["error"])
+            return reply
+
+    def eval(self, code, session="default", setup=None, on_piece=None):
+        """Evaluates ``code``; streams a Run's output to ``on_piece`` if given."""
+        return self.request(on_piece=on_piece, session=session, code=code, setup=setup,
+                            stream=on_piece is not None)
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve AI-APL interpreters on a Unix socket.")
+    parser.add_argument("--socket", default=None,
+                        help="socket path (default: $APL_DAEMON_SOCKET or a per-user temp file)")
+    parser.add_argument("--max-sessions", type=int, default=DEFAULT_MAX_SESSIONS)
+    parser.add_argument("--memory-mb", type=int, default=None,
+                        help="evict idle sessions while the daemon's RSS is above this")
+    args = parser.parse_args(argv)
+    daemon = Daemon(args.socket, args.max_sessions, args.memory_mb)
+    print(f"AI-APL daemon listening on {daemon.path}", flush=True)
+    try:
+        asyncio.run(daemon.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
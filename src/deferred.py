@@ -0,0 +1,38 @@
+"""Deferred imports of heavy modules.
+
+Importing torch costs seconds, and gradio or textual add more. Modules
+that do not need them to start bind a placeholder instead::
+
+    torch = Deferred("torch", globals())
+    engine = Deferred(".engine", globals())
+
+The first attribute access (``torch.tensor``) imports the module and
+rebinds the global name to it. After that, lookups go straight to the
+module with no extra cost. Relative names resolve against the caller's
+package, or as top-level modules when the caller runs from inside src/.
+"""
+import importlib
+
+
+class Deferred:
+    """A module that is imported on first attribute access."""
+
+    def __init__(self, name, namespace, alias=None):
+        self._name = name
+        self._namespace = namespace
+        self._alias = alias or name.rpartition(".")[2]
+
+    def _load(self):
+        name, package = self._name, self._namespace.get("__package__")
+        if name.startswith(".") and not package:
+            name = name[1:]
+        module = importlib.import_module(name, package or None)
+        if self._namespace.get(self._alias) is self:
+            self._namespace[self._alias] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return f"<deferred module {self._name!r}>"
@@ -0,0 +1,646 @@
+"""Forward-pass execution of the layer table (``APLInterpreter.layers``).
+
+Engine turns each layer dict into a module holding real weights and runs
+the modules in order. A layer's weights come from the mapped .apl_bin file
+when it has them (``layer["params"]``, or tensors named
+``"<layer>.<param>"``) and are used in place: fp32 tensors as torch views
+over the mapping, packed ones through the quantized matmul kernels.
+Layers without stored weights (presets, ``Layer`` declarations) get
+deterministic synthetic ones, seeded by layer and parameter name: random
+packed codes for quantized layers, scaled Gaussians for FP32 ones. Either
+way the compute is the real thing, at the real size.
+
+Activations never get a fresh tensor per call. Layer outputs alternate
+between two arena buffers, and layer internals (attention projections,
+MLP hidden states, kernel staging) use named scratch buffers shared by
+every layer of the same kind. Buffers only grow when a larger input
+shape is seen.
+
+TransformerBlock parameters (``<layer>.<param>``): attn_norm, wq, wk, wv,
+wo (dim x dim), mlp_norm, w_gate, w_up (hidden x dim) and w_down
+(dim x hidden) - a pre-norm block with rotary attention and a SwiGLU MLP.
+
+Token models decode through a PagedKVCache (src/kv_cache.py): each step
+feeds only the new tokens, and attention reads earlier keys/values from the
+cache instead of recomputing the whole sequence.
+"""
+import codecs
+import math
+import weakref
+import zlib
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+try:
+    from .bitplanes import PLANE_BITS, BitPlanes
+    from .kv_cache import DEFAULT_BUDGET_BYTES, PagedKVCache
+    from .packed import DEFAULT_GROUP_SIZE, PackedTensor
+except ImportError:
+    from bitplanes import PLANE_BITS, BitPlanes
+    from kv_cache import DEFAULT_BUDGET_BYTES, PagedKVCache
+    from packed import DEFAULT_GROUP_SIZE, PackedTensor
+
+# Matmul kernels a layer can select: "dequant" (dequantize + BLAS, exact)
+# or "xnor" (bit-plane popcount over quantized activations, 1/2-bit only).
+KERNELS = ("dequant", "xnor")
+NORM_EPS = 1e-5
+ROPE_BASE = 10000.0
+HEAD_DIM = 64
+
+# aten out= variants let conv/pool write straight into the arena.
+_CONV_OUT = hasattr(torch.ops.aten.convolution, "out")
+_POOL_OUT = hasattr(torch.ops.aten.max_pool2d_with_indices, "out")
+
+
+def encode(text, vocab):
+    """Byte-level tokenizer: UTF-8 bytes, folded into the vocabulary."""
+    return [b % vocab for b in text.encode("utf-8")] or [0]
+
+
+def decode(ids):
+    return bytes(i for i in ids if i < 256).decode("utf-8", errors="replace")
+
+
+class TextStream:
+    """Incremental ``decode``: the text each new token adds.
+
+    UTF-8 sequences split across tokens are held back until complete, so
+    the pieces (plus ``flush()``) always join up to ``decode(tokens)``.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def push(self, token):
+        return self._decoder.decode(bytes([token]) if token < 256 else b"")
+
+    def flush(self):
+        return self._decoder.decode(b"", final=True)
+
+
+def generation_summary(prompt_len, tokens, first_s, elapsed_s):
+    """The Run report for a generated sequence: the text, then its stats."""
+    return f"Output: {decode(tokens)}\n" + generation_stats(prompt_len, tokens, first_s,
+                                                            elapsed_s)
+
+
+def generation_stats(prompt_len, tokens, first_s, elapsed_s):
+    rate = len(tokens) / elapsed_s if elapsed_s > 0 else 0.0
+    return (f"Prompt: {prompt_len} tokens, generated {len(tokens)}: {tokens}\n"
+            f"First token: {first_s * 1000:.1f} ms | {rate:.2f} tokens/sec")
+
+
+def layer_bits(layer):
+    """Bit width of a layer's packed weights, or None for FP32."""
+    bits = layer.get("bits")
+    if bits is None:
+        tag = layer.get("quantization", "FP32")
+        bits = int(tag.split("-")[0]) if tag[:1].isdigit() else None
+    return bits
+
+
+class Scratch:
+    """Named, grow-only buffers reused across layers and calls."""
+
+    def __init__(self, device):
+        self.device = device
+        self.allocations = 0
+        self._buffers = {}
+
+    def get(self, key, shape, dtype=torch.float32):
+        n = math.prod(shape)
+        buf = self._buffers.get((key, dtype))
+        if buf is None or buf.numel() < n:
+            buf = self._buffers[(key, dtype)] = torch.empty(n, dtype=dtype, device=self.device)
+            self.allocations += 1
+        return buf[:n].view(shape)
+
+    @property
+    def nbytes(self):
+        return sum(b.numel() * b.element_size() for b in self._buffers.values())
+
+
+# Synthetic weights are a pure function of the layer, so engines in one
+# process (e.g. sessions in a worker) share them while any engine uses them.
+_SYNTHETIC = weakref.WeakValueDictionary()
+
+
+class Weights:
+    """Resolves one layer's parameters: stored tensors, else synthetic ones."""
+
+    def __init__(self, layer, store, device):
+        self.layer = layer
+        self.store = store
+        self.device = device
+        self.bits = layer_bits(layer)
+        self.params = layer.get("params", {})
+        self.kernel = layer.get("kernel") or "dequant"
+        self.act_bits = layer.get("act_bits") or 1
+        if self.kernel not in KERNELS:
+            raise ValueError(f"Layer {layer['name']}: unknown kernel {self.kernel!r} "
+                             f"(available: {', '.join(KERNELS)})")
+
+    def _stored(self, param):
+        if self.store is None:
+            return None
+        name = self.params.get(param, f"{self.layer['name']}.{param}")
+        return self.store[name] if name in self.store else None
+
+    def get(self, param, shape, init="normal", quantize=True):
+        """A tensor of ``shape``; PackedTensor when packed and ``quantize``.
+
+        ``init`` is the synthetic fallback: "normal", "ones", "zeros", or
+        None for an optional parameter (returns None when not stored).
+        """
+        value = self._stored(param)
+        if value is not None:
+            if tuple(value.shape) != tuple(shape):
+                raise ValueError(f"Layer {self.layer['name']}: {param} has shape "
+                                 f"{list(value.shape)}, expected {list(shape)}")
+            if isinstance(value, PackedTensor):
+                if quantize and len(shape) == 2:
+                    return value
+                return value.to_torch(device=self.device)
+            return torch.from_numpy(value).to(self.device, torch.float32)
+        if init is None:
+            return None
+        if init == "ones":
+            return torch.ones(shape, device=self.device)
+        if init == "zeros":
+            return torch.zeros(shape, device=self.device)
+        packed = bool(quantize and self.bits and len(shape) == 2)
+        key = (self.layer["name"], param, tuple(shape), self.bits if packed else None,
+               str(self.device))
+        value = _SYNTHETIC.get(key)
+        if value is None:
+            seed = zlib.crc32(f"{self.layer['name']}.{param}".encode("utf-8"))
+            if packed:
+                value = self._random_packed(shape, np.random.default_rng(seed))
+            else:
+                std = 1.0 / math.sqrt(math.prod(shape[1:]))
+                gen = torch.Generator().manual_seed(seed)
+                value = (torch.randn(shape, generator=gen) * std).to(self.device)
+            _SYNTHETIC[key] = value
+        return value
+
+    def matrix(self, param, shape):
+        """get() for a weight matrix, as BitPlanes for the xnor kernel."""
+        value = self.get(param, shape)
+        if self.kernel != "xnor":
+            return value
+        if not isinstance(value, PackedTensor) or value.bits not in PLANE_BITS:
+            bits = value.bits if isinstance(value, PackedTensor) else 32
+            raise ValueError(f"Layer {self.layer['name']}: the xnor kernel needs 1- or 2-bit "
+                             f"weights, {param} has {bits}")
+        return BitPlanes.from_packed(value, self.act_bits)
+
+    def _random_packed(self, shape, rng):
+        # Uniform codes around the midpoint, scaled to unit fan-in variance;
+        # built directly in packed form (no float copy of the matrix).
+        rows, cols = shape
+        bits = self.bits
+        levels = 1 << bits
+        row_bytes = (cols * bits + 7) // 8
+        groups = max(1, math.ceil(cols / DEFAULT_GROUP_SIZE))
+        code_std = math.sqrt((levels * levels - 1) / 12)
+        data = rng.integers(0, 256, size=(rows, row_bytes), dtype=np.uint8)
+        scales = np.full((rows, groups), 1.0 / (code_std * math.sqrt(cols)), dtype=np.float32)
+        zeros = np.full((rows, groups), (levels - 1) / 2, dtype=np.float32)
+        return PackedTensor(data, shape, bits, scales, zeros, DEFAULT_GROUP_SIZE)
+
+
+def _dims(layer, count, defaults=()):
+    """The layer's shape arguments as ints (``Layer`` passes strings)."""
+    try:
+        dims = [int(float(d)) for d in layer.get("shape", [])]
+    except (TypeError, ValueError):
+        raise ValueError(f"Layer {layer['name']}: shape must be numeric, got {layer['shape']}")
+    if len(dims) < count:
+        raise ValueError(f"Layer {layer['name']} ({layer['type']}) needs {count} "
+                         f"shape values, got {len(dims)}")
+    return dims + list(defaults[len(dims) - count:])
+
+
+def linear(x, w, bias, out, kernels, scratch):
+    """out = x @ w.T + bias for 2-D x/out; packed w uses the quantized kernels."""
+    if isinstance(w, (PackedTensor, BitPlanes)):
+        # The kernels compute W @ X column-wise: stage X^T and Y^T.
+        rows = x.shape[0]
+        xt = scratch.get("linear_in", (w.shape[1], rows))
+        yt = scratch.get("linear_out", (w.shape[0], rows))
+        xt.copy_(x.t())
+        if isinstance(w, BitPlanes):
+            kernels.matmul_bits(w, xt, out=yt)
+        else:
+            kernels.matmul_4bit(w, xt, out=yt)
+        out.copy_(yt.t())
+        if bias is not None:
+            out += bias
+    elif bias is not None:
+        torch.addmm(bias, x, w.t(), out=out)
+    else:
+        torch.mm(x, w.t(), out=out)
+    return out
+
+
+def rms_norm(x, weight, out):
+    torch.mul(x, torch.rsqrt(x.pow(2).mean(-1, keepdim=True) + NORM_EPS), out=out)
+    out *= weight
+    return out
+
+
+class Module:
+    """One layer: ``out_shape`` for planning and ``forward`` into ``out``."""
+
+    # False for pure views (Flatten): no output buffer is taken.
+    alloc = True
+
+    def __init__(self, layer):
+        self.name = layer["name"]
+        self.type = layer["type"]
+
+    def _expect(self, ok, message):
+        if not ok:
+            raise ValueError(f"Layer {self.name} ({self.type}): {message}")
+
+    def out_shape(self, shape):
+        return shape
+
+
+class Conv2d(Module):
+    def __init__(self, layer, weights, ctx):
+        super().__init__(layer)
+        self.cin, self.cout, self.k, self.stride, self.pad = _dims(layer, 3, (1, 0))[:5]
+        self.weight = weights.get("weight", (self.cout, self.cin, self.k, self.k), quantize=False)
+        self.bias = weights.get("bias", (self.cout,), init=None)
+
+    def out_shape(self, shape):
+        self._expect(len(shape) == 4 and shape[1] == self.cin,
+                     f"expects [N, {self.cin}, H, W], got {list(shape)}")
+        h, w = ((d + 2 * self.pad - self.k) // self.stride + 1 for d in shape[2:])
+        self._expect(h > 0 and w > 0, f"input {list(shape)} is smaller than the kernel")
+        return (shape[0], self.cout, h, w)
+
+    def forward(self, x, out):
+        s, p = [self.stride] * 2, [self.pad] * 2
+        if _CONV_OUT:
+            return torch.ops.aten.convolution.out(x, self.weight, self.bias, s, p, [1, 1],
+                                                  False, [0, 0], 1, out=out)
+        return out.copy_(F.conv2d(x, self.weight, self.bias, s, p))
+
+
+class ReLU(Module):
+    def forward(self, x, out):
+        return torch.clamp_min(x, 0, out=out)
+
+
+class MaxPool2d(Module):
+    def __init__(self, layer, weights, ctx):
+        super().__init__(layer)
+        dims = _dims(layer, 0)
+        self.k = dims[0] if dims else 2
+        self.stride = dims[1] if len(dims) > 1 else self.k
+        self.scratch = ctx.scratch
+
+    def out_shape(self, shape):
+        self._expect(len(shape) == 4, f"expects [N, C, H, W], got {list(shape)}")
+        h, w = ((d - self.k) // self.stride + 1 for d in shape[2:])
+        self._expect(h > 0 and w > 0, f"input {list(shape)} is smaller than the window")
+        return shape[:2] + (h, w)
+
+    def forward(self, x, out):
+        k, s = [self.k] * 2, [self.stride] * 2
+        if _POOL_OUT:
+            indices = self.scratch.get("pool_indices", out.shape, torch.int64)
+            torch.ops.aten.max_pool2d_with_indices.out(x, k, s, [0, 0], [1, 1], False,
+                                                       out=out, indices=indices)
+            return out
+        return out.copy_(F.max_pool2d(x, k, s))
+
+
+class Flatten(Module):
+    alloc = False
+
+    def out_shape(self, shape):
+        return (shape[0], math.prod(shape[1:]))
+
+    def forward(self, x, out):
+        return x.reshape(x.shape[0], -1)
+
+
+class Linear(Module):
+    def __init__(self, layer, weights, ctx):
+        super().__init__(layer)
+        self.fin, self.fout = _dims(layer, 2)[:2]
+        self.weight = weights.matrix("weight", (self.fout, self.fin))
+        self.bias = weights.get("bias", (self.fout,), init=None)
+        self.ctx = ctx
+
+    def out_shape(self, shape):
+        self._expect(shape[-1] == self.fin, f"expects {self.fin} features, got {shape[-1]}")
+        return shape[:-1] + (self.fout,)
+
+    def forward(self, x, out):
+        return linear(x.reshape(-1, self.fin), self.weight, self.bias,
+                      out.view(-1, self.fout), self.ctx.kernels, self.ctx.scratch).view(out.shape)
+
+
+class Embedding(Module):
+    def __init__(self, layer, weights, ctx):
+        super().__init__(layer)
+        self.vocab, self.dim = _dims(layer, 2)[:2]
+        self.weight = weights.get("weight", (self.vocab, self.dim))
+
+    def out_shape(self, shape):
+        return shape + (self.dim,)
+
+    def forward(self, ids, out):
+        flat = ids.reshape(-1)
+        rows = out.view(-1, self.dim)
+        if isinstance(self.weight, PackedTensor):
+            self.weight[flat.cpu().numpy()].to_torch(out=rows)
+        else:
+            torch.index_select(self.weight, 0, flat, out=rows)
+        return out
+
+
+class Norm(Module):
+    def __init__(self, layer, weights, ctx):
+        super().__init__(layer)
+        (self.dim,) = _dims(layer, 1)[:1]
+        self.weight = weights.get("weight", (self.dim,), init="ones", quantize=False)
+        self.bias = weights.get("bias", (self.dim,), init=None, quantize=False)
+
+    def forward(self, x, out):
+        if self.bias is not None:
+            return out.copy_(F.layer_norm(x, (self.dim,), self.weight, self.bias, NORM_EPS))
+        return rms_norm(x, self.weight, out)
+
+
+def _ffn_dim(dim):
+    # LLaMA sizing: 2/3 of 4*dim, rounded up to a multiple of 256.
+    return (8 * dim // 3 + 255) // 256 * 256
+
+
+class TransformerBlock(Module):
+    def __init__(self, layer, weights, ctx):
+        super().__init__(layer)
+        dims = _dims(layer, 1)
+        self.dim = dims[0]
+        self.hidden = dims[1] if len(dims) > 1 else _ffn_dim(self.dim)
+        self.heads = dims[2] if len(dims) > 2 else max(1, self.dim // HEAD_DIM)
+        self._expect(self.dim % self.heads == 0 and (self.dim // self.heads) % 2 == 0,
+                     f"{self.dim} is not divisible into {self.heads} even-sized heads")
+        self.head_dim = self.dim // self.heads
+        d, h = self.dim, self.hidden
+        get = weights.get
+        self.attn_norm = get("attn_norm", (d,), init="ones", quantize=False)
+        matrix = weights.matrix
+        self.wq, self.wk, self.wv, self.wo = (matrix(p, (d, d)) for p in ("wq", "wk", "wv", "wo"))
+        self.mlp_norm = get("mlp_norm", (d,), init="ones", quantize=False)
+        self.w_gate, self.w_up = matrix("w_gate", (h, d)), matrix("w_up", (h, d))
+        self.w_down = matrix("w_down", (d, h))
+        self.ctx = ctx
+
+    def out_shape(self, shape):
+        self._expect(len(shape) == 3 and shape[-1] == self.dim,
+                     f"expects [batch, tokens, {self.dim}], got {list(shape)}")
+        return shape
+
+    def _rope(self, x, positions):
+        # Rotary embedding on (B, H, T, head_dim), rotate-half convention.
+        half = self.head_dim // 2
+        freqs = ROPE_BASE ** (-torch.arange(half, device=x.device) / half)
+        angles = positions.to(x.device, torch.float32)[:, None] * freqs
+        cos, sin = angles.cos(), angles.sin()
+        x1, x2 = x[..., :half], x[..., half:]
+        return torch.cat((x1 * cos - x2 * sin, x2 * cos + x1 * sin), dim=-1)
+
+    def _heads(self, x, B, T):
+        return x.view(B, T, self.heads, self.head_dim).transpose(1, 2)
+
+    def attention(self, q, k, v, B, T):
+        """Causal self-attention for this call's tokens; returns (B, H, T, hd)."""
+        step = self.ctx.step
+        if step is None:
+            positions = torch.arange(T)
+            q, k = self._rope(self._heads(q, B, T), positions), self._rope(self._heads(k, B, T), positions)
+            return F.scaled_dot_product_attention(q, k, self._heads(v, B, T), is_causal=True)
+        # Cached decoding: store this step's keys/values in each sequence's
+        # pages, then attend over everything cached so far.
+        cache = self.ctx.cache
+        q, k, v = (t.view(B, T, self.heads, self.head_dim) for t in (q, k, v))
+        outputs = []
+        for b, (start, new_rows, all_rows) in enumerate(step):
+            positions = torch.arange(start, start + T)
+            qb = self._rope(q[b].transpose(0, 1), positions)
+            kb = self._rope(k[b].transpose(0, 1), positions)
+            cache.write(self.index, new_rows, kb.transpose(0, 1), v[b])
+            keys, values = cache.read(self.index, all_rows)
+            mask = None
+            if T > 1:
+                mask = torch.arange(start + T, device=q.device) <= positions.to(q.device)[:, None]
+            outputs.append(F.scaled_dot_product_attention(
+                qb, keys.transpose(0, 1), values.transpose(0, 1), attn_mask=mask))
+        return torch.stack(outputs)
+
+    def forward(self, x, out):
+        B, T, D = x.shape
+        kernels, scratch = self.ctx.kernels, self.ctx.scratch
+        rows, flat, res = B * T, x.reshape(-1, D), out.view(-1, D)
+        normed = rms_norm(flat, self.attn_norm, scratch.get("block_norm", (rows, D)))
+        q = linear(normed, self.wq, None, scratch.get("block_q", (rows, D)), kernels, scratch)
+        k = linear(normed, self.wk, None, scratch.get("block_k", (rows, D)), kernels, scratch)
+        v = linear(normed, self.wv, None, scratch.get("block_v", (rows, D)), kernels, scratch)
+        attn = scratch.get("block_attn", (B, T, D))
+        attn.view(B, T, self.heads, self.head_dim).copy_(
+            self.attention(q, k, v, B, T).transpose(1, 2))
+        linear(attn.view(rows, D), self.wo, None, res, kernels, scratch)
+        res += flat
+
+        normed = rms_norm(res, self.mlp_norm, normed)
+        gate = linear(normed, self.w_gate, None, scratch.get("block_gate", (rows, self.hidden)),
+                      kernels, scratch)
+        up = linear(normed, self.w_up, None, scratch.get("block_up", (rows, self.hidden)),
+                    kernels, scratch)
+        F.silu(gate, inplace=True)
+        gate *= up
+        down = linear(gate, self.w_down, None, scratch.get("block_down", (rows, D)),
+                      kernels, scratch)
+        res += down
+        return out
+
+
+MODULES = {
+    "Conv2d": Conv2d,
+    "ReLU": ReLU,
+    "MaxPool2d": MaxPool2d,
+    "Flatten": Flatten,
+    "Linear": Linear,
+    "Embedding": Embedding,
+    "Norm": Norm,
+    "TransformerBlock": TransformerBlock,
+}
+
+
+class Engine:
+    """Runs the layer table as one forward pass over real weights."""
+
+    def __init__(self, layers, kernels, store=None, device="cpu",
+                 kv_budget=DEFAULT_BUDGET_BYTES):
+        self.kernels = kernels
+        self.device = device
+        self.scratch = Scratch(device)
+        self.kv_budget = kv_budget
+        self._cache = None
+        # Per-sequence (start, new rows, all rows) while a cached step runs
+        self.step = None
+        self.modules = []
+        for layer in layers:
+            # Quant* types run the same module over packed weights.
+            cls = MODULES.get(layer["type"].removeprefix("Quant"))
+            if cls is None:
+                raise ValueError(f"Layer {layer['name']}: unsupported type {layer['type']} "
+                                 f"(supported: {', '.join(MODULES)})")
+            if cls in (ReLU, Flatten):
+                self.modules.append(cls(layer))
+            else:
+                self.modules.append(cls(layer, Weights(layer, store, device), self))
+        if not self.modules:
+            raise ValueError("The model has no layers")
+        self.blocks = [m for m in self.modules if isinstance(m, TransformerBlock)]
+        for index, block in enumerate(self.blocks):
+            block.index = index
+
+    @property
+    def cache(self):
+        """The KV cache for the TransformerBlocks (None without any)."""
+        if self._cache is None and self.blocks:
+            dims = {(b.heads, b.head_dim) for b in self.blocks}
+            if len(dims) > 1:
+                raise ValueError("TransformerBlocks with different head sizes cannot share a KV cache")
+            heads, head_dim = dims.pop()
+            self._cache = PagedKVCache(len(self.blocks), heads, head_dim,
+                                       self.kv_budget, device=self.device)
+        return self._cache
+
+    def kv_stats(self):
+        """PagedKVCache.stats(), or None before the first cached step."""
+        return self._cache.stats() if self._cache is not None else None
+
+    def set_kv_budget(self, budget_bytes):
+        """Changes the KV cache budget (dropping everything cached)."""
+        self.kv_budget = budget_bytes
+        self._cache = None
+
+    @property
+    def takes_tokens(self):
+        return isinstance(self.modules[0], Embedding)
+
+    @property
+    def vocab(self):
+        return self.modules[0].vocab
+
+    def plan(self, shape):
+        """Output shape for an input shape; raises ValueError if it does not fit."""
+        for module in self.modules:
+            shape = module.out_shape(tuple(shape))
+        return shape
+
+    def input_shape(self, batch=1):
+        """A valid input shape for batch inputs (tokens models: one token each)."""
+        first = self.modules[0]
+        if isinstance(first, Embedding):
+            return (batch, 1)
+        if isinstance(first, Conv2d):
+            # Smallest square image that makes every later layer line up.
+            for side in range(first.k, 1025):
+                try:
+                    shape = (batch, first.cin, side, side)
+                    self.plan(shape)
+                    return shape
+                except ValueError:
+                    continue
+            raise ValueError(f"No input size fits the layers after {first.name}")
+        if isinstance(first, (Linear, Norm)):
+            return (batch, getattr(first, "fin", getattr(first, "dim", 0)))
+        raise ValueError(f"Cannot infer the input of a {first.type} layer")
+
+    def forward(self, x, seq_ids=None, protect=()):
+        """Runs every layer; the result is a view valid until the next call.
+
+        With ``seq_ids`` (token models), ``x[b]`` continues cached sequence
+        ``seq_ids[b]``: its tokens are appended to the KV cache and attention
+        covers the cached prefix. Sequences in ``seq_ids`` and ``protect``
+        are never evicted to make room. If reserving any of them raises
+        CacheFull (or the pass fails), every sequence in the step is rolled
+        back to its cached length before the call.
+        """
+        before = {}  # seq_id -> cached length, None if it was not cached
+        try:
+            if seq_ids is not None and self.blocks:
+                cache = self.cache
+                keep = set(seq_ids).union(protect)
+                step = []
+                for seq_id, tokens in zip(seq_ids, x.tolist()):
+                    before.setdefault(seq_id, cache.length(seq_id) if seq_id in cache else None)
+                    start = cache.reserve(seq_id, tokens, protect=keep)
+                    step.append((start, cache.slots(seq_id, start, start + len(tokens)),
+                                 cache.slots(seq_id, 0, start + len(tokens))))
+                self.step = step
+            slot = 0
+            for module in self.modules:
+                if not module.alloc:
+                    x = module.forward(x, None)
+                    continue
+                out = self.scratch.get(("act", slot), module.out_shape(tuple(x.shape)))
+                x = module.forward(x, out)
+                slot ^= 1
+            return x
+        except BaseException:
+            for seq_id, length in before.items():
+                if length is None:
+                    self.cache.free(seq_id)
+                else:
+                    self.cache.truncate(seq_id, length)
+            raise
+        finally:
+            self.step = None
+
+    def generate(self, ids, max_new_tokens, seq_id=None):
+        """Greedy decoding; yields each new token id as it is produced.
+
+        The prompt is prefilled once and every later step feeds a single
+        token. A ``seq_id`` keeps the sequence cached after the call, so a
+        later prompt that extends it only prefills the new tokens.
+        """
+        cache = self.cache
+        owned = seq_id is None
+        if owned:
+            seq_id = object()
+        ids = list(ids)
+        feed = ids
+        if cache is not None:
+            # Reuse the cached prefix (at least one token must be fed).
+            cached = cache.tokens(seq_id)
+            common = 0
+            for a, b in zip(cached, ids[:-1]):
+                if a != b:
+                    break
+                common += 1
+            cache.truncate(seq_id, common)
+            feed = ids[common:]
+        try:
+            for _ in range(max_new_tokens):
+                tokens = torch.tensor([feed], dtype=torch.int64, device=self.device)
+                logits = self.forward(tokens, [seq_id])
+                token = int(torch.argmax(logits[0, -1]))
+                # Positions are independent without attention, so only the
+                # new token is ever fed after the prompt.
+                feed = [token]
+                yield token
+        finally:
+            if owned and cache is not None:
+                cache.free(seq_id)
@@ -1,27 +1,195 @@
-import torch
+import math
 import sys
-import platform
-import ctypes
 import os
-import numpy as np
+import threading
+import time
+
+try:
+    from .apl_parser import (APLError, Assign, Command, Derived, Dyadic, Monadic,
+                             Name, Num, Str, Strand, PARSE_CACHE_SIZE, REDUCE_OPS,
+                             parse)
+except ImportError:
+    from apl_parser import (APLError, Assign, Command, Derived, Dyadic, Monadic,
+                            Name, Num, Str, Strand, PARSE_CACHE_SIZE, REDUCE_OPS,
+                            parse)
+
+try:
+    from .deferred import Deferred
+except ImportError:
+    from deferred import Deferred
+
+try:
+    from .programs import ProgramCache
+except ImportError:
+    from programs import ProgramCache
+
+# torch and the modules built on it load on first use, so starting an
+# interpreter (or running help, Layer, Source ...) does not pay for them.
+torch = Deferred("torch", globals())
+primitives = Deferred(".primitives", globals())
+lazy_eval = Deferred(".lazy", globals(), alias="lazy_eval")
+packed = Deferred(".packed", globals())
+apl_bin = Deferred(".apl_bin", globals())
+engine_mod = Deferred(".engine", globals(), alias="engine_mod")
+kv_cache = Deferred(".kv_cache", globals())
+native = Deferred(".native", globals())
+parallel = Deferred(".parallel", globals())
+profiler_mod = Deferred(".profiler", globals(), alias="profiler_mod")
+operators = Deferred(".operators", globals())
+
+__version__ = "0.1"
+
+# Compiled Source'd scripts, shared by every interpreter in the process.
+PROGRAMS = ProgramCache(__version__)
+
+
+class Interrupted(APLError):
+    """Evaluation was cancelled with ``APLInterpreter.cancel()``."""
+
 
 class APLInterpreter:
-    def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    def __init__(self, lazy=False, threads=1, engines=None, engine_lock=None, max_threads=None):
+        self._device = None
         self.variables = {}
         self.layers = [] # Track model structure
-        self.backend = self._load_backend()
+        self.weights = None # Memory-mapped AplBinFile from LoadModel 'x.apl_bin'
+        self._engine = None # (layer signature, Engine) built on first Run
+        self.kv_budget_mb = 512 # KV cache memory bound for token models
+        # Engines shared with other interpreters (a worker's sessions, see
+        # src/sessions.py), keyed by model, and the lock their users hold
+        # around forward passes. Interpreters with the same layers then
+        # share one Engine, KV cache and batch.
+        self._shared_engines = engines
+        self.engine_lock = engine_lock or threading.RLock()
+        # Quantize/matmul kernels: the native library, or the torch fallback,
+        # with output rows sharded over `threads` worker threads. Loaded on
+        # first use (see the backend and kernels properties).
+        self._backend = self._kernels = None
+        self._backend_loaded = False
+        self._threads = threads
+        self._max_threads = max_threads
+        # Deferred evaluation: scalar primitives build a graph that is
+        # fused and run when the value is needed (see src/lazy.py).
+        self.lazy = lazy
+        self._fusion = None
+        # Set by cancel() from another thread; checked between statements,
+        # Source lines and generated tokens. The caller clears it.
+        self.interrupt = threading.Event()
+        # Statement and primitive timings while profiling (see src/profiler.py)
+        self.profiler = None
+        self.profiling = False
+        self._commands = {
+            "help": self._cmd_help,
+            "Source": self._cmd_source,
+            "LoadModel": self._cmd_load_model,
+            "Run": self._cmd_run,
+            "Layer": self._cmd_layer,
+            "Lazy": self._cmd_lazy,
+            "Threads": self._cmd_threads,
+            "KVCache": self._cmd_kv_cache,
+            "Profile": self._cmd_profile,
+        }
+        self._constants = {}
+        self._node_handlers = {
+            Num: self._eval_num,
+            Str: self._eval_str,
+            Name: self._eval_name,
+            Strand: self._eval_strand,
+            Monadic: self._eval_monadic,
+            Dyadic: self._eval_dyadic,
+        }
+        # Structural and system functions (scalar ones live in primitives.py)
+        self._monadic_fns = {
+            "⍳": self._iota,
+            "⍴": self._shape,
+            "⎕Q4": self._quantize_fn,
+            "⎕DQ": self._dequantize_fn,
+        }
+        self._dyadic_fns = {
+            "⍴": self._reshape,
+            "⎕QMM": self._qmatmul,
+        }
         
+    @property
+    def device(self):
+        if self._device is None:
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self._device
+
+    @property
+    def backend(self):
+        if not self._backend_loaded:
+            self._backend = self._load_backend()
+            self._backend_loaded = True
+        return self._backend
+
+    @property
+    def kernels(self):
+        if self._kernels is None:
+            self._kernels = parallel.ParallelKernels(self.backend or native.TorchBackend(),
+                                                     self._threads, self._max_threads)
+        return self._kernels
+
+    @property
+    def fusion(self):
+        if self._fusion is None:
+            self._fusion = lazy_eval.FusionCache()
+        return self._fusion
+
     def _load_backend(self):
-        # Try to load the compiled C++ backend
+        # Try to load the compiled C++ backend (build/libapl_quant.so etc.)
         try:
-            # This is a simplified loading mechanism. In a real package, 
-            # you'd import the module directly after pip installing it.
-            # For now, we check if a .so or .pyd exists in build/
-            return None 
-        except:
+            return native.load_backend()
+        except Exception:
             return None
 
+    def set_threads(self, n):
+        """Sets the thread pool size for the quantize/matmul kernels."""
+        self.kernels.set_threads(n)
+
+    def quantize_4bit(self, x):
+        """Quantizes a float matrix to group-wise packed INT4 (the ⎕Q4 format)."""
+        return self.kernels.quantize_4bit(x, packed.DEFAULT_GROUP_SIZE)
+
+    def matmul_4bit(self, w, x):
+        """Multiplies a packed (M, N) matrix by x of shape (N,) or (N, K)."""
+        return self.kernels.matmul_4bit(w, x)
+
+    def enable_profiling(self):
+        """Starts timing statements and primitives; returns the Profiler.
+
+        The handlers are swapped for timed wrappers, so there is no cost
+        when profiling is off. Timings accumulate until ``profiler.reset()``.
+        """
+        if self.profiler is None:
+            self.profiler = profiler_mod.Profiler(self.device)
+        if self.profiling:
+            return self.profiler
+        call, describe = self.profiler.call, profiler_mod.describe
+        exec_, force = self._exec, self._force
+        monadic, dyadic = self._eval_monadic, self._eval_dyadic
+
+        def profiled_force(value):
+            if isinstance(value, str) or not isinstance(value, lazy_eval.LazyArray):
+                return value
+            return call("fusion", "materialize", force, value)
+
+        self._exec = lambda node: call("statement", describe(node), exec_, node)
+        self._force = profiled_force
+        self._node_handlers[Monadic] = lambda node: call("monadic", node.fn.glyph, monadic, node)
+        self._node_handlers[Dyadic] = lambda node: call("dyadic", node.fn.glyph, dyadic, node)
+        self.profiling = True
+        return self.profiler
+
+    def disable_profiling(self):
+        """Restores the plain handlers; the recorded profile is kept."""
+        if self.profiling:
+            del self._exec, self._force
+            self._node_handlers[Monadic] = self._eval_monadic
+            self._node_handlers[Dyadic] = self._eval_dyadic
+            self.profiling = False
+        return self.profiler
+
     def get_python_version(self):
         return sys.version.split()[0]
         
@@ -29,58 +197,253 @@ class APLInterpreter:
         """Returns a list of layers for visualization."""
         return self.layers
 
-    def define_layer(self, name, type, shape):
-        """Defines a layer in the AI model structure."""
-        self.layers.append({
+    def define_layer(self, name, type, shape, bits=None, kernel=None, act_bits=None):
+        """Defines a layer in the AI model structure.
+
+        ``kernel="xnor"`` runs a 1/2-bit layer's matmuls on bit-planes with
+        activations quantized to ``act_bits`` (src/bitplanes.py).
+        """
+        # Quant* layers keep weights as packed INT4 (see src/packed.py)
+        if bits is None and "Quant" in type:
+            bits = 4
+        quantization = packed.describe_format(bits, packed.DEFAULT_GROUP_SIZE) if bits else "FP32"
+        layer = {
             "name": name,
             "type": type,
             "shape": shape,
-            "quantization": "4-bit FPTQ" if "Quant" in type else "FP32"
-        })
+            "bits": bits,
+            "quantization": quantization,
+        }
+        if kernel is not None:
+            layer["kernel"] = kernel
+            layer["act_bits"] = act_bits or 1
+            if kernel == "xnor":
+                layer["quantization"] += f", xnor kernel ({layer['act_bits']}-bit activations)"
+        self.layers.append(layer)
+
+    def load_weights(self, path):
+        """Maps an .apl_bin file and builds the layer table from its index.
+
+        No weights are read here: each tensor is a view over the mapping and
+        is paged in the first time its values are used.
+        """
+        start = time.perf_counter()
+        weights = apl_bin.AplBinFile(path)
+        if self.weights is not None:
+            self.weights.close()
+        self.weights = weights
+        self.layers = []
+        for name, params in weights.layers().items():
+            entries = {param: weights.index[tensor] for param, tensor in params.items()}
+            main = entries.get("weight") or next(iter(entries.values()))
+            self.define_layer(name, self._layer_type(name, main), main["shape"])
+            layer = self.layers[-1]
+            layer["params"] = params
+            if "bits" in main:
+                layer["quantization"] = packed.describe_format(main["bits"], main["group_size"],
+                                                        main["symmetric"])
+        ms = (time.perf_counter() - start) * 1000
+        return (f"Mapped {os.path.basename(path)}: {len(weights)} tensors in "
+                f"{len(self.layers)} layers, {weights.nbytes / 1e6:.1f} MB ({ms:.1f} ms).")
+
+    @staticmethod
+    def _layer_type(name, entry):
+        if "embed" in name.lower():
+            return "Embedding"
+        return {1: "Norm", 2: "Linear", 4: "Conv2d"}.get(len(entry["shape"]), "Tensor")
 
     def load_preset_model(self, name):
         name = name.lower()
         self.layers = [] # Clear existing
         
         if name == "tinyllama":
-            self.define_layer("Embed", "Embedding", [32000, 2048])
+            self.define_layer("Embed", "Embedding", [32000, 2048], bits=4)
             for i in range(22):
-                self.define_layer(f"Block{i}", "TransformerBlock", [2048])
-            self.define_layer("Head", "Linear", [2048, 32000])
+                self.define_layer(f"Block{i}", "TransformerBlock", [2048], bits=4)
+            self.define_layer("Head", "Linear", [2048, 32000], bits=4)
             return "Loaded TinyLlama (1.1B) structure."
             
         elif name == "mistral":
-            self.define_layer("Embed", "Embedding", [32000, 4096])
+            self.define_layer("Embed", "Embedding", [32000, 4096], bits=4)
             for i in range(32):
-                self.define_layer(f"Block{i}", "TransformerBlock", [4096])
-            self.define_layer("Head", "Linear", [4096, 32000])
+                self.define_layer(f"Block{i}", "TransformerBlock", [4096], bits=4)
+            self.define_layer("Head", "Linear", [4096, 32000], bits=4)
             return "Loaded Mistral (7B) structure."
             
         return f"Unknown preset: {name}. Try 'tinyllama' or 'mistral'."
 
     def run_inference(self, input_str):
+        return "".join(self.stream_inference(input_str))
+
+    def stream_inference(self, input_str):
+        """Runs inference, yielding the report as it is produced.
+
+        Token models yield the report header with the first token's text as
+        soon as the prompt is prefilled, then each new token's text, then
+        the timing lines. The pieces join up to the full report, so the
+        time to the first piece is the time to the first token.
+        """
         if not self.layers:
-            return "Error: No model loaded. Use 'LoadModel' or define layers first."
-        
-        # Simulate inference
-        # In a real implementation, this would tokenize input and run through self.layers
+            yield "Error: No model loaded. Use 'LoadModel' or define layers first."
+            return
+        try:
+            engine = self.get_engine()
+            if not engine.takes_tokens:
+                yield self.format_report(input_str, self._run_batch(engine, input_str))
+                return
+            # Greedy generation of MaxTokens tokens (default 16) after the
+            # prompt. The sequence stays in the KV cache, so a follow-up
+            # prompt that extends it only prefills what is new.
+            prompt = engine_mod.encode(input_str, engine.vocab)
+            start = time.perf_counter()
+            generator = engine.generate(prompt, max(1, self.setting("MaxTokens", 16)),
+                                        seq_id=f"Run-{id(self):x}")
+            with self.engine_lock:
+                tokens = [next(generator)]  # the prefill: errors surface before any output
+        except (ValueError, kv_cache.CacheFull) as e:
+            yield f"Error: {e}"
+            return
+        first = time.perf_counter() - start
+        text = engine_mod.TextStream()
+        yield self.format_report(input_str, "Output: ") + text.push(tokens[0])
+        try:
+            while True:
+                with self.engine_lock:  # one step at a time on a shared engine
+                    token = next(generator, None)
+                if token is None:
+                    break
+                self.check_interrupt()
+                tokens.append(token)
+                yield text.push(token)
+        except (ValueError, kv_cache.CacheFull) as e:
+            # A decode step can run out of pages after output has started.
+            yield text.flush() + f"\nError: {e}"
+            return
+        yield text.flush() + "\n" + engine_mod.generation_stats(len(prompt), tokens, first,
+                                                     time.perf_counter() - start)
+
+    def eval_stream(self, code):
+        """Like ``eval``, but yields progress as it is made.
+
+        A ``Run`` yields its output piece by piece and a ``Source`` yields
+        each line before running it. ``Interrupted`` propagates, so the
+        caller can tell a cancelled evaluation from a finished one.
+        """
+        command = self._lone_command(code)
+        if command is not None and command.name == "Run":
+            yield from self.stream_inference(" ".join(command.args))
+        elif command is not None and command.name == "Source" and command.args:
+            yield from self.stream_file(command.args[0])
+        else:
+            self.check_interrupt()
+            yield str(self.eval(code))
+
+    @classmethod
+    def run_text(cls, code):
+        """The argument of ``code`` if it is a lone ``Run`` command, else None."""
+        command = cls._lone_command(code)
+        if command is not None and command.name == "Run":
+            return " ".join(command.args)
+        return None
+
+    @staticmethod
+    def _lone_command(code):
+        try:
+            program = parse(code.strip())
+        except APLError:
+            return None
+        if len(program.statements) == 1 and isinstance(program.statements[0], Command):
+            return program.statements[0]
+        return None
+
+    def cancel(self):
+        """Asks the evaluation running on another thread to stop."""
+        self.interrupt.set()
+
+    def check_interrupt(self):
+        if self.interrupt.is_set():
+            raise Interrupted("Interrupted.")
+
+    def format_report(self, input_str, report):
+        """The Run output: a header about the model, then ``report``."""
         return f"Running inference on '{input_str}'...\n" \
                f"Device: {self.device}\n" \
-               f"Layers: {len(self.layers)}\n" \
-               f"Output: [Tensor 1x32000] (Simulated logits)"
+               f"Layers: {len(self.layers)}\n" + report
+
+    def get_engine(self):
+        """The forward-pass Engine for the current layers (rebuilt on change)."""
+        signature = (id(self.weights),) + tuple(
+            (l["name"], l["type"], tuple(map(str, l["shape"])), l.get("bits"), l.get("kernel"),
+             l.get("act_bits"))
+            for l in self.layers)
+        if self._engine is None or self._engine[0] != signature:
+            self._engine = None  # release the old weights first
+            with self.engine_lock:
+                self._engine = (signature, self._build_engine(signature))
+        return self._engine[1]
+
+    def _build_engine(self, signature):
+        if self._shared_engines is None:
+            return engine_mod.Engine(self.layers, self.kernels, self.weights, self.device,
+                                     kv_budget=self.kv_budget_mb << 20)
+        # Shared by model and KV budget: a KVCache change must not drop
+        # other interpreters' sequences.
+        key = signature + (self.kv_budget_mb,)
+        engine = self._shared_engines.get(key)
+        if engine is None:
+            engine = self._shared_engines[key] = engine_mod.Engine(
+                self.layers, self.kernels, self.weights, self.device,
+                kv_budget=self.kv_budget_mb << 20)
+        return engine
+
+    def setting(self, name, default):
+        """An integer setting from a workspace variable (e.g. MaxTokens)."""
+        value = self.variables.get(name)
+        return default if value is None else int(value)
+
+    def _run_batch(self, engine, text):
+        # A batch of BatchSize random samples (or `Run 'N'` for N samples).
+        batch = int(text) if text.strip().isdigit() else self.setting("BatchSize", 1)
+        shape = engine.input_shape(max(1, batch))
+        x = torch.randn(shape, device=self.device)
+        start = time.perf_counter()
+        with self.engine_lock:
+            y = engine.forward(x)
+            if self.device == "cuda":
+                torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+        top = int(torch.argmax(y[0].reshape(-1)))
+        return (f"Input: {list(shape)} -> Output: {list(y.shape)}\n"
+                f"Top index (sample 0): {top}\n"
+                f"{elapsed * 1000:.1f} ms | {shape[0] / elapsed:.1f} samples/sec")
 
     def run_file(self, filepath):
+        summary = ""
+        for summary in self.stream_file(filepath):
+            pass
+        return summary
+
+    def stream_file(self, filepath):
+        """Runs a file's commands, yielding each one before it runs, then a summary."""
         if not os.path.exists(filepath):
-            return f"File not found: {filepath}"
+            yield f"File not found: {filepath}"
+            return
             
-        count = 0
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#"):
-                    self.eval(line)
-                    count += 1
-        return f"Executed {count} commands from {filepath}"
+        program = PROGRAMS.load(filepath)
+        for count, line in enumerate(program.lines, 1):
+            self.check_interrupt()
+            yield f"[{count}] {line.source}\n"
+            self._exec_line(line)
+        yield f"Executed {len(program.lines)} commands from {filepath}"
+
+    def _exec_line(self, line):
+        # A compiled line (src/programs.py), evaluated like eval(line.source).
+        if line.error is not None:
+            return line.error
+        if line.layer is not None:
+            name, ltype, shape = line.layer
+            return self._cmd_layer((name, ltype) + tuple(shape))
+        return self._exec_program(line.program)
 
     def eval(self, code: str):
         code = code.strip()
@@ -88,105 +451,359 @@ class APLInterpreter:
         if not code:
             return ""
 
-        if code == "help":
-            return """
+        try:
+            program = parse(code)
+        except APLError as e:
+            return f"Syntax error: {e}"
+
+        return self._exec_program(program)
+
+    def _exec_program(self, program):
+        result = ""
+        try:
+            for statement in program.statements:
+                self.check_interrupt()
+                result = self._exec(statement)
+        except APLError as e:
+            return str(e)
+        return self._force(result)
+
+    def _exec(self, node):
+        if isinstance(node, Command):
+            return self._commands[node.name](node.args)
+        if isinstance(node, Assign):
+            self.variables[node.name] = self._force(self._eval_node(node.value))
+            return f"{node.name} assigned."
+        return self._eval_node(node)
+
+    # --- Commands -----------------------------------------------------------
+
+    def _cmd_help(self, args):
+        return """
 Commands:
   help        Show this help
   exit        Exit the studio
   
 APL Examples:
   2 3 ⍴ ⍳6    Create a 2x3 matrix with numbers 0-5
-  A + B       Add two tensors
+  A + B       Add two tensors (also - × ÷ * ⍟ ⌈ ⌊ | ! ○ = ≠ < ≤ > ≥ ∧ ∨ ~)
+  A +.× B     Inner product (matrix product; also ⌈.+ ∧.= ...)
+  A ∘.× B     Outer product (also ∘.- ∘.= ...)
+  +/ A        Reduce the last axis (⌈/ ×/ ...; ⌿ for the first, +/[k] for axis k)
+  +\\ A        Scan: running reductions (⍀ for the first axis, +\\[k] for axis k)
   
 AI Building:
   Layer 'Conv1' 'Conv2d' 64 3   Define a layer
   LoadModel 'tinyllama'         Load a preset model for testing
-  Run 'Hello world'             Run inference (simulated)
+  LoadModel 'model.apl_bin'     Map converted weights (scripts/convert_model.py)
+  Run 'Hello world'             Run a forward pass (tokens/sec or samples/sec)
   Source 'path/to/file.apl'     Run commands from a file
+
+Quantization:
+  W <- ⎕Q4 M                    Pack a matrix as group-wise INT4
+  W ⎕QMM X                      Multiply packed W by a vector/matrix
+  ⎕DQ W                         Dequantize packed weights
+  Layer 'FC' 'Linear' 512 256 bits=1 kernel=xnor [act_bits=1]
+                                1/2-bit layer on the XNOR/popcount kernel
+
+Performance:
+  Lazy on|off|compile           Fuse elementwise chains before running them
+  Threads N                     Shard quantized kernels over N threads
+  KVCache [MB]                  Show KV cache use, or set its memory budget
+  Profile on|off|reset          Time statements and primitives
+  Profile [report N]            Show the N hottest spans (default 15)
+  Profile trace 'out.json'      Export a Chrome trace (chrome://tracing)
             """
-            
-        # Handle Source: Source 'path'
-        if code.startswith("Source"):
-            parts = code.split()
-            if len(parts) >= 2:
-                path = parts[1].strip("'\"")
-                return self.run_file(path)
-
-        # Handle LoadModel: LoadModel 'name'
-        if code.startswith("LoadModel"):
-            parts = code.split()
-            if len(parts) >= 2:
-                name = parts[1].strip("'\"")
-                return self.load_preset_model(name)
-
-        # Handle Run: Run 'input'
-        if code.startswith("Run"):
-            # Extract input string
-            input_str = code[3:].strip().strip("'\"")
-            return self.run_inference(input_str)
-
-        # Handle Layer Definition: Layer 'Name' 'Type' ...
-        if code.startswith("Layer"):
-            parts = code.split()
-            if len(parts) >= 3:
-                name = parts[1].strip("'\"")
-                ltype = parts[2].strip("'\"")
-                shape = parts[3:]
-                self.define_layer(name, ltype, shape)
-                return f"Layer {name} ({ltype}) added to model structure."
-
-        # Handle assignment: A <- ...
-        if "<-" in code:
-            parts = code.split("<-")
-            var_name = parts[0].strip()
-            value_expr = parts[1].strip()
-            val = self._eval_expr(value_expr)
-            self.variables[var_name] = val
-            return f"{var_name} assigned."
-            
-        return self._eval_expr(code)
 
-    def _eval_expr(self, expr: str):
-        # Handle Reshape: A ⍴ B
-        # Check for ⍴ first because it might contain ⍳ on the right side
-        if "⍴" in expr:
-            parts = expr.split("⍴")
-            shape_str = parts[0].strip()
-            data_expr = parts[1].strip()
-            
-            # Parse shape "2 3" -> [2, 3]
+    def _cmd_source(self, args):
+        if not args:
+            return "Usage: Source 'path/to/file.apl'"
+        return self.run_file(args[0])
+
+    def _cmd_load_model(self, args):
+        if not args:
+            return "Usage: LoadModel 'name'"
+        if args[0].endswith(".apl_bin"):
+            if not os.path.exists(args[0]):
+                return f"File not found: {args[0]}"
             try:
-                shape = [int(x) for x in shape_str.split()]
-                
-                # Evaluate data
-                data = self._eval_expr(data_expr)
-                
-                # Reshape
-                if isinstance(data, torch.Tensor):
-                    return data.reshape(shape)
-            except:
-                pass # Fall through if parsing fails
-
-        # Handle Iota: ⍳N
-        if "⍳" in expr:
-            # Extract number
+                return self.load_weights(args[0])
+            except ValueError as e:
+                return f"Error: {e}"
+        return self.load_preset_model(args[0])
+
+    def _cmd_run(self, args):
+        return self.run_inference(" ".join(args))
+
+    def _cmd_lazy(self, args):
+        mode = args[0].lower() if args else ("off" if self.lazy else "on")
+        if mode not in ("on", "off", "compile"):
+            return "Usage: Lazy on|off|compile"
+        self.lazy = mode != "off"
+        compile = mode == "compile"
+        if compile != (self._fusion.compile if self._fusion is not None else False):
+            self._fusion = lazy_eval.FusionCache(compile=compile)
+        return f"Lazy evaluation {mode}."
+
+    def _cmd_threads(self, args):
+        if not args:
+            return (f"Threads: {self.kernels.threads} (kernels: {self.kernels.name}, "
+                    f"torch intra-op: {torch.get_num_threads()}, cores: {parallel.cpu_count()})")
+        try:
+            n = int(args[0])
+        except ValueError:
+            return "Usage: Threads N"
+        self.set_threads(n)
+        if self.kernels.threads < n:
+            return (f"Using {self.kernels.threads} threads for quantized kernels "
+                    f"(at most {self.kernels.max_threads} here).")
+        return f"Using {self.kernels.threads} threads for quantized kernels."
+
+    def _cmd_kv_cache(self, args):
+        if args:
             try:
-                n = int(expr.split("⍳")[1].strip())
-                return torch.arange(n, device=self.device)
-            except:
-                pass
-            
-        # Handle simple numbers
+                self.kv_budget_mb = int(args[0])
+            except ValueError:
+                return "Usage: KVCache [budget_mb]"
+            if self._shared_engines is not None:
+                self._engine = None  # the next Run picks the engine with this budget
+            elif self._engine is not None:
+                self._engine[1].set_kv_budget(self.kv_budget_mb << 20)
+            return f"KV cache budget set to {self.kv_budget_mb} MB."
+        st = self._engine[1].kv_stats() if self._engine is not None else None
+        if st is None:
+            return f"KV cache: empty (budget {self.kv_budget_mb} MB)"
+        return (f"KV cache: {st['sequences']} sequences, {st['tokens']} tokens, "
+                f"{st['pages_used']}/{st['pages_total']} pages of {st['page_size']} "
+                f"({st['budget_mb']:.0f} MB), {st['evictions']} evictions")
+
+    def _cmd_profile(self, args):
+        action = args[0].lower() if args else "report"
+        if action == "on":
+            self.enable_profiling()
+            return "Profiling on."
+        if action == "off":
+            self.disable_profiling()
+            return "Profiling off."
+        if self.profiler is None:
+            return "Profile: not started. Use 'Profile on'."
+        if action == "reset":
+            self.profiler.reset()
+            return "Profile reset."
+        if action == "report":
+            try:
+                return self.profiler.report(int(args[1]) if len(args) > 1 else 15)
+            except ValueError:
+                return "Usage: Profile report [N]"
+        if action == "trace" and len(args) > 1:
+            try:
+                count = self.profiler.save_chrome_trace(args[1])
+            except OSError as e:
+                return f"Error: {e}"
+            return f"Wrote {count} trace events to {args[1]}."
+        return "Usage: Profile on|off|reset|report [N]|trace 'file.json'"
+
+    def _cmd_layer(self, args):
+        usage = "Usage: Layer 'Name' 'Type' [shape...] [bits=N] [kernel=dequant|xnor] [act_bits=N]"
+        if len(args) < 2:
+            return usage
+        name, ltype = args[0], args[1]
+        shape, options = [], {}
+        for arg in args[2:]:
+            key, sep, value = arg.partition("=")
+            if not sep:
+                shape.append(arg)
+            elif key not in ("bits", "kernel", "act_bits"):
+                return f"Unknown Layer option: {key}\n{usage}"
+            else:
+                options[key] = value
         try:
-            if " " in expr:
-                # Array: 1 2 3
-                return torch.tensor([float(x) for x in expr.split()], device=self.device)
-            return torch.tensor(float(expr), device=self.device)
-        except:
-            pass
-            
-        # Handle variables
-        if expr in self.variables:
-            return self.variables[expr]
+            bits = int(options["bits"]) if "bits" in options else None
+            act_bits = int(options["act_bits"]) if "act_bits" in options else None
+        except ValueError:
+            return usage
+        if bits is not None and bits not in packed.SUPPORTED_BITS:
+            return f"Unsupported bit width: {bits} (use {', '.join(map(str, packed.SUPPORTED_BITS))})"
+        kernel = options.get("kernel")
+        if kernel is not None and kernel not in engine_mod.KERNELS:
+            return f"Unknown kernel: {kernel} (use {' or '.join(engine_mod.KERNELS)})"
+        if kernel == "xnor" and bits not in engine_mod.PLANE_BITS:
+            return "The xnor kernel needs bits=1 or bits=2"
+        self.define_layer(name, ltype, shape, bits, kernel, act_bits)
+        return f"Layer {name} ({ltype}) added to model structure."
+
+    # --- Expressions --------------------------------------------------------
+
+    def _eval_expr(self, expr: str):
+        """Evaluates a single expression given as source text."""
+        program = parse(expr)
+        if len(program.statements) != 1:
+            raise APLError(f"Unknown expression: {expr}")
+        return self._eval_node(program.statements[0])
+
+    def _eval_node(self, node):
+        return self._node_handlers[type(node)](node)
+
+    def _eval_num(self, node):
+        # Literals are immutable, so each distinct one is materialized once.
+        value = self._constants.get(node)
+        if value is None:
+            if len(self._constants) >= PARSE_CACHE_SIZE:
+                self._constants.clear()
+            data = node.values[0] if node.scalar else node.values
+            value = self._constants[node] = torch.tensor(data, device=self.device)
+        return value
+
+    def _eval_str(self, node):
+        return node.value
+
+    def _eval_name(self, node):
+        if node.name in self.variables:
+            return self.variables[node.name]
+        raise APLError(f"Unknown expression: {node.name}")
+
+    def _eval_strand(self, node):
+        items = [self._force(self._eval_node(item)) for item in node.items]
+        if not all(isinstance(item, torch.Tensor) and item.dim() == 0 for item in items):
+            raise APLError("Nested arrays are not supported")
+        return torch.stack([item.to(torch.float32) for item in items])
+
+    def _force(self, value):
+        """Materializes a pending lazy value; other values pass through."""
+        # (Command results are strings: no need to load the lazy module.)
+        if not isinstance(value, str) and isinstance(value, lazy_eval.LazyArray):
+            return self.fusion.materialize(value)
+        return value
+
+    def _array(self, value, glyph):
+        if isinstance(value, lazy_eval.LazyArray):
+            return value
+        if not isinstance(value, torch.Tensor):
+            raise APLError(f"DOMAIN ERROR: {glyph} expects a numeric array")
+        return value
+
+    def _scalar_call(self, key, fn, args):
+        if self.lazy:
+            pending = lazy_eval.defer(key, fn, args)
+            if pending is not None:
+                return pending
+        return fn(*[self._force(arg) for arg in args])
+
+    def _eval_monadic(self, node):
+        arg = self._eval_node(node.arg)
+        glyph = node.fn.glyph
+        fn = primitives.SCALAR_MONADIC.get(glyph)
+        if fn is not None:
+            return self._scalar_call(("m", glyph), fn, (self._array(arg, glyph),))
+        fn = self._monadic_fns.get(glyph)
+        if fn is None:
+            if isinstance(node.fn, Derived):
+                if node.fn.op in REDUCE_OPS:
+                    return self._eval_reduce(node.fn, arg)
+                raise APLError(f"VALENCE ERROR: {glyph} needs a left argument")
+            raise APLError(f"Primitive not implemented: {glyph}")
+        return fn(self._force(arg))
+
+    def _eval_dyadic(self, node):
+        right = self._eval_node(node.right)
+        left = self._eval_node(node.left)
+        glyph = node.fn.glyph
+        fn = primitives.SCALAR_DYADIC.get(glyph)
+        if fn is not None:
+            left, right = self._array(left, glyph), self._array(right, glyph)
+            primitives.check_conformable(glyph, left, right)
+            return self._scalar_call(("d", glyph), fn, (left, right))
+        fn = self._dyadic_fns.get(glyph)
+        if fn is None:
+            if isinstance(node.fn, Derived):
+                return self._eval_product(node.fn, left, right)
+            raise APLError(f"Primitive not implemented: {glyph}")
+        return fn(self._force(left), self._force(right))
+
+    def _eval_reduce(self, fn, arg):
+        # f/ f⌿ f\ f⍀, optionally with [axis] (src/operators.py)
+        arg = self._array(arg, fn.glyph)
+        dim = fn.axis
+        if dim is None:
+            dim = 0 if fn.op in "⌿⍀" else max(arg.dim() - 1, 0)
+        kind = operators.reduce if fn.op in "/⌿" else operators.scan
+        glyph, f = fn.glyph, fn.left.glyph
+        # Lazy mode records it as a graph node, so a compiled plan can fuse
+        # it with the elementwise chain that produces its argument.
+        return self._scalar_call(("r", glyph, dim), lambda t: kind(f, t, dim, glyph), (arg,))
+
+    def _eval_product(self, fn, left, right):
+        # A f.g B and A ∘.g B (src/operators.py)
+        if fn.op != ".":
+            raise APLError(f"NONCE ERROR: n-wise {fn.glyph} is not supported")
+        left, right = self._operand(left, fn.glyph), self._operand(right, fn.glyph)
+        if fn.left.glyph == "∘":
+            return operators.outer_product(fn.right.glyph, left, right)
+        return operators.inner_product(fn.left.glyph, fn.right.glyph, left, right, self.kernels)
+
+    def _operand(self, value, glyph):
+        # Arrays and packed weights (for +.×)
+        value = self._force(value)
+        if isinstance(value, packed.PackedTensor):
+            return value
+        return self._array(value, glyph)
+
+    def _iota(self, n):
+        n = self._array(n, "⍳")
+        if n.dim() > 1 or n.numel() != 1:
+            raise APLError("RANK ERROR: ⍳ expects a scalar")
+        count = n.item()
+        if not math.isfinite(count) or count < 0 or count != int(count):
+            raise APLError(f"DOMAIN ERROR: ⍳ expects a non-negative integer, got {count:g}")
+        return torch.arange(int(count), device=self.device)
+
+    def _shape(self, value):
+        return torch.tensor(list(self._operand(value, "⍴").shape), device=self.device)
+
+    def _quantize_fn(self, value):
+        # ⎕Q4 X: group-wise INT4 packed weights
+        value = self._array(value, "⎕Q4")
+        if value.dim() != 2:
+            raise APLError("RANK ERROR: ⎕Q4 expects a matrix")
+        if value.numel() == 0:
+            raise APLError("LENGTH ERROR: ⎕Q4 expects a non-empty matrix")
+        return self.quantize_4bit(value)
+
+    def _dequantize_fn(self, value):
+        # ⎕DQ W: packed weights back to a float tensor
+        if not isinstance(value, packed.PackedTensor):
+            raise APLError("DOMAIN ERROR: ⎕DQ expects packed weights")
+        return value.to_torch(device=self.device)
+
+    def _qmatmul(self, w, x):
+        # W ⎕QMM X: (M N) × (N) or (N K), dequantizing W on the fly
+        x = self._array(x, "⎕QMM")
+        if not isinstance(w, packed.PackedTensor):
+            w = self._array(w, "⎕QMM")
+        if w.ndim != 2 or x.dim() not in (1, 2) or x.shape[0] != w.shape[1]:
+            raise APLError(f"LENGTH ERROR: ⎕QMM on shapes {list(w.shape)} and {list(x.shape)}")
+        if isinstance(w, packed.PackedTensor):
+            return self.matmul_4bit(w, x)
+        return torch.matmul(w.to(torch.float32), x.to(torch.float32))
 
-        return f"Unknown expression: {expr}"
+    def _reshape(self, shape, data):
+        shape, data = self._array(shape, "⍴"), self._array(data, "⍴")
+        if shape.dim() > 1:
+            raise APLError("RANK ERROR: the left argument of ⍴ must be a vector")
+        dims = shape.reshape(-1).tolist()
+        if any(not math.isfinite(dim) or dim < 0 or dim != int(dim) for dim in dims):
+            raise APLError("DOMAIN ERROR: ⍴ expects non-negative integer lengths, got "
+                           + " ".join(f"{dim:g}" for dim in dims))
+        shape = [int(dim) for dim in dims]
+        count = 1
+        for dim in shape:
+            count *= dim
+        if data.numel() == count:
+            return data.reshape(shape)
+        flat = data.reshape(-1)
+        if flat.numel() == 0:
+            raise APLError("Cannot reshape an empty array")
+        if flat.numel() < count:
+            # APL reshape cycles through the data.
+            flat = flat.repeat((count + flat.numel() - 1) // flat.numel())
+        return flat[:count].reshape(shape)
@@ -0,0 +1,145 @@
+"""Paged key/value cache for autoregressive generation.
+
+All keys and values live in one pool allocated up front for a fixed memory
+budget, split into pages of ``page_size`` token slots. Page ``p`` holds the
+same token positions in every layer (rows ``p * page_size`` onwards of
+``k[layer]`` and ``v[layer]``). A sequence owns a list of pages (its
+page table) and grows a page at a time, so appending a token never copies
+or reallocates what is already cached.
+
+Sequences stay cached between calls (e.g. one per chat session) and share
+the pool. When a new page is needed and none is free, the least recently
+used sequence that is not part of the current step is evicted. Memory use
+is therefore bounded by the budget however many sessions are open.
+"""
+import math
+from collections import OrderedDict
+
+import torch
+
+DEFAULT_PAGE_SIZE = 16
+DEFAULT_BUDGET_BYTES = 512 << 20
+
+
+class CacheFull(MemoryError):
+    """No page could be freed for a sequence."""
+
+
+class _Sequence:
+    __slots__ = ("pages", "tokens")
+
+    def __init__(self):
+        self.pages = []
+        self.tokens = []  # token ids whose keys/values are cached
+
+
+class PagedKVCache:
+    """A fixed pool of KV pages shared by many sequences."""
+
+    def __init__(self, layers, heads, head_dim, budget_bytes=DEFAULT_BUDGET_BYTES,
+                 page_size=DEFAULT_PAGE_SIZE, device="cpu", dtype=torch.float32):
+        self.layers, self.heads, self.head_dim = layers, heads, head_dim
+        self.page_size = page_size
+        element = torch.tensor([], dtype=dtype).element_size()
+        self.page_bytes = 2 * layers * page_size * heads * head_dim * element
+        self.num_pages = budget_bytes // self.page_bytes
+        if self.num_pages < 1:
+            raise ValueError(f"KV cache budget of {budget_bytes} bytes is below one page "
+                             f"({self.page_bytes} bytes)")
+        shape = (layers, self.num_pages * page_size, heads, head_dim)
+        # Token slot s of page p is row p * page_size + s.
+        self.k = torch.empty(shape, dtype=dtype, device=device)
+        self.v = torch.empty(shape, dtype=dtype, device=device)
+        self._free = list(range(self.num_pages - 1, -1, -1))
+        self._seqs = OrderedDict()  # LRU order: oldest first
+        self.evictions = 0
+
+    # --- Sequences ----------------------------------------------------------
+
+    def __contains__(self, seq_id):
+        return seq_id in self._seqs
+
+    def tokens(self, seq_id):
+        """Token ids cached for ``seq_id`` (empty if unknown or evicted)."""
+        seq = self._seqs.get(seq_id)
+        return list(seq.tokens) if seq else []
+
+    def length(self, seq_id):
+        seq = self._seqs.get(seq_id)
+        return len(seq.tokens) if seq else 0
+
+    def truncate(self, seq_id, length):
+        """Drops cached positions from ``length`` on, returning spare pages."""
+        seq = self._seqs.get(seq_id)
+        if seq is None:
+            return
+        del seq.tokens[length:]
+        keep = math.ceil(length / self.page_size)
+        self._free.extend(reversed(seq.pages[keep:]))
+        del seq.pages[keep:]
+
+    def free(self, seq_id):
+        seq = self._seqs.pop(seq_id, None)
+        if seq is not None:
+            self._free.extend(reversed(seq.pages))
+
+    def reserve(self, seq_id, tokens, protect=()):
+        """Appends ``tokens`` to the sequence, growing its page table.
+
+        Returns the position of the first new token. Pages come from the
+        free list, else from evicting LRU sequences not in ``protect``.
+        """
+        # Nothing changes (no entry, no eviction) unless the tokens fit.
+        seq = self._seqs.get(seq_id)
+        start, held = (len(seq.tokens), len(seq.pages)) if seq else (0, 0)
+        need = math.ceil((start + len(tokens)) / self.page_size) - held
+        if held + need > self.num_pages:
+            raise CacheFull(f"{start + len(tokens)} tokens do not fit in the KV cache "
+                            f"({self.num_pages} pages of {self.page_size} tokens)")
+        if len(self._free) < need:
+            victims = [s for s in self._seqs if s != seq_id and s not in protect]
+            if len(self._free) + sum(len(self._seqs[s].pages) for s in victims) < need:
+                raise CacheFull(f"KV cache is full ({self.num_pages} pages of "
+                                f"{self.page_size} tokens)")
+            for victim in victims:  # oldest first
+                if len(self._free) >= need:
+                    break
+                self.free(victim)
+                self.evictions += 1
+        if seq is None:
+            seq = self._seqs[seq_id] = _Sequence()
+        self._seqs.move_to_end(seq_id)
+        seq.pages.extend(self._free.pop() for _ in range(need))
+        seq.tokens.extend(tokens)
+        return start
+
+    # --- Per-layer access ---------------------------------------------------
+
+    def slots(self, seq_id, start, stop):
+        """Pool rows of positions [start, stop) of a sequence."""
+        pages = torch.tensor(self._seqs[seq_id].pages, dtype=torch.int64)
+        positions = torch.arange(start, stop)
+        rows = pages[positions // self.page_size] * self.page_size + positions % self.page_size
+        return rows.to(self.k.device)
+
+    def write(self, layer, rows, k, v):
+        """Stores (T, heads, head_dim) keys/values at pool ``rows``."""
+        self.k[layer].index_copy_(0, rows, k)
+        self.v[layer].index_copy_(0, rows, v)
+
+    def read(self, layer, rows):
+        """Keys/values at pool ``rows`` as (T, heads, head_dim) tensors."""
+        return self.k[layer].index_select(0, rows), self.v[layer].index_select(0, rows)
+
+    # --- Introspection ------------------------------------------------------
+
+    @property
+    def nbytes(self):
+        return self.num_pages * self.page_bytes
+
+    def stats(self):
+        used = self.num_pages - len(self._free)
+        return {"sequences": len(self._seqs), "pages_used": used,
+                "pages_total": self.num_pages, "page_size": self.page_size,
+                "tokens": sum(len(s.tokens) for s in self._seqs.values()),
+                "evictions": self.evictions, "budget_mb": self.nbytes / (1 << 20)}
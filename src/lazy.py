@@ -0,0 +1,229 @@
+"""Deferred evaluation of elementwise APL expressions.
+
+In lazy mode the interpreter does not run scalar primitives immediately.
+Each one becomes a LazyArray node; a whole statement such as
+``A × B + C - D`` therefore turns into a small DAG that is executed in one
+go when the value is needed (printed, assigned, or passed to a non-fusible
+primitive such as ⍴).
+
+Execution plans are cached per graph signature (ops, wiring, and the
+shape/dtype/device of every leaf):
+
+* eager plans run the ops back to back, writing each result into a dead
+  temporary of the same shape and dtype where possible, so a chain of N
+  elementwise ops allocates one buffer instead of N;
+* compiled plans wrap the same function in ``torch.compile``, which fuses
+  the chain (and any reductions in it) into a single kernel.
+"""
+import math
+from collections import OrderedDict
+
+import torch
+
+# Max cached execution plans per FusionCache.
+PLAN_CACHE_SIZE = 256
+
+# Ops that have a torch ``out=`` variant with identical semantics when all
+# inputs already have the result dtype. Keys match LazyArray.key.
+INPLACE = {
+    ("d", "+"): torch.add,
+    ("d", "-"): torch.sub,
+    ("d", "×"): torch.mul,
+    ("d", "÷"): torch.true_divide,
+    ("d", "*"): torch.pow,
+    ("d", "⌈"): torch.maximum,
+    ("d", "⌊"): torch.minimum,
+    ("m", "-"): torch.neg,
+    ("m", "×"): torch.sign,
+    ("m", "÷"): torch.reciprocal,
+    ("m", "*"): torch.exp,
+    ("m", "⍟"): torch.log,
+    ("m", "⌈"): torch.ceil,
+    ("m", "⌊"): torch.floor,
+    ("m", "|"): torch.abs,
+}
+
+
+class LazyArray:
+    """A pending op whose inputs are tensors or other LazyArrays."""
+
+    __slots__ = ("key", "fn", "inputs", "shape", "dtype", "value")
+
+    def __init__(self, key, fn, inputs, shape, dtype):
+        self.key = key
+        self.fn = fn
+        self.inputs = inputs
+        self.shape = shape
+        self.dtype = dtype
+        self.value = None
+
+    def dim(self):
+        return len(self.shape)
+
+    def numel(self):
+        return math.prod(self.shape)
+
+    def __repr__(self):
+        return f"LazyArray({self.key}, shape={list(self.shape)}, dtype={self.dtype})"
+
+
+def _meta(x):
+    return torch.empty(x.shape, dtype=x.dtype, device="meta")
+
+
+def defer(key, fn, inputs):
+    """Records ``fn(*inputs)`` as a graph node.
+
+    Returns None when the result cannot be inferred without running the op
+    (data-dependent functions such as dyadic ○); the caller then evaluates
+    eagerly.
+    """
+    try:
+        out = fn(*[_meta(x) for x in inputs])
+    except Exception:
+        return None
+    return LazyArray(key, fn, tuple(inputs), tuple(out.shape), out.dtype)
+
+
+class _Plan:
+    """A linearized graph: runs ``steps`` over leaf tensors."""
+
+    def __init__(self, steps, inplace):
+        # steps: [(fn, refs, out_slot, dead_slots)], refs are (is_tmp, index)
+        self.steps = steps
+        self.allocations = sum(1 for step in steps if step[2] is None)
+        self.inplace = inplace
+
+    def __call__(self, *leaves):
+        tmps = [None] * len(self.steps)
+        for i, (fn, refs, out_slot, dead) in enumerate(self.steps):
+            args = [tmps[j] if is_tmp else leaves[j] for is_tmp, j in refs]
+            if out_slot is None:
+                tmps[i] = fn(*args)
+            else:
+                tmps[i] = fn(*args, out=tmps[out_slot])
+            for j in dead:
+                tmps[j] = None
+        return tmps[-1]
+
+
+class FusionCache:
+    """Materializes LazyArray graphs through cached execution plans."""
+
+    def __init__(self, compile=False, maxsize=PLAN_CACHE_SIZE):
+        self.compile = compile
+        self.maxsize = maxsize
+        self._plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self._plans.clear()
+
+    def materialize(self, value):
+        """Returns a concrete tensor for a LazyArray (tensors pass through)."""
+        if not isinstance(value, LazyArray):
+            return value
+        if value.value is not None:
+            return value.value
+
+        leaves, nodes, signature = _linearize(value)
+        signature = (self.compile,) + signature
+        plan = self._plans.get(signature)
+        if plan is None:
+            self.misses += 1
+            plan = self._build(nodes, [t.dtype for t in leaves])
+            self._plans[signature] = plan
+            if len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+        else:
+            self.hits += 1
+            self._plans.move_to_end(signature)
+
+        value.value = plan(*leaves)
+        # Drop the graph so materialized inputs can be freed.
+        value.inputs = ()
+        return value.value
+
+    def _build(self, nodes, leaf_dtypes):
+        if self.compile and hasattr(torch, "compile"):
+            eager = _build_plan(nodes, leaf_dtypes, inplace=False)
+            compiled = torch.compile(eager.__call__, dynamic=False)
+            return _CompiledPlan(compiled, eager)
+        return _build_plan(nodes, leaf_dtypes, inplace=True)
+
+
+class _CompiledPlan:
+    """torch.compile-d plan that falls back to eager if compilation fails."""
+
+    def __init__(self, compiled, eager):
+        self.compiled = compiled
+        self.eager = eager
+        self.allocations = eager.allocations
+        self.inplace = False
+
+    def __call__(self, *leaves):
+        if self.compiled is not None:
+            try:
+                return self.compiled(*leaves)
+            except Exception:
+                self.compiled = None
+        return self.eager(*leaves)
+
+
+def _linearize(root):
+    """Post-order walk: returns (leaf tensors, nodes, signature)."""
+    leaves, leaf_ids = [], {}
+    nodes, node_ids = [], {}
+
+    def visit(x):
+        if isinstance(x, LazyArray) and x.value is None:
+            if id(x) in node_ids:
+                return (True, node_ids[id(x)])
+            refs = tuple(visit(inp) for inp in x.inputs)
+            node_ids[id(x)] = len(nodes)
+            nodes.append((x, refs))
+            return (True, node_ids[id(x)])
+        t = x.value if isinstance(x, LazyArray) else x
+        if id(t) not in leaf_ids:
+            leaf_ids[id(t)] = len(leaves)
+            leaves.append(t)
+        return (False, leaf_ids[id(t)])
+
+    visit(root)
+    signature = (
+        tuple((node.key, refs) for node, refs in nodes),
+        tuple((tuple(t.shape), t.dtype, t.device) for t in leaves),
+    )
+    return leaves, nodes, signature
+
+
+def _build_plan(nodes, leaf_dtypes, inplace):
+    last_use = {}
+    for i, (_, refs) in enumerate(nodes):
+        for is_tmp, j in refs:
+            if is_tmp:
+                last_use[j] = i
+
+    steps = []
+    owned = set()  # temporaries that are fresh buffers (safe to overwrite)
+    for i, (node, refs) in enumerate(nodes):
+        fn, out_slot = node.fn, None
+        out_fn = INPLACE.get(node.key)
+        input_dtypes = [nodes[j][0].dtype if is_tmp else leaf_dtypes[j] for is_tmp, j in refs]
+        # The out= variants skip the bool -> int promotion done by the
+        # primitive table, so only use them on non-boolean inputs.
+        if (inplace and out_fn is not None
+                and torch.bool not in input_dtypes and node.dtype != torch.bool):
+            for (is_tmp, j), dtype in zip(refs, input_dtypes):
+                if (is_tmp and j in owned and last_use.get(j) == i
+                        and nodes[j][0].shape == node.shape and dtype == node.dtype):
+                    out_slot = j
+                    break
+        if out_slot is not None:
+            fn = out_fn
+        dead = tuple(sorted({j for is_tmp, j in refs if is_tmp and last_use.get(j) == i}))
+        steps.append((fn, refs, out_slot, dead))
+        if node.key != ("m", "+"):  # identity returns its argument
+            owned.add(i)
+    return _Plan(steps, inplace)
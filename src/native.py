@@ -0,0 +1,253 @@
+"""Quantization kernels: the compiled C++ backend and its torch fallback.
+
+The C++ backend (src/backend/quantization.cpp) is built as a shared
+library by ``python scripts/build_backend.py`` or the CMake ``apl_quant``
+target and loaded here with ctypes. Arguments are passed as raw pointers
+into the NumPy/torch buffers (no copies), and ctypes releases the GIL for
+the duration of each foreign call, so other Python threads keep running.
+
+When the library is not found, TorchBackend provides the same operations
+and the same packed format with vectorized torch/NumPy code.
+
+``quantize_4bit(x)`` produces the group-wise INT4 PackedTensor that
+``PackedTensor.quantize(x, bits=4)`` does, byte for byte: the format of
+``⎕Q4``, prototype.py and .apl_bin files. The native
+``quantize_4bit_grouped`` does it in one pass per row without the NumPy
+temporaries.
+
+Both backends implement ``matmul_4bit(w, x)`` for any PackedTensor ``w``
+of shape (M, N) and ``x`` of shape (N,) or (N, K), so prefill and batched
+decode multiply all K columns in one pass:
+
+* native: ``matmul_4bit_grouped`` unpacks one group of nibbles at a time
+  into a small float panel, reuses each panel of X across a block of rows,
+  and applies scale/zero once per group rather than per element;
+* torch: dequantizes a block of rows at a time into a reused panel buffer
+  and multiplies it with BLAS, so memory stays at one panel instead of the
+  full dequantized matrix.
+
+``matmul_bits(w, x)`` is the popcount kernel for 1/2-bit BitPlanes
+weights (src/bitplanes.py): NumPy ``bitwise_count`` over uint64 words, or
+``bitserial_dot_u64`` in the library. Libraries built before that kernel
+existed still load; they just use the NumPy loop (and likewise the NumPy
+quantizer without ``quantize_4bit_grouped``).
+"""
+import ctypes
+import glob
+import os
+import sys
+
+import numpy as np
+import torch
+
+try:
+    from .bitplanes import ActivationPlanes, popcount_dot
+    from .packed import DEFAULT_GROUP_SIZE, PackedTensor, pack_codes, quantize_groups
+except ImportError:
+    from bitplanes import ActivationPlanes, popcount_dot
+    from packed import DEFAULT_GROUP_SIZE, PackedTensor, pack_codes, quantize_groups
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Environment variable that points at a specific backend library.
+BACKEND_ENV = "APL_BACKEND_PATH"
+
+# Size of the dequantized weight panel used by the torch path.
+PANEL_BYTES = 4 << 20
+
+_u8_p = ctypes.POINTER(ctypes.c_uint8)
+_f32_p = ctypes.POINTER(ctypes.c_float)
+_i32_p = ctypes.POINTER(ctypes.c_int32)
+_u64_p = ctypes.POINTER(ctypes.c_uint64)
+
+
+def _library_names():
+    if sys.platform == "win32":
+        return ["apl_quant.dll"]
+    if sys.platform == "darwin":
+        return ["libapl_quant.dylib"]
+    return ["libapl_quant.so"]
+
+
+def find_library():
+    """Returns the path of the backend library, or None."""
+    path = os.environ.get(BACKEND_ENV)
+    if path:
+        return path if os.path.exists(path) else None
+    dirs = [os.path.join(ROOT, "build"), os.path.join(ROOT, "build", "Release"),
+            os.path.join(ROOT, "src", "backend"), ROOT]
+    if hasattr(sys, "_MEIPASS"):  # PyInstaller bundle
+        dirs.insert(0, sys._MEIPASS)
+    for d in dirs:
+        for name in _library_names():
+            candidate = os.path.join(d, name)
+            if os.path.exists(candidate):
+                return candidate
+        # `python setup.py build_ext --inplace` output
+        for candidate in glob.glob(os.path.join(d, "apl_backend*.so")) + \
+                glob.glob(os.path.join(d, "apl_backend*.pyd")):
+            return candidate
+    return None
+
+
+def load_backend():
+    """Loads the native backend; returns None if it is unavailable."""
+    path = find_library()
+    if path is None:
+        return None
+    try:
+        return NativeBackend(ctypes.CDLL(path), path)
+    except (OSError, AttributeError):
+        return None
+
+
+def _as_cpu_f32(x):
+    if isinstance(x, np.ndarray):
+        x = torch.from_numpy(x)
+    return x.detach().to("cpu", torch.float32).contiguous()
+
+
+def _group_buffers(rows, cols, group_size):
+    # Packed codes, scales and zero points of a group-wise INT4 tensor.
+    groups = max(1, -(-cols // group_size))
+    return (np.empty((rows, (cols + 1) // 2), dtype=np.uint8),
+            np.empty((rows, groups), dtype=np.float32),
+            np.empty((rows, groups), dtype=np.float32))
+
+
+class TorchBackend:
+    """Vectorized torch implementation of the backend kernels."""
+
+    name = "torch"
+
+    def quantize_4bit(self, x, group_size=DEFAULT_GROUP_SIZE):
+        """Group-wise INT4: the same PackedTensor as ``PackedTensor.quantize(x, bits=4)``."""
+        x = _as_cpu_f32(x)
+        shape = tuple(x.shape) if x.dim() else (1,)
+        x = x.reshape(-1, shape[-1])
+        data, scales, zeros = _group_buffers(*x.shape, group_size)
+        self.quantize_rows(x, data, scales, zeros, group_size)
+        return PackedTensor(data, shape, 4, scales, zeros, group_size)
+
+    def quantize_rows(self, x, data, scales, zeros, group_size):
+        """Quantizes rows of a contiguous float32 x into data/scales/zeros (in place)."""
+        codes, scales[:], zeros[:] = quantize_groups(x.numpy(), 4, group_size)
+        data[:] = pack_codes(codes, 4)
+
+    def matmul_4bit(self, w, x, out=None):
+        """y = dequant(w) @ x for a 2-D PackedTensor w and x of shape (N,) or (N, K).
+
+        ``out``, if given, is a contiguous (M, K) float32 tensor to write into.
+        """
+        M, N = w.shape
+        columns = x.to(torch.float32).reshape(N, -1)
+        y = out if out is not None else \
+            torch.empty((M, columns.shape[1]), dtype=torch.float32, device=x.device)
+        block = max(1, min(M, PANEL_BYTES // (4 * N)))
+        panel = torch.empty((block, N), dtype=torch.float32, device=x.device)
+        for r0 in range(0, M, block):
+            r1 = min(M, r0 + block)
+            rows = panel[:r1 - r0]
+            w[r0:r1].to_torch(out=rows)
+            torch.matmul(rows, columns, out=y[r0:r1])
+        return y.reshape((M,) + tuple(x.shape[1:]))
+
+    def rmatmul_4bit(self, x, w):
+        """y = x @ dequant(w) for x of shape (N,) or (K, N) and a 2-D PackedTensor w.
+
+        Packed weights on the right (APL's ``X +.× W``): blocks of w's rows
+        are dequantized into the panel and accumulated into y.
+        """
+        N, M = w.shape
+        rows = x.to(torch.float32).reshape(-1, N)
+        y = torch.zeros((rows.shape[0], M), dtype=torch.float32, device=x.device)
+        block = max(1, min(N, PANEL_BYTES // (4 * M)))
+        panel = torch.empty((block, M), dtype=torch.float32, device=x.device)
+        for r0 in range(0, N, block):
+            r1 = min(N, r0 + block)
+            w[r0:r1].to_torch(out=panel[:r1 - r0])
+            y.addmm_(rows[:, r0:r1], panel[:r1 - r0])
+        return y.reshape(tuple(x.shape[:-1]) + (M,))
+
+    def bit_dot(self, w_planes, x_planes):
+        return popcount_dot(w_planes, x_planes)
+
+    def matmul_bits(self, w, x, out=None):
+        """y = W @ x for BitPlanes w (M, N) and x of shape (N,) or (N, K).
+
+        x is quantized to ``w.act_bits`` per group first; it may also be
+        ActivationPlanes already quantized by the caller (shared by shards),
+        in which case the result is (M, K).
+        """
+        M, N = w.shape
+        acts = x
+        if not isinstance(x, ActivationPlanes):
+            acts = w.activations(_as_cpu_f32(x).reshape(N, -1).numpy())
+        y = torch.from_numpy(w.matmul(acts, self.bit_dot))
+        if out is not None:
+            y = out.copy_(y)
+        if isinstance(x, ActivationPlanes):
+            return y
+        return y.to(x.device).reshape((M,) + tuple(x.shape[1:]))
+
+
+class NativeBackend(TorchBackend):
+    """ctypes wrapper around the compiled quantization library."""
+
+    name = "native"
+
+    def __init__(self, lib, path):
+        self.lib = lib
+        self.path = path
+        lib.matmul_4bit_grouped.argtypes = [_u8_p, _f32_p, _f32_p, ctypes.c_int, _f32_p, _f32_p,
+                                            ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        lib.matmul_4bit_grouped.restype = None
+        # Optional: missing from libraries built before these kernels.
+        self.has_quantize = hasattr(lib, "quantize_4bit_grouped")
+        if self.has_quantize:
+            lib.quantize_4bit_grouped.argtypes = [_f32_p, _u8_p, _f32_p, _f32_p,
+                                                  ctypes.c_int, ctypes.c_int, ctypes.c_int]
+            lib.quantize_4bit_grouped.restype = None
+        self.has_bit_dot = hasattr(lib, "bitserial_dot_u64")
+        if self.has_bit_dot:
+            lib.bitserial_dot_u64.argtypes = [_u64_p, _u64_p, _i32_p] + [ctypes.c_int] * 6
+            lib.bitserial_dot_u64.restype = None
+
+    @staticmethod
+    def _ptr(t, kind):
+        return ctypes.cast(t.data_ptr(), kind)
+
+    def quantize_rows(self, x, data, scales, zeros, group_size):
+        if not self.has_quantize:
+            return super().quantize_rows(x, data, scales, zeros, group_size)
+        rows, cols = x.shape
+        self.lib.quantize_4bit_grouped(self._ptr(x, _f32_p), data.ctypes.data_as(_u8_p),
+                                       scales.ctypes.data_as(_f32_p), zeros.ctypes.data_as(_f32_p),
+                                       rows, cols, group_size)
+
+    def matmul_4bit(self, w, x, out=None):
+        if x.device.type != "cpu" or w.ndim != 2 or w.bits != 4:
+            return super().matmul_4bit(w, x, out)
+        M, N = w.shape
+        columns = x.to(torch.float32).reshape(N, -1).contiguous()
+        K = columns.shape[1]
+        y = out if out is not None else torch.empty((M, K), dtype=torch.float32)
+        data = np.ascontiguousarray(w.data)
+        scales = np.ascontiguousarray(w.scales, dtype=np.float32)
+        zeros = np.ascontiguousarray(w.zero_points, dtype=np.float32)
+        self.lib.matmul_4bit_grouped(data.ctypes.data_as(_u8_p), scales.ctypes.data_as(_f32_p),
+                                     zeros.ctypes.data_as(_f32_p), w.group_size,
+                                     self._ptr(columns, _f32_p), self._ptr(y, _f32_p), M, N, K)
+        return y.reshape((M,) + tuple(x.shape[1:]))
+
+    def bit_dot(self, w_planes, x_planes):
+        if not self.has_bit_dot or w_planes.dtype != np.uint64:
+            return super().bit_dot(w_planes, x_planes)
+        M, P, G, W = w_planes.shape
+        K, Q = x_planes.shape[:2]
+        w_planes = np.ascontiguousarray(w_planes)
+        x_planes = np.ascontiguousarray(x_planes)
+        out = np.empty((M, K, G), dtype=np.int32)
+        self.lib.bitserial_dot_u64(w_planes.ctypes.data_as(_u64_p), x_planes.ctypes.data_as(_u64_p),
+                                   out.ctypes.data_as(_i32_p), P, Q, M, K, G, W)
+        return out
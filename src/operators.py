@@ -0,0 +1,273 @@
+"""APL operators over torch tensors: inner and outer products, reduce and scan.
+
+``A f.g B`` combines the last axis of A with the first axis of B: every
+pair of a row of A and a column of B is joined elementwise with ``g`` and
+reduced with ``f``. ``A ∘.g B`` applies ``g`` to every pair of elements,
+giving a result of shape ``⍴A, ⍴B``.
+
+None of them loops over elements in Python:
+
+* ``+.×`` is a matrix product: one ``torch.matmul`` after flattening A to
+  (m, n) and B to (n, p). When an operand is packed 4-bit weights it goes
+  to the quantized kernels instead (``matmul_4bit``, or ``rmatmul_4bit``
+  for packed weights on the right);
+* other ``f.g``, e.g. ``⌈.+`` (max-plus) or ``∧.=`` (row matching),
+  apply ``g`` by broadcasting to an (m, n, p) block and reduce its middle
+  axis with ``f/`` (below), one torch reduction for ``+ × ⌈ ⌊ ∧ ∨``.
+  Blocks of rows are bounded by BLOCK_ELEMENTS;
+* ``∘.g`` is ``g`` on A reshaped to ``⍴A, 1 1 ...`` against B: a single
+  broadcast kernel.
+
+``f/`` reduces an axis right to left (``x0 f (x1 f (... f xn))``) and
+``f\\`` gives the reduction of every prefix. Both work on any axis in
+place: slices along ``dim`` are strided views, so nothing is transposed
+or copied first.
+
+* ``+ × ⌈ ⌊ ∧ ∨`` are one torch kernel (``sum``/``prod``/``amax``/
+  ``amin``/``all``/``any``, ``cumsum``/``cumprod``/``cummax``/``cummin``),
+  and so are ``-`` and ``÷``: their right fold is an alternating sum or
+  product, ``x0 - x1 + x2 - ...``;
+* other associative functions (``=`` and ``≠`` on booleans) reduce as a
+  tree: adjacent pairs combine in one kernel per level, so log2(n) kernels
+  instead of n. Scans use the same doubling (Hillis-Steele): after the
+  step with offset k each element holds the reduction of the 2k elements
+  ending at it;
+* the rest (``*``, ``|``, ``<`` ...) are not associative, so the order of
+  the fold is fixed. They still run one kernel per element of the axis,
+  each over the whole rest of the array.
+"""
+import math
+
+import torch
+
+try:
+    from .apl_parser import APLError
+    from .packed import PackedTensor
+    from .primitives import SCALAR_DYADIC, _num
+except ImportError:
+    from apl_parser import APLError
+    from packed import PackedTensor
+    from primitives import SCALAR_DYADIC, _num
+
+# Elements of the broadcast (rows, n, p) block of a generic inner product.
+BLOCK_ELEMENTS = 1 << 22
+
+# Scalar functions whose reduction along an axis is one torch kernel.
+REDUCTIONS = {
+    "+": lambda t, dim: torch.sum(_num(t), dim),
+    "×": lambda t, dim: torch.prod(_num(t), dim),
+    "⌈": lambda t, dim: torch.amax(_num(t), dim),
+    "⌊": lambda t, dim: torch.amin(_num(t), dim),
+    "∧": lambda t, dim: torch.all(t, dim),
+    "∨": lambda t, dim: torch.any(t, dim),
+}
+
+# Results of reducing an empty axis.
+IDENTITIES = {"+": 0, "-": 0, "×": 1, "÷": 1, "⌈": -math.inf, "⌊": math.inf,
+              "∧": True, "∨": False, "=": True, "≠": False, "|": 0, "*": 1, "!": 1,
+              "<": False, ">": False, "≤": True, "≥": True}
+
+
+def _scalar_fn(glyph, derived):
+    fn = SCALAR_DYADIC.get(glyph)
+    if fn is None:
+        raise APLError(f"DOMAIN ERROR: {derived} needs scalar functions, got {glyph}")
+    return fn
+
+
+def _matmul(a, b):
+    if a.is_floating_point() or b.is_floating_point():
+        dtype = torch.promote_types(a.dtype, b.dtype)
+        if not dtype.is_floating_point:
+            dtype = torch.get_default_dtype()
+        return torch.matmul(a.to(dtype), b.to(dtype))
+    a, b = _num(a), _num(b)
+    if a.device.type != "cpu":  # no integer GEMM on GPUs
+        return torch.matmul(a.double(), b.double()).round().to(torch.int64)
+    return torch.matmul(a, b)
+
+
+def _contract(f, g, a, b, derived):
+    # (m, n) f.g (n, p) -> (m, p) for scalar functions f and g.
+    if f == "+" and g == "×":
+        return _matmul(a, b)
+    join = _scalar_fn(g, derived)
+    m, n = a.shape
+    p = b.shape[1]
+    block = max(1, BLOCK_ELEMENTS // max(1, n * p))
+    if block >= m:
+        return reduce(f, join(a[:, :, None], b[None]), 1, derived)
+    return torch.cat([reduce(f, join(a[r0:r0 + block, :, None], b[None]), 1, derived)
+                      for r0 in range(0, m, block)])
+
+
+def inner_product(f, g, a, b, kernels=None):
+    """``a f.g b``; ``kernels`` runs +.× on packed operands (src/native.py)."""
+    derived = f"{f}.{g}"
+    if isinstance(a, PackedTensor) or isinstance(b, PackedTensor):
+        return _packed_product(derived, a, b, kernels)
+    if a.dim() == 0 and b.dim() == 0:
+        return _scalar_fn(g, derived)(a, b)  # f/ of one element is that element
+    # A scalar extends along the axis it is paired with.
+    if a.dim() == 0:
+        a = a.expand(b.shape[0])
+    if b.dim() == 0:
+        b = b.expand(a.shape[-1])
+    if a.shape[-1] != b.shape[0]:
+        raise APLError(f"LENGTH ERROR: {derived} on shapes {list(a.shape)} and {list(b.shape)}")
+    n = b.shape[0]
+    shape = tuple(a.shape[:-1]) + tuple(b.shape[1:])
+    # Explicit sizes rather than -1, which is ambiguous when n is 0.
+    m, p = math.prod(a.shape[:-1]), math.prod(b.shape[1:])
+    result = _contract(f, g, a.reshape(m, n), b.reshape(n, p), derived)
+    return result.reshape(shape)
+
+
+def _packed_product(derived, a, b, kernels):
+    if derived != "+.×":
+        raise APLError(f"DOMAIN ERROR: packed weights only support +.×, not {derived}")
+    if isinstance(a, PackedTensor) and isinstance(b, PackedTensor):
+        raise APLError("DOMAIN ERROR: +.× needs at most one packed operand")
+    if isinstance(a, PackedTensor):
+        # W +.× X: (M N) by (N) or (N K), the kernels' native orientation
+        if a.ndim != 2 or b.dim() not in (1, 2) or b.shape[0] != a.shape[1]:
+            raise APLError(f"LENGTH ERROR: +.× on shapes {list(a.shape)} and {list(b.shape)}")
+        return kernels.matmul_4bit(a, b)
+    # X +.× W: (N) or (K N) by (N M)
+    if b.ndim != 2 or a.dim() not in (1, 2) or a.shape[-1] != b.shape[0]:
+        raise APLError(f"LENGTH ERROR: +.× on shapes {list(a.shape)} and {list(b.shape)}")
+    return kernels.rmatmul_4bit(a, b)
+
+
+def outer_product(g, a, b):
+    """``a ∘.g b``: g on every pair, shape ``a.shape + b.shape``."""
+    if isinstance(a, PackedTensor) or isinstance(b, PackedTensor):
+        raise APLError(f"DOMAIN ERROR: ∘.{g} does not take packed weights")
+    fn = _scalar_fn(g, f"∘.{g}")
+    return fn(a.reshape(tuple(a.shape) + (1,) * b.dim()), b)
+
+
+# Scans that are one torch kernel.
+SCANS = {
+    "+": lambda t, dim: torch.cumsum(_num(t), dim),
+    "×": lambda t, dim: torch.cumprod(_num(t), dim),
+    "⌈": lambda t, dim: torch.cummax(_num(t), dim).values,
+    "⌊": lambda t, dim: torch.cummin(_num(t), dim).values,
+    "∧": lambda t, dim: torch.cumprod(t.bool().to(torch.uint8), dim).bool(),
+    "∨": lambda t, dim: torch.cumsum(t.bool().to(torch.uint8), dim) > 0,
+}
+
+
+def _alternating(t, dim):
+    # 1, -1, 1, ... along dim, shaped to broadcast against t.
+    signs = 1 - 2 * (torch.arange(t.shape[dim], device=t.device) % 2)
+    return signs.reshape((-1,) + (1,) * (t.dim() - dim - 1))
+
+
+def _pairs(t, dim):
+    # Views of the even and odd elements of the even-length prefix of dim.
+    n = t.shape[dim] // 2 * 2
+    even = [slice(None)] * t.dim()
+    odd = list(even)
+    even[dim], odd[dim] = slice(0, n, 2), slice(1, n, 2)
+    return t[tuple(even)], t[tuple(odd)]
+
+
+def _associative(f, t):
+    if f in REDUCTIONS:
+        return True
+    return f in ("=", "≠") and t.dtype == torch.bool
+
+
+def tree_reduce(fn, t, dim):
+    """Reduces ``dim`` with an associative ``fn`` in log2(n) pairwise steps."""
+    while t.shape[dim] > 1:
+        n = t.shape[dim]
+        combined = fn(*_pairs(t, dim))
+        if n % 2:
+            combined = torch.cat((combined, t.narrow(dim, n - 1, 1)), dim)
+        t = combined
+    return t.squeeze(dim)
+
+
+def tree_scan(fn, t, dim):
+    """Inclusive scan of ``dim`` with an associative ``fn`` in log2(n) steps."""
+    n, offset = t.shape[dim], 1
+    while offset < n:
+        tail = fn(t.narrow(dim, 0, n - offset), t.narrow(dim, offset, n - offset))
+        t = torch.cat((t.narrow(dim, 0, offset).to(tail.dtype), tail), dim)
+        offset *= 2
+    return t
+
+
+def _fold(fn, t, dim):
+    # Right fold: x0 f (x1 f (... f x(n-1))), one kernel per element of dim.
+    n = t.shape[dim]
+    result = t.select(dim, n - 1)
+    for i in range(n - 2, -1, -1):
+        result = fn(t.select(dim, i), result)
+    return result
+
+
+def _fold_scan(fn, x, dim):
+    # After step k, element i >= k holds x(i-k) f (... f xi); element k is done.
+    n, t = x.shape[dim], x
+    for k in range(1, n):
+        tail = fn(x.narrow(dim, 0, n - k), t.narrow(dim, k, n - k))
+        t = torch.cat((t.narrow(dim, 0, k), tail), dim)
+    return t
+
+
+def _check_axis(derived, t, dim):
+    if not 0 <= dim < t.dim():
+        raise APLError(f"AXIS ERROR: {derived} on rank {t.dim()}")
+
+
+def reduce(f, t, dim, derived=None):
+    """``f/`` along ``dim`` (``f/[dim]``): the axis is removed."""
+    derived = derived or f"{f}/"
+    # Results are always new tensors: lazy plans may write into them.
+    if t.dim() == 0:
+        return t.clone()
+    _check_axis(derived, t, dim)
+    n = t.shape[dim]
+    if n == 0:
+        identity = IDENTITIES.get(f)
+        if identity is None:
+            raise APLError(f"DOMAIN ERROR: {derived} of an empty axis: {f} has no identity")
+        shape = t.shape[:dim] + t.shape[dim + 1:]
+        return torch.full(shape, identity, device=t.device)
+    if n == 1:
+        return t.select(dim, 0).clone()
+    native = REDUCTIONS.get(f)
+    if native is not None:
+        return native(t, dim)
+    if f == "-":
+        return torch.sum(_num(t) * _alternating(t, dim), dim)
+    if f == "÷":
+        return torch.prod(torch.pow(t.to(torch.get_default_dtype()), _alternating(t, dim)), dim)
+    fn = _scalar_fn(f, derived)
+    if _associative(f, t):
+        return tree_reduce(fn, t, dim)
+    return _fold(fn, t, dim)
+
+
+def scan(f, t, dim, derived=None):
+    """``f\\`` along ``dim``: the reduction of every prefix, same shape as t."""
+    derived = derived or f"{f}\\"
+    if t.dim() == 0:
+        return t.clone()
+    _check_axis(derived, t, dim)
+    if t.shape[dim] <= 1:
+        return t.clone()
+    native = SCANS.get(f)
+    if native is not None:
+        return native(t, dim)
+    if f == "-":
+        return torch.cumsum(_num(t) * _alternating(t, dim), dim)
+    if f == "÷":
+        return torch.cumprod(torch.pow(t.to(torch.get_default_dtype()), _alternating(t, dim)), dim)
+    fn = _scalar_fn(f, derived)
+    if _associative(f, t):
+        return tree_scan(fn, t, dim)
+    return _fold_scan(fn, t, dim)
@@ -0,0 +1,296 @@
+"""Packed low-bit tensors (INT8/INT4/INT2/BIT1) with per-group scales.
+
+A PackedTensor stores integer codes densely: ``8 // bits`` codes per byte,
+first element in the most significant bits (the same nibble order as
+the kernels in src/backend/quantization.cpp). Each row (the last
+axis) is padded to a whole number of bytes so that row slices are plain
+byte-range views of the buffer.
+
+Rows are split into groups of ``group_size`` consecutive elements; each
+group has its own float32 ``scale`` and ``zero_point`` and dequantizes as::
+
+    value = (code - zero_point) * scale
+
+Only NumPy is required. Torch conversion is available when torch is
+installed; torch is only imported when a conversion needs it.
+"""
+import math
+import sys
+
+import numpy as np
+
+torch = None  # set by _torch() on first use
+
+
+def _torch():
+    """The torch module, imported on first use (None if not installed)."""
+    global torch
+    if torch is None:
+        try:
+            import torch as module
+        except ImportError:
+            return None
+        torch = module
+    return torch
+
+
+def _is_tensor(x):
+    # A torch tensor can only exist once torch has been imported.
+    return "torch" in sys.modules and isinstance(x, sys.modules["torch"].Tensor)
+
+DEFAULT_GROUP_SIZE = 64
+SUPPORTED_BITS = (1, 2, 4, 8)
+
+
+def describe_format(bits, group_size=DEFAULT_GROUP_SIZE, symmetric=False):
+    """Human-readable storage description, e.g. for the layer table."""
+    per_byte = 8 // bits
+    mode = "sym" if symmetric else "asym"
+    bytes_per_param = bits / 8 + 8 / group_size
+    return (f"{bits}-bit packed ({per_byte}/byte, group {group_size}, {mode}, "
+            f"{bytes_per_param:.3g} B/param)")
+
+
+def _row_bytes(cols, bits):
+    return (cols * bits + 7) // 8
+
+
+def pack_codes(codes, bits):
+    """Packs uint8 codes of shape (rows, cols) into (rows, row_bytes)."""
+    if bits == 8:
+        return np.ascontiguousarray(codes, dtype=np.uint8)
+    rows, cols = codes.shape
+    per_byte = 8 // bits
+    padded = _row_bytes(cols, bits) * per_byte
+    if padded != cols:
+        codes = np.pad(codes, ((0, 0), (0, padded - cols)))
+    codes = codes.reshape(rows, -1, per_byte).astype(np.uint8, copy=False)
+    shifts = np.arange(per_byte - 1, -1, -1, dtype=np.uint8) * bits
+    return np.bitwise_or.reduce(codes << shifts, axis=2)
+
+
+def unpack_codes(data, bits, cols):
+    """Inverse of pack_codes: (rows, row_bytes) -> (rows, cols) uint8."""
+    if bits == 8:
+        return data[:, :cols]
+    per_byte = 8 // bits
+    shifts = np.arange(per_byte - 1, -1, -1, dtype=np.uint8) * bits
+    mask = np.uint8((1 << bits) - 1)
+    codes = (data[:, :, None] >> shifts) & mask
+    return codes.reshape(data.shape[0], -1)[:, :cols]
+
+
+def quantize_groups(x, bits, group_size=DEFAULT_GROUP_SIZE, symmetric=False, clip=None):
+    """Quantizes a 2-D float array group-wise along its rows.
+
+    Returns (codes, scales, zeros) with codes as uint8 of the same shape as
+    ``x`` and scales/zeros of shape (rows, n_groups). ``clip`` (a ratio in
+    (0, 1], scalar or per group) shrinks each group's range about its centre
+    before quantizing; values outside it saturate. Choosing it per group
+    from sample activations is src/calibration.py's job.
+    """
+    if bits not in SUPPORTED_BITS:
+        raise ValueError(f"Unsupported bit width: {bits}")
+    x = np.asarray(x, dtype=np.float32)
+    rows, cols = x.shape
+    n_groups = max(1, math.ceil(cols / group_size))
+    pad = n_groups * group_size - cols
+    g = np.pad(x, ((0, 0), (0, pad)), mode="edge") if pad else x
+    g = g.reshape(rows, n_groups, group_size)
+    qmax = (1 << bits) - 1
+
+    if clip is not None:
+        clip = np.broadcast_to(np.asarray(clip, dtype=np.float32), (rows, n_groups))
+    if symmetric and bits == 1:
+        # Sign binarization: code 1 -> +scale/2, code 0 -> -scale/2.
+        scales = 2 * np.abs(g).mean(axis=2)
+        if clip is not None:
+            scales = scales * clip
+        zeros = np.full_like(scales, 0.5)
+    elif symmetric:
+        half = (1 << (bits - 1)) - 1
+        scales = np.abs(g).max(axis=2) / half
+        if clip is not None:
+            scales = scales * clip
+        zeros = np.full_like(scales, float(half + 1))
+    else:
+        lo, hi = g.min(axis=2), g.max(axis=2)
+        if clip is not None:
+            mid, radius = (hi + lo) / 2, (hi - lo) / 2 * clip
+            lo, hi = mid - radius, mid + radius
+        scales = (hi - lo) / qmax
+        zeros = np.zeros_like(scales)
+        np.divide(-lo, scales, out=zeros, where=scales != 0)
+        zeros[scales == 0] = -lo[scales == 0]
+    empty = scales == 0
+    scales[empty] = 1.0
+
+    codes = np.rint(g / scales[:, :, None] + zeros[:, :, None])
+    np.clip(codes, 0, qmax, out=codes)
+    codes = codes.reshape(rows, -1)[:, :cols].astype(np.uint8)
+    if symmetric and bits == 1:
+        scales[empty] = 0.0  # an all-zero group must decode to zeros
+    return codes, scales.astype(np.float32), zeros.astype(np.float32)
+
+
+class PackedTensor:
+    """A quantized tensor stored ``8 // bits`` values per byte."""
+
+    def __init__(self, data, shape, bits, scales, zeros, group_size=DEFAULT_GROUP_SIZE,
+                 symmetric=False):
+        if bits not in SUPPORTED_BITS:
+            raise ValueError(f"Unsupported bit width: {bits}")
+        self.shape = tuple(int(d) for d in shape)
+        self.bits = bits
+        self.group_size = group_size
+        self.symmetric = symmetric
+        # Stored as (rows, row_bytes) / (rows, n_groups) views.
+        self.data = data.reshape(self.rows, _row_bytes(self.cols, bits))
+        self.scales = scales.reshape(self.rows, -1)
+        self.zero_points = zeros.reshape(self.rows, -1)
+
+    # --- Construction -------------------------------------------------------
+
+    @classmethod
+    def quantize(cls, x, bits=4, group_size=DEFAULT_GROUP_SIZE, symmetric=False, clip=None):
+        """Quantizes a NumPy array or torch tensor (``clip``: see quantize_groups)."""
+        if _is_tensor(x):
+            x = x.detach().to("cpu", _torch().float32).numpy()
+        x = np.asarray(x, dtype=np.float32)
+        shape = x.shape if x.ndim else (1,)
+        flat = x.reshape(-1, shape[-1])
+        codes, scales, zeros = quantize_groups(flat, bits, group_size, symmetric, clip)
+        return cls(pack_codes(codes, bits), shape, bits, scales, zeros, group_size, symmetric)
+
+    @classmethod
+    def from_torch(cls, t, bits=4, group_size=DEFAULT_GROUP_SIZE, symmetric=False):
+        return cls.quantize(t, bits, group_size, symmetric)
+
+    @classmethod
+    def zeros(cls, shape, bits=4, group_size=DEFAULT_GROUP_SIZE):
+        """An all-zero tensor (code == zero point) without a float source."""
+        shape = tuple(shape) if len(shape) else (1,)
+        rows = math.prod(shape[:-1])
+        n_groups = max(1, math.ceil(shape[-1] / group_size))
+        data = np.zeros((rows, _row_bytes(shape[-1], bits)), dtype=np.uint8)
+        scales = np.ones((rows, n_groups), dtype=np.float32)
+        zeros = np.zeros((rows, n_groups), dtype=np.float32)
+        return cls(data, shape, bits, scales, zeros, group_size)
+
+    # --- Properties ---------------------------------------------------------
+
+    @property
+    def rows(self):
+        return math.prod(self.shape[:-1])
+
+    @property
+    def cols(self):
+        return self.shape[-1]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.scales.nbytes + self.zero_points.nbytes
+
+    def describe(self):
+        return describe_format(self.bits, self.group_size, self.symmetric)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return (f"PackedTensor(shape={list(self.shape)}, bits={self.bits}, "
+                f"group_size={self.group_size}, nbytes={self.nbytes})")
+
+    # --- Access -------------------------------------------------------------
+
+    def codes(self):
+        """Unpacked integer codes, shape (rows, cols), uint8."""
+        return unpack_codes(self.data, self.bits, self.cols)
+
+    def numpy(self, dtype=np.float32):
+        """Dequantizes to a NumPy array of ``self.shape``."""
+        codes = self.codes()
+        out = self._dequantize_groups(codes.astype(dtype), np)
+        return out.reshape(self.shape)
+
+    def to_torch(self, dtype=None, device=None, out=None):
+        """Dequantizes straight into a torch tensor.
+
+        The packed bytes are shared with torch (no copy), unpacked to uint8
+        codes, and converted once into the output dtype (or copied into
+        ``out``, a preallocated (rows, cols) buffer); scaling happens in
+        place, so no other full-precision copy is made.
+        """
+        if _torch() is None:
+            raise ImportError("torch is required for PackedTensor.to_torch")
+        if out is not None:
+            dtype, device = out.dtype, out.device
+        dtype = dtype or torch.float32
+        data = torch.from_numpy(np.ascontiguousarray(self.data)).to(device)
+        if self.bits == 8:
+            codes = data[:, :self.cols]
+        else:
+            per_byte = 8 // self.bits
+            shifts = torch.arange(per_byte - 1, -1, -1, dtype=torch.uint8,
+                                  device=data.device) * self.bits
+            codes = (data.unsqueeze(-1) >> shifts) & ((1 << self.bits) - 1)
+            codes = codes.reshape(self.rows, -1)[:, :self.cols]
+        if out is None:
+            out = codes.to(dtype)
+        else:
+            out = out.view(self.rows, self.cols)
+            out.copy_(codes)
+        scales = torch.from_numpy(np.ascontiguousarray(self.scales)).to(data.device, dtype)
+        zeros = torch.from_numpy(np.ascontiguousarray(self.zero_points)).to(data.device, dtype)
+        out = self._dequantize_groups(out, torch, scales, zeros)
+        return out.reshape(self.shape)
+
+    def _dequantize_groups(self, values, xp, scales=None, zeros=None):
+        scales = self.scales if scales is None else scales
+        zeros = self.zero_points if zeros is None else zeros
+        n_groups = scales.shape[1]
+        full = n_groups * self.group_size
+        if full == self.cols:
+            v = values.reshape(self.rows, n_groups, self.group_size)
+            v -= zeros[:, :, None]
+            v *= scales[:, :, None]
+            return values
+        # Ragged last group: expand per-element scale/zero indices.
+        idx = xp.arange(self.cols) // self.group_size
+        if xp is not np:
+            idx = idx.to(values.device)
+        values -= zeros[:, idx]
+        values *= scales[:, idx]
+        return values
+
+    def __getitem__(self, idx):
+        """Indexes leading axes as zero-copy packed views.
+
+        Indices that reach into the last (packed) axis dequantize the selected
+        rows and return a NumPy array.
+        """
+        if not isinstance(idx, tuple):
+            idx = (idx,)
+        if any(i is Ellipsis or i is None for i in idx):
+            return self.numpy()[idx]
+        lead, last = idx[:self.ndim - 1], idx[self.ndim - 1:]
+        if self.ndim == 1:
+            return self.numpy()[idx]
+
+        lead_shape = self.shape[:-1]
+        data = self.data.reshape(lead_shape + (-1,))[lead]
+        scales = self.scales.reshape(lead_shape + (-1,))[lead]
+        zeros = self.zero_points.reshape(lead_shape + (-1,))[lead]
+        shape = data.shape[:-1] + (self.cols,)
+        if len(shape) == 1:
+            # A single row: keep it as a 1-row matrix internally.
+            data, scales, zeros = data[None], scales[None], zeros[None]
+        view = PackedTensor(data, shape, self.bits, scales, zeros,
+                            self.group_size, self.symmetric)
+        if last:
+            return view.numpy()[(Ellipsis,) + last]
+        return view
@@ -0,0 +1,121 @@
+"""Multi-core execution of the quantization kernels by row sharding.
+
+ParallelKernels wraps a backend from src/native.py and splits the output
+rows of quantize/matmul calls into contiguous shards that run on a thread
+pool. Every shard writes straight into its slice of the shared output
+buffer, and both the native library (via ctypes) and torch release the
+GIL while they compute, so shards run truly in parallel.
+
+To avoid oversubscription, the pool is at most ``max_threads`` threads
+(by default the cores this process may use), and a pool of N threads lowers
+torch's intra-op thread count to ``budget // N``, where the budget is the
+count torch had when the kernels were created (a session worker's CPU cap,
+see src/sessions.py). The native kernels are single-threaded per call.
+torch's count is process-wide, so it is only changed while a pool runs.
+"""
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+try:
+    from .native import _as_cpu_f32, _group_buffers
+    from .packed import DEFAULT_GROUP_SIZE, PackedTensor
+except ImportError:
+    from native import _as_cpu_f32, _group_buffers
+    from packed import DEFAULT_GROUP_SIZE, PackedTensor
+
+# Rows per shard are a multiple of this (the native kernel's row block).
+ROW_ALIGN = 4
+# Below this many rows per shard, threading costs more than it saves.
+MIN_SHARD_ROWS = 64
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def shard_ranges(rows, shards):
+    """Splits [0, rows) into at most ``shards`` ROW_ALIGN-aligned ranges."""
+    shards = max(1, min(shards, rows // MIN_SHARD_ROWS))
+    step = math.ceil(rows / shards / ROW_ALIGN) * ROW_ALIGN
+    return [(r0, min(rows, r0 + step)) for r0 in range(0, rows, step)]
+
+
+class ParallelKernels:
+    """Row-sharded quantize_4bit / matmul_4bit / matmul_bits over a thread pool."""
+
+    def __init__(self, kernels, threads=1, max_threads=None):
+        self.kernels = kernels
+        self.threads = 1
+        self.max_threads = max(1, max_threads or cpu_count())
+        self._pool = None
+        self._torch_threads = torch.get_num_threads()
+        self.set_threads(threads)
+
+    @property
+    def name(self):
+        return self.kernels.name
+
+    def set_threads(self, threads):
+        """Resizes the pool (up to max_threads) and rebalances torch's intra-op threads."""
+        threads = max(1, min(int(threads), self.max_threads))
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+            torch.set_num_threads(self._torch_threads)
+        self.threads = threads
+        if threads > 1:
+            self._pool = ThreadPoolExecutor(max_workers=threads,
+                                            thread_name_prefix="apl-shard")
+            torch.set_num_threads(max(1, self._torch_threads // threads))
+
+    def shutdown(self):
+        self.set_threads(1)
+
+    def _run(self, rows, fn):
+        ranges = shard_ranges(rows, self.threads) if self._pool else [(0, rows)]
+        if len(ranges) == 1:
+            fn(0, rows)
+            return
+        # Propagates the first shard exception, if any.
+        for future in [self._pool.submit(fn, r0, r1) for r0, r1 in ranges]:
+            future.result()
+
+    def quantize_4bit(self, x, group_size=DEFAULT_GROUP_SIZE):
+        x = _as_cpu_f32(x)
+        shape = tuple(x.shape) if x.dim() else (1,)
+        x = x.reshape(-1, shape[-1])
+        data, scales, zeros = _group_buffers(*x.shape, group_size)
+        self._run(x.shape[0], lambda r0, r1: self.kernels.quantize_rows(
+            x[r0:r1], data[r0:r1], scales[r0:r1], zeros[r0:r1], group_size))
+        return PackedTensor(data, shape, 4, scales, zeros, group_size)
+
+    def matmul_4bit(self, w, x, out=None):
+        if w.ndim != 2 or x.device.type != "cpu":
+            return self.kernels.matmul_4bit(w, x, out)
+        M, N = w.shape
+        columns = x.to(torch.float32).reshape(N, -1).contiguous()
+        y = out if out is not None else torch.empty((M, columns.shape[1]), dtype=torch.float32)
+        self._run(M, lambda r0, r1: self.kernels.matmul_4bit(w[r0:r1], columns, out=y[r0:r1]))
+        return y.reshape((M,) + tuple(x.shape[1:]))
+
+    def rmatmul_4bit(self, x, w):
+        # Accumulates over w's rows, so it is not row-sharded.
+        return self.kernels.rmatmul_4bit(x, w)
+
+    def matmul_bits(self, w, x, out=None):
+        # Activations are quantized once and shared by every shard.
+        M, N = w.shape
+        acts = w.activations(_as_cpu_f32(x).reshape(N, -1).numpy())
+        K = acts.planes.shape[0]
+        y = out if out is not None and out.device.type == "cpu" else \
+            torch.empty((M, K), dtype=torch.float32)
+        self._run(M, lambda r0, r1: self.kernels.matmul_bits(w[r0:r1], acts, out=y[r0:r1]))
+        if out is not None and y is not out:
+            y = out.copy_(y)
+        return y.to(x.device).reshape((M,) + tuple(x.shape[1:]))
@@ -0,0 +1,114 @@
+"""Scalar primitive functions mapped onto batched torch ops.
+
+Every entry in SCALAR_MONADIC / SCALAR_DYADIC takes whole tensors and is a
+single torch kernel (plus a cheap dtype promotion where torch needs one),
+so an expression like ``A × B + 1`` runs one kernel per primitive instead
+of a Python loop over elements.
+
+Dyadic scalar functions follow APL scalar extension: the arguments must
+have the same shape, unless one of them has a single element, in which
+case it is paired with every element of the other (torch broadcasting).
+"""
+import math
+
+import torch
+
+try:
+    from .apl_parser import APLError
+except ImportError:
+    from apl_parser import APLError
+
+
+def _num(t):
+    """Booleans take part in arithmetic as 0/1 integers."""
+    return t.to(torch.int64) if t.dtype == torch.bool else t
+
+
+def _float(t):
+    return t if t.is_floating_point() else t.to(torch.get_default_dtype())
+
+
+def _residue(a, b):
+    # APL: a|b is b modulo a, and 0|b is b.
+    a, b = _num(a), _num(b)
+    return torch.where(a == 0, b, torch.remainder(b, torch.where(a == 0, 1, a)))
+
+
+def _log_base(a, b):
+    return torch.log(_float(b)) / torch.log(_float(a))
+
+
+def _factorial(t):
+    return torch.exp(torch.lgamma(_float(t) + 1))
+
+
+def _binomial(a, b):
+    a, b = _float(a), _float(b)
+    return torch.exp(torch.lgamma(b + 1) - torch.lgamma(a + 1) - torch.lgamma(b - a + 1))
+
+
+_CIRCULAR = {
+    0: lambda t: torch.sqrt(1 - t * t),
+    1: torch.sin, 2: torch.cos, 3: torch.tan,
+    -1: torch.asin, -2: torch.acos, -3: torch.atan,
+    5: torch.sinh, 6: torch.cosh, 7: torch.tanh,
+    -5: torch.asinh, -6: torch.acosh, -7: torch.atanh,
+}
+
+
+def _circular(a, b):
+    if a.numel() != 1:
+        raise APLError("DOMAIN ERROR: left argument of ○ must be a scalar")
+    code = a.item()
+    fn = _CIRCULAR.get(code)  # None for NaN and non-integers too
+    if fn is None:
+        raise APLError(f"DOMAIN ERROR: {code:g}○ is not supported")
+    return fn(_float(b))
+
+
+SCALAR_MONADIC = {
+    "+": lambda t: t,                      # conjugate (real: identity)
+    "-": lambda t: torch.neg(_num(t)),     # negate
+    "×": lambda t: torch.sign(_num(t)),    # signum
+    "÷": torch.reciprocal,                 # reciprocal
+    "*": torch.exp,                        # exponential
+    "⍟": torch.log,                        # natural log
+    "⌈": lambda t: torch.ceil(_num(t)),    # ceiling
+    "⌊": lambda t: torch.floor(_num(t)),   # floor
+    "|": lambda t: torch.abs(_num(t)),     # magnitude
+    "!": _factorial,                       # factorial / gamma(n+1)
+    "○": lambda t: torch.mul(_float(t), math.pi),  # pi times
+    "~": torch.logical_not,                # not
+}
+
+SCALAR_DYADIC = {
+    "+": lambda a, b: torch.add(_num(a), _num(b)),
+    "-": lambda a, b: torch.sub(_num(a), _num(b)),
+    "×": lambda a, b: torch.mul(_num(a), _num(b)),
+    "÷": lambda a, b: torch.true_divide(_num(a), _num(b)),
+    "*": lambda a, b: torch.pow(_float(a), b),
+    "⍟": _log_base,
+    "⌈": lambda a, b: torch.maximum(_num(a), _num(b)),
+    "⌊": lambda a, b: torch.minimum(_num(a), _num(b)),
+    "|": _residue,
+    "!": _binomial,
+    "○": _circular,
+    "=": torch.eq,
+    "≠": torch.ne,
+    "<": torch.lt,
+    "≤": torch.le,
+    ">": torch.gt,
+    "≥": torch.ge,
+    "∧": torch.logical_and,
+    "∨": torch.logical_or,
+    "⍲": lambda a, b: torch.logical_not(torch.logical_and(a, b)),
+    "⍱": lambda a, b: torch.logical_not(torch.logical_or(a, b)),
+}
+
+
+def check_conformable(glyph, a, b):
+    """Raises LENGTH/RANK ERROR unless a and b satisfy scalar extension."""
+    if a.shape == b.shape or a.numel() == 1 or b.numel() == 1:
+        return
+    kind = "RANK" if a.dim() != b.dim() else "LENGTH"
+    raise APLError(f"{kind} ERROR: {glyph} on shapes {list(a.shape)} and {list(b.shape)}")
@@ -0,0 +1,197 @@
+"""Opt-in profiling of statements and primitives.
+
+``Profile on`` (or ``APLInterpreter.enable_profiling()``) swaps the
+interpreter's statement and primitive handlers for timed wrappers. ``Profile
+off`` puts the originals back, so an interpreter that is not profiling runs
+exactly the code it ran before. Nothing is checked per call.
+
+Each span records its call count, wall time and self time (wall time minus
+nested spans), the time spent waiting for the device to finish, and memory:
+
+* on CUDA, the bytes allocated by the span (``memory_allocated`` after minus
+  before) and its peak above the starting point (``max_memory_allocated``,
+  reset at the start of each top-level statement). Device sync time is the
+  ``torch.cuda.synchronize()`` after the span, so queued kernels are
+  charged to the span that launched them;
+* on CPU, torch has no allocator statistics: "allocated" is the size of
+  the span's result (summed over calls), "peak" the largest single result,
+  and sync time is zero.
+
+Spans are also kept as Chrome trace events (``save_chrome_trace``; open the
+file in chrome://tracing or https://ui.perfetto.dev), up to ``max_events``.
+"""
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+
+try:
+    from .apl_parser import (Assign, Command, Dyadic, Monadic, Name, Num, Str, Strand,
+                             PARSE_CACHE_SIZE)
+except ImportError:
+    from apl_parser import (Assign, Command, Dyadic, Monadic, Name, Num, Str, Strand,
+                            PARSE_CACHE_SIZE)
+
+MAX_EVENTS = 100_000
+# Statement texts are shortened to this many characters in reports.
+NAME_WIDTH = 48
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def describe(node):
+    """Compact source text for a statement or expression node."""
+    if isinstance(node, Num):
+        text = " ".join(f"{v:g}" for v in node.values)
+    elif isinstance(node, Str):
+        text = f"'{node.value}'"
+    elif isinstance(node, Name):
+        text = node.name
+    elif isinstance(node, Strand):
+        text = " ".join(describe(item) for item in node.items)
+    elif isinstance(node, Monadic):
+        space = " " if node.fn.glyph.startswith("⎕") else ""
+        text = f"{node.fn.glyph}{space}{_operand(node.arg)}"
+    elif isinstance(node, Dyadic):
+        text = f"{_operand(node.left, True)} {node.fn.glyph} {_operand(node.right)}"
+    elif isinstance(node, Assign):
+        text = f"{node.name} <- {describe(node.value)}"
+    elif isinstance(node, Command):
+        text = " ".join((node.name,) + tuple(f"'{a}'" if " " in a else a for a in node.args))
+    else:
+        text = type(node).__name__
+    return text if len(text) <= NAME_WIDTH else text[:NAME_WIDTH - 1] + "…"
+
+
+def _operand(node, left=False):
+    # Left operands of a dyadic function need parentheses if they are calls.
+    text = describe(node)
+    return f"({text})" if left and isinstance(node, (Monadic, Dyadic)) else text
+
+
+def _nbytes(value):
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    try:
+        return value.element_size() * value.nelement()
+    except AttributeError:
+        return 0
+
+
+class Stat:
+    __slots__ = ("count", "wall", "self_time", "sync", "allocated", "peak")
+
+    def __init__(self):
+        self.count = 0
+        self.wall = self.self_time = self.sync = 0.0
+        self.allocated = self.peak = 0
+
+    def as_dict(self):
+        return {"count": self.count, "wall_ms": self.wall * 1000,
+                "self_ms": self.self_time * 1000, "sync_ms": self.sync * 1000,
+                "allocated_bytes": self.allocated, "peak_bytes": self.peak}
+
+
+class Profiler:
+    """Aggregated timings and trace events for one interpreter."""
+
+    def __init__(self, device="cpu", max_events=MAX_EVENTS):
+        self.device = device
+        self.max_events = max_events
+        self.stats = {}  # (kind, name) -> Stat
+        self.events = []
+        self.dropped = 0
+        self._children = []  # self-time stack: time spent in nested spans
+        self._origin = time.perf_counter()
+        self._cuda = None
+        if device == "cuda":
+            import torch
+            self._cuda = torch.cuda
+
+    def reset(self):
+        self.stats.clear()
+        self.events.clear()
+        self.dropped = 0
+
+    def call(self, kind, name, fn, *args):
+        """Calls ``fn(*args)`` as a span named ``name`` of ``kind``."""
+        cuda = self._cuda
+        if cuda is not None:
+            if not self._children:
+                cuda.reset_peak_memory_stats()
+            before = cuda.memory_allocated()
+        self._children.append(0.0)
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        finally:
+            done = time.perf_counter()
+            sync = 0.0
+            if cuda is not None:
+                cuda.synchronize()
+                sync = time.perf_counter() - done
+            end = done + sync
+            wall = end - start
+            nested = self._children.pop()
+            if self._children:
+                self._children[-1] += wall
+        if cuda is not None:
+            allocated = cuda.memory_allocated() - before
+            peak = cuda.max_memory_allocated() - before
+        else:
+            allocated = peak = _nbytes(result)
+        stat = self.stats.get((kind, name))
+        if stat is None:
+            stat = self.stats[(kind, name)] = Stat()
+        stat.count += 1
+        stat.wall += wall
+        stat.self_time += wall - nested
+        stat.sync += sync
+        stat.allocated += allocated
+        stat.peak = max(stat.peak, peak)
+        if len(self.events) < self.max_events:
+            self.events.append((kind, name, start, wall, sync, allocated,
+                                threading.get_ident()))
+        else:
+            self.dropped += 1
+        return result
+
+    def hotspots(self, top=10, kind=None):
+        """The ``top`` spans by self time, as dicts (kind, name and Stat fields)."""
+        rows = [{"kind": k, "name": n, **s.as_dict()} for (k, n), s in list(self.stats.items())
+                if kind is None or k == kind]
+        rows.sort(key=lambda r: r["self_ms"], reverse=True)
+        return rows[:top]
+
+    def report(self, top=15):
+        """A text table of the hot spots."""
+        if not self.stats:
+            return "Profile: no samples yet."
+        lines = [f"{'kind':<10}{'name':<{NAME_WIDTH + 2}}{'calls':>7}{'total ms':>11}"
+                 f"{'self ms':>10}{'sync ms':>9}{'alloc MB':>10}{'peak MB':>9}"]
+        for r in self.hotspots(top):
+            lines.append(f"{r['kind']:<10}{r['name']:<{NAME_WIDTH + 2}}{r['count']:>7}"
+                         f"{r['wall_ms']:>11.3f}{r['self_ms']:>10.3f}{r['sync_ms']:>9.3f}"
+                         f"{r['allocated_bytes'] / 2**20:>10.2f}{r['peak_bytes'] / 2**20:>9.2f}")
+        if len(self.stats) > top:
+            lines.append(f"... {len(self.stats) - top} more")
+        if self.dropped:
+            lines.append(f"({self.dropped} trace events dropped beyond {self.max_events})")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """The recorded spans in Chrome's trace event format."""
+        pid = os.getpid()
+        events = []
+        for kind, name, start, wall, sync, allocated, tid in self.events:
+            events.append({"name": name, "cat": kind, "ph": "X", "pid": pid, "tid": tid,
+                           "ts": (start - self._origin) * 1e6, "dur": wall * 1e6,
+                           "args": {"sync_ms": sync * 1000, "allocated_bytes": allocated}})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"device": self.device, "dropped": self.dropped}}
+
+    def save_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+        return len(self.events)
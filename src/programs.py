@@ -0,0 +1,151 @@
+"""Compiled ``.apl`` scripts and their on-disk cache.
+
+``Source`` used to read a script and evaluate it line by line, parsing
+every line again each time. A script is now compiled once into a
+CompiledProgram: the parsed statements of each line, with ``Layer``
+commands resolved to their ``define_layer`` arguments and syntax errors
+recorded rather than raised. The result is pickled into a cache directory
+under a key made from the script's content hash, the interpreter version
+and CACHE_FORMAT. Every later ``Source`` of the same text (in this
+process, another worker, or the next run) loads it instead of parsing.
+
+The cache lives in ``$APL_CACHE_DIR/programs`` (default
+``~/.cache/ai-apl/programs``). Entries are never stale: changing a script
+changes its key, and upgrading the interpreter changes every key. The
+directory can be deleted at any time. If it cannot be written, programs
+are still cached in memory.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+try:
+    from .apl_parser import APLError, Command, Program, parse
+except ImportError:
+    from apl_parser import APLError, Command, Program, parse
+
+# Bump when CompiledProgram or CompiledLine change shape, or when the same
+# text would parse differently (e.g. a new command).
+CACHE_FORMAT = 4
+# Compiled programs kept in memory per process.
+MEMORY_ENTRIES = 64
+
+
+@dataclass(frozen=True)
+class CompiledLine:
+    """One command of a script."""
+    source: str
+    program: Optional[Program]
+    # "Syntax error: ..." when the line does not parse (program is None)
+    error: Optional[str] = None
+    # (name, type, shape) when the line is a lone Layer command
+    layer: Optional[Tuple[str, str, Tuple[str, ...]]] = None
+
+
+@dataclass(frozen=True)
+class CompiledProgram:
+    path: str
+    digest: str
+    lines: Tuple[CompiledLine, ...]
+
+
+def compile_source(text, path="<string>", digest=""):
+    """Compiles a script's text: comments and blank lines are dropped."""
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            program = parse(line)
+        except APLError as e:
+            lines.append(CompiledLine(line, None, error=f"Syntax error: {e}"))
+            continue
+        layer = None
+        if len(program.statements) == 1:
+            node = program.statements[0]
+            if isinstance(node, Command) and node.name == "Layer" and len(node.args) >= 2:
+                layer = (node.args[0], node.args[1], node.args[2:])
+        lines.append(CompiledLine(line, program, layer=layer))
+    return CompiledProgram(path, digest, tuple(lines))
+
+
+def default_cache_dir():
+    root = os.environ.get("APL_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "ai-apl")
+    return os.path.join(root, "programs")
+
+
+class ProgramCache:
+    """Loads compiled scripts from memory, then disk, compiling on a miss."""
+
+    def __init__(self, version, directory=None):
+        self.version = version
+        self.directory = directory or default_cache_dir()
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, data):
+        h = hashlib.sha256(f"{self.version}\0{CACHE_FORMAT}\0".encode())
+        h.update(data)
+        return h.hexdigest()
+
+    def load(self, path):
+        """The CompiledProgram for the file at ``path`` (OSError if unreadable)."""
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = self.key(data)
+        program = self._memory.get(digest)
+        if program is not None:
+            self._memory.move_to_end(digest)
+            self.hits += 1
+        else:
+            program = self._read(digest)
+            if program is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                program = compile_source(data.decode("utf-8"), path, digest)
+                self._write(digest, program)
+            self._memory[digest] = program
+            if len(self._memory) > MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+        if program.path != path:
+            # Same text under another name: report the name it was run as.
+            program = CompiledProgram(path, program.digest, program.lines)
+        return program
+
+    def _file(self, digest):
+        return os.path.join(self.directory, digest + ".aplc")
+
+    def _read(self, digest):
+        try:
+            with open(self._file(digest), "rb") as f:
+                program = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            return None  # truncated or from an incompatible build: recompile
+        return program if isinstance(program, CompiledProgram) else None
+
+    def _write(self, digest, program):
+        # Write-then-rename, so concurrent workers never see a partial file.
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(program, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._file(digest))
+        except OSError:
+            pass
+
+    def stats(self):
+        return {"memory": len(self._memory), "hits": self.hits,
+                "disk_hits": self.disk_hits, "misses": self.misses,
+                "directory": self.directory}
@@ -0,0 +1,336 @@
+"""Continuous batching of ``Run`` requests over one or more interpreters.
+
+Callers (e.g. Gradio handlers on many threads) submit Run requests to a
+BatchScheduler instead of calling the interpreter directly. A request's
+Engine is looked up when it is submitted, and a single scheduler thread
+then loops:
+
+1. admit waiting requests (up to ``max_batch`` in flight) and prefill each
+   prompt into its own KV-cache sequence;
+2. run ONE decode step for every in-flight sequence, as a single batched
+   forward pass (B sequences x 1 token) per Engine;
+3. finish sequences that reached their token budget, freeing their pages.
+
+If an Engine's KV cache cannot grow every sequence in its batch, the most
+recently admitted ones are preempted: their pages are freed and they go
+back to the front of the queue, to be prefilled again (prompt plus the
+tokens generated so far) once there is room. The other sequences on that
+Engine, and every other Engine, keep decoding.
+
+New requests join between decode steps, so 20 concurrent users cost about
+one batched pass per generated token rather than 20 separate passes.
+
+Requests can come from several interpreters (``interp=``): a worker's
+sessions share one scheduler, and sessions with the same model share one
+Engine (src/sessions.py), so their sequences decode together. Lines other
+than Run on the scheduler's own interpreter run under the same lock as
+the scheduler's steps, so they never race a forward pass.
+
+``stream`` is the incremental form of ``eval``: a streamed request gets
+each token's text as soon as the step that produced it finishes.
+"""
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+
+try:
+    from .engine import TextStream, encode, generation_summary
+    from .kv_cache import CacheFull
+except ImportError:
+    from engine import TextStream, encode, generation_summary
+    from kv_cache import CacheFull
+
+# Completed requests kept for the latency percentiles.
+METRICS_WINDOW = 1000
+
+_request_ids = itertools.count()
+
+
+class Request:
+    """One Run request; ``result()`` blocks until its report is ready."""
+
+    def __init__(self, interp, text, max_tokens, stream=False):
+        self.id = f"req-{next(_request_ids)}"
+        self.interp = interp
+        self.engine = None
+        self.error = None  # set instead of engine when it cannot run
+        self.text = text
+        self.max_tokens = max_tokens
+        self.prompt_len = 0
+        self.tokens = []
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.first_token = None
+        self.future = Future()
+        # Streamed requests: output pieces as they are produced, then None.
+        self.pieces = None
+        if stream:
+            self.pieces = queue.SimpleQueue()
+            self.decoder = TextStream()
+            self.future.add_done_callback(lambda _: self.pieces.put(None))
+
+    @property
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+class BatchScheduler:
+    """Merges concurrent Run requests into shared forward passes."""
+
+    def __init__(self, interp=None, max_batch=32):
+        self.interp = interp
+        self.max_batch = max_batch
+        # Guards the engines: held for every step, engine lookup, and every
+        # other eval on the scheduler's own interpreter.
+        self.lock = threading.RLock()
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._active = []
+        self._thread = None
+        self._stopped = False
+        # Metrics
+        self.forward_passes = 0
+        self.decode_steps = 0
+        self.preemptions = 0
+        self.completed = 0
+        self.tokens_generated = 0
+        self.last_batch = 0
+        self._batch_sizes = deque(maxlen=METRICS_WINDOW)
+        self._latencies = deque(maxlen=METRICS_WINDOW)
+        self._ttfts = deque(maxlen=METRICS_WINDOW)
+
+    # --- Client API ---------------------------------------------------------
+
+    def submit(self, text, max_tokens=None, stream=False, interp=None):
+        """Queues a Run request on ``interp`` (default: the scheduler's own)."""
+        interp = interp or self.interp
+        with self.lock:
+            if max_tokens is None:
+                max_tokens = interp.setting("MaxTokens", 16)
+            request = Request(interp, text, max(1, max_tokens), stream)
+            if not interp.layers:
+                request.error = "Error: No model loaded. Use 'LoadModel' or define layers first."
+            else:
+                try:
+                    request.engine = interp.get_engine()
+                except ValueError as e:
+                    request.error = f"Error: {e}"
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("scheduler is closed")
+            self._waiting.append(request)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="apl-scheduler",
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return request
+
+    def eval(self, code, interp=None):
+        """Evaluates a line: Run goes through the batch, the rest runs directly.
+
+        The scheduler's own interpreter may be used by any thread, so its
+        other lines run locked. Another ``interp`` must only be used by the
+        caller's thread (a session's, in src/sessions.py).
+        """
+        interp = interp or self.interp
+        text = interp.run_text(code)
+        if text is not None:
+            return self.submit(text, interp=interp).result()
+        if interp is not self.interp:
+            return interp.eval(code)
+        with self.lock:
+            return interp.eval(code)
+
+    def stream(self, code, interp=None):
+        """Like ``eval``, but yields a Run's output piece by piece."""
+        interp = interp or self.interp
+        text = interp.run_text(code)
+        if text is None:
+            yield str(self.eval(code, interp))
+            return
+        request = self.submit(text, stream=True, interp=interp)
+        streamed = []
+        for piece in iter(request.pieces.get, None):
+            streamed.append(piece)
+            yield piece
+        # The report ends with the stats (or is an error if nothing streamed).
+        report, streamed = request.result(), "".join(streamed)
+        yield report[len(streamed):] if report.startswith(streamed) else "\n" + report
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            queued, active = len(self._waiting), len(self._active)
+        sizes = list(self._batch_sizes)
+        return {
+            "queue_depth": queued,
+            "active": active,
+            "batch_size": self.last_batch,
+            "mean_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+            "forward_passes": self.forward_passes,
+            "decode_steps": self.decode_steps,
+            "preemptions": self.preemptions,
+            "completed": self.completed,
+            "tokens": self.tokens_generated,
+            "latency_ms": _percentiles(list(self._latencies)),
+            "ttft_ms": _percentiles(list(self._ttfts)),
+        }
+
+    # --- Scheduler thread ---------------------------------------------------
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not (self._waiting or self._active or self._stopped):
+                    self._cond.wait()
+                if self._stopped:
+                    pending = list(self._waiting) + self._active
+                    self._waiting.clear()
+                    self._active = []
+                    break
+                admit = []
+                while self._waiting and len(self._active) + len(admit) < self.max_batch:
+                    admit.append(self._waiting.popleft())
+            with self.lock:
+                try:
+                    self._step(admit)
+                except Exception as e:  # keep serving; fail what was in flight
+                    for request in admit + self._active:
+                        self._finish(request, f"Error: {e}")
+                    self._active = []
+        for request in pending:
+            if not request.done:
+                request.future.set_exception(RuntimeError("scheduler is closed"))
+
+    def _step(self, admit):
+        for i, request in enumerate(admit):
+            if request.engine is None:
+                self._finish(request, request.error)
+            elif not request.engine.takes_tokens:
+                self._finish(request, request.interp.run_inference(request.text))
+            elif not self._prefill(request):
+                # No room in the KV cache yet: retry once sequences finish.
+                with self._cond:
+                    self._waiting.extendleft(reversed(admit[i:]))
+                break
+
+        if self._active:
+            self._decode()
+
+    def _prefill(self, request):
+        engine = request.engine
+        prompt = encode(request.text, engine.vocab)
+        request.prompt_len = len(prompt)
+        if request.started is None:
+            request.started = time.perf_counter()
+        # A preempted request resumes after the tokens it already produced.
+        prompt = prompt + request.tokens
+        sharing = [r.id for r in self._active if r.engine is engine]
+        try:
+            logits = engine.forward(torch.tensor([prompt], device=engine.device), [request.id],
+                                    protect=sharing)
+        except CacheFull as e:
+            engine.cache.free(request.id)
+            if sharing:
+                return False
+            self._finish(request, f"Error: {e}")
+            return True
+        self.forward_passes += 1
+        self._emit(request, int(torch.argmax(logits[0, -1])))
+        if not request.done:
+            self._active.append(request)
+        return True
+
+    def _decode(self):
+        # One batched pass per Engine: every sequence on it advances a token.
+        batches = {}
+        for request in self._active:
+            batches.setdefault(request.engine, []).append(request)
+        for engine, batch in batches.items():
+            try:
+                logits = self._forward_decode(engine, batch)
+            except Exception as e:  # only this Engine's sequences fail
+                for request in batch:
+                    self._finish(request, f"Error: {e}")
+                continue
+            if logits is None:
+                continue
+            next_tokens = torch.argmax(logits[:, -1], dim=-1).tolist()
+            self.forward_passes += 1
+            self._batch_sizes.append(len(batch))
+            for request, token in zip(batch, next_tokens):
+                self._emit(request, token)
+        self.decode_steps += 1
+        self.last_batch = len(self._active)
+        self._active = [r for r in self._active if not r.done]
+
+    def _forward_decode(self, engine, batch):
+        # Engine.forward reserves all of a step or nothing, so on CacheFull
+        # the newest sequence is preempted and the rest retried. One that
+        # cannot grow even alone ends with the error. Returns None if no
+        # sequence is left.
+        while batch:
+            ids = torch.tensor([[r.tokens[-1]] for r in batch], device=engine.device)
+            try:
+                return engine.forward(ids, [r.id for r in batch])
+            except CacheFull as e:
+                request = batch.pop()
+                if not batch:
+                    self._finish(request, f"Error: {e}")
+                    return None
+                engine.cache.free(request.id)
+                self._active.remove(request)
+                self.preemptions += 1
+                with self._cond:
+                    self._waiting.appendleft(request)
+        return None
+
+    def _emit(self, request, token):
+        now = time.perf_counter()
+        if request.first_token is None:
+            request.first_token = now
+            self._ttfts.append(now - request.submitted)
+        request.tokens.append(token)
+        self.tokens_generated += 1
+        if request.pieces is not None:
+            piece = request.decoder.push(token)
+            if len(request.tokens) == 1:
+                piece = request.interp.format_report(request.text, "Output: ") + piece
+            request.pieces.put(piece)
+        if len(request.tokens) >= request.max_tokens:
+            report = generation_summary(request.prompt_len, request.tokens,
+                                        request.first_token - request.started,
+                                        now - request.started)
+            self._finish(request, request.interp.format_report(request.text, report))
+
+    def _finish(self, request, result):
+        if request.done:
+            return
+        if request.engine is not None and request.engine.cache is not None:
+            request.engine.cache.free(request.id)
+        self._latencies.append(time.perf_counter() - request.submitted)
+        self.completed += 1
+        request.future.set_result(result)
@@ -0,0 +1,422 @@
+"""Per-session interpreters hosted in a pool of worker processes.
+
+Each browser session gets its own APLInterpreter (variables, layers), so
+nothing leaks between users. Sessions are spread over ``workers``
+processes and stay pinned to the one that created them. Within a worker,
+evaluations for different sessions run on separate threads, and each
+session's own evaluations run in order. A long ``eval`` therefore only
+blocks its own session, and the front end can use every core.
+
+Run requests from all of a worker's sessions go through one BatchScheduler
+(src/scheduler.py). Sessions whose layer tables match share one Engine,
+so its weights, KV cache (sequences are keyed by request id) and decode
+passes: 20 users of the same preset decode in one batched pass per token.
+A session that changes its model, or its KVCache budget, moves to the
+Engine for that; an Engine is dropped once no session uses it.
+
+Weights are shared rather than copied. ``.apl_bin`` files are
+memory-mapped, so every worker that loads the same file shares its pages
+through the OS page cache (each session maps the file itself, so those
+sessions get Engines of their own). Synthetic preset weights are cached
+per worker and shared by that worker's sessions.
+
+Limits:
+
+* ``max_sessions``: the least recently used session is evicted beyond it;
+* ``idle_ttl``: sessions idle for longer than this many seconds are evicted;
+* ``worker_threads``: torch intra-op threads per worker (CPU cap), and with
+  ``pin_cpus`` each worker is also pinned to its own share of the cores.
+  Sessions share it, so ``Threads N`` in a session stays at 1;
+* ``worker_memory_mb``: after each call a worker over this RSS evicts its
+  idle sessions, and if it is still over, drops the session that grew it.
+
+A worker that dies is restarted, and its sessions start fresh.
+
+``stream`` runs a line like ``eval`` but forwards a Run's output from the
+worker piece by piece, so the front end can show tokens as they decode.
+"""
+import gc
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_MAX_SESSIONS = 64
+DEFAULT_IDLE_TTL = 30 * 60
+
+
+def _rss_mb():
+    """Current resident set size in MB, or None where it is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# --- Worker process -----------------------------------------------------------
+
+class _Session:
+    def __init__(self, host):
+        try:
+            from .interpreter import APLInterpreter
+        except ImportError:
+            from interpreter import APLInterpreter
+        self.scheduler = host.scheduler
+        # torch's intra-op thread count is process-wide and is the worker's
+        # CPU cap, so a session's Threads may not resize it.
+        self.interp = APLInterpreter(engines=host.engines, engine_lock=self.scheduler.lock,
+                                     max_threads=1)
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def eval(self, code):
+        result = self.scheduler.eval(code, self.interp)
+        return {"output": str(result), "layers": self.interp.get_model_structure()}
+
+    def stream(self, code, emit):
+        output = []
+        for piece in self.scheduler.stream(code, self.interp):
+            output.append(piece)
+            emit(piece)
+        return {"output": "".join(output), "layers": self.interp.get_model_structure()}
+
+
+class SessionHost:
+    """The sessions of one process: a worker's, or the daemon's (src/daemon.py)."""
+
+    def __init__(self, memory_mb=None):
+        self.memory_mb = memory_mb
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self._scheduler = None
+        # Model signature -> Engine, kept alive by the sessions using it.
+        self.engines = weakref.WeakValueDictionary()
+
+    @property
+    def scheduler(self):
+        """The BatchScheduler shared by every session (created on first use)."""
+        with self.lock:
+            if self._scheduler is None:
+                try:
+                    from .scheduler import BatchScheduler
+                except ImportError:
+                    from scheduler import BatchScheduler
+                self._scheduler = BatchScheduler()
+            return self._scheduler
+
+    def session(self, sid):
+        with self.lock:
+            session = self.sessions.get(sid)
+        if session is None:
+            session = _Session(self)
+            with self.lock:
+                session = self.sessions.setdefault(sid, session)
+        session.last_used = time.monotonic()
+        return session
+
+    def close(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def shutdown(self):
+        with self.lock:
+            self.sessions.clear()
+            scheduler, self._scheduler = self._scheduler, None
+        if scheduler is not None:
+            scheduler.close()
+
+    def enforce_memory(self, current):
+        """Evicts idle sessions while over the cap; returns evicted ids."""
+        evicted = []
+        if not self.memory_mb:
+            return evicted
+        while (_rss_mb() or 0) > self.memory_mb:
+            with self.lock:
+                idle = sorted((s.last_used, sid) for sid, s in self.sessions.items()
+                              if sid != current and not s.lock.locked())
+            if not idle:
+                break
+            self.close(idle[0][1])
+            evicted.append(idle[0][1])
+            gc.collect()
+        if (_rss_mb() or 0) > self.memory_mb and current in self.sessions:
+            self.close(current)
+            gc.collect()
+            evicted.append(current)
+        return evicted
+
+    def handle(self, op, sid, payload, emit):
+        if op in ("eval", "stream"):
+            session = self.session(sid)
+            with session.lock:
+                if op == "eval":
+                    value = session.eval(payload)
+                else:
+                    value = session.stream(payload, emit)
+            value["evicted"] = self.enforce_memory(sid)
+            if sid in value["evicted"]:
+                value["output"] = (f"Error: session exceeded the worker memory cap "
+                                   f"({self.memory_mb} MB) and was reset")
+            return value
+        if op == "close":
+            self.close(sid)
+            return None
+        if op == "stats":
+            session = self.sessions.get(sid)
+            profiler = session.interp.profiler if session else None
+            return {"sessions": len(self.sessions), "rss_mb": _rss_mb(),
+                    "engines": len(self.engines),
+                    "scheduler": self._scheduler.stats() if self._scheduler else None,
+                    "profile": None if profiler is None else {
+                        "on": session.interp.profiling, "hotspots": profiler.hotspots(10)}}
+        raise ValueError(f"unknown operation {op}")
+
+
+def _worker_main(conn, threads, cpus, memory_mb):
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    state = SessionHost(memory_mb)
+    send_lock = threading.Lock()
+
+    def send(reply):
+        with send_lock:
+            conn.send(reply)
+
+    def run(msg_id, op, sid, payload):
+        # Replies are (id, True, value) or (id, False, error); streamed
+        # pieces go out first as (id, None, piece).
+        emit = lambda piece: send((msg_id, None, piece))
+        try:
+            reply = (msg_id, True, state.handle(op, sid, payload, emit))
+        except Exception as e:
+            reply = (msg_id, False, f"{type(e).__name__}: {e}")
+        send(reply)
+
+    with ThreadPoolExecutor(thread_name_prefix="apl-session") as pool:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            if message is None:
+                break
+            pool.submit(run, *message)
+    state.shutdown()
+
+
+# --- Parent side ----------------------------------------------------------------
+
+class _Worker:
+    """One worker process and the futures of its in-flight calls."""
+
+    def __init__(self, ctx, index, threads, cpus, memory_mb):
+        self.index = index
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, name=f"apl-worker-{index}",
+                                   args=(child, threads, cpus, memory_mb), daemon=True)
+        self.process.start()
+        child.close()
+        self.sessions = set()
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    @property
+    def alive(self):
+        return self.process.is_alive()
+
+    def call(self, op, sid, payload=None, on_piece=None):
+        future = Future()
+        with self._lock:
+            msg_id = next(self._ids)
+            self._pending[msg_id] = (future, on_piece)
+            try:
+                self.conn.send((msg_id, op, sid, payload))
+            except (OSError, ValueError) as e:
+                del self._pending[msg_id]
+                future.set_exception(RuntimeError(f"worker {self.index} is gone: {e}"))
+        return future
+
+    def _read(self):
+        while True:
+            try:
+                msg_id, ok, value = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                entry = (self._pending.get(msg_id) if ok is None else
+                         self._pending.pop(msg_id, None))
+            if entry is None:
+                continue
+            future, on_piece = entry
+            if ok is None:
+                if on_piece is not None:
+                    on_piece(value)
+            elif ok:
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(value))
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            future.set_exception(RuntimeError(f"worker {self.index} exited"))
+
+    def stop(self, timeout=5):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class SessionPool:
+    """Routes each session's evaluations to its interpreter in a worker."""
+
+    def __init__(self, workers=None, max_sessions=DEFAULT_MAX_SESSIONS,
+                 idle_ttl=DEFAULT_IDLE_TTL, worker_threads=None, worker_memory_mb=None,
+                 pin_cpus=False):
+        cores = (sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity")
+                 else list(range(os.cpu_count() or 1)))
+        self.num_workers = max(1, workers or len(cores))
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.worker_threads = worker_threads or max(1, len(cores) // self.num_workers)
+        self.worker_memory_mb = worker_memory_mb
+        self._cpu_sets = ([set(cores[i::self.num_workers]) or set(cores)
+                           for i in range(self.num_workers)] if pin_cpus else
+                          [None] * self.num_workers)
+        # spawn: workers never inherit the parent's torch thread state
+        self._ctx = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session id -> (worker, last used); LRU first
+        self.evictions = 0
+        self.restarts = 0
+        self._workers = [self._start(i) for i in range(self.num_workers)]
+
+    def _start(self, index):
+        return _Worker(self._ctx, index, self.worker_threads, self._cpu_sets[index],
+                       self.worker_memory_mb)
+
+    def _worker_for(self, sid):
+        """The session's worker, assigning the least loaded one to new sessions."""
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now, keep=sid)
+            entry = self._sessions.pop(sid, None)
+            worker = entry[0] if entry else None
+            if worker is not None and not worker.alive:
+                worker = None
+            if worker is None:
+                for i, w in enumerate(self._workers):
+                    if not w.alive:
+                        self._restart(i)
+                worker = min(self._workers, key=lambda w: len(w.sessions))
+                worker.sessions.add(sid)
+            self._sessions[sid] = (worker, now)
+            while len(self._sessions) > self.max_sessions:
+                self._evict(next(iter(self._sessions)))
+            return worker
+
+    def _restart(self, index):
+        old = self._workers[index]
+        for sid in old.sessions:
+            self._sessions.pop(sid, None)
+        old.stop(timeout=0)
+        self._workers[index] = self._start(index)
+        self.restarts += 1
+
+    def _sweep(self, now, keep=None):
+        # Sessions are in LRU order, so the idle ones are at the front.
+        while self._sessions:
+            sid, (worker, last_used) = next(iter(self._sessions.items()))
+            if sid == keep or now - last_used <= self.idle_ttl:
+                break
+            self._evict(sid)
+
+    def _evict(self, sid):
+        worker, _ = self._sessions.pop(sid)
+        worker.sessions.discard(sid)
+        worker.call("close", sid)
+        self.evictions += 1
+
+    def _forget(self, sid):
+        with self._lock:
+            entry = self._sessions.pop(sid, None)
+        if entry is not None:
+            entry[0].sessions.discard(sid)
+
+    # --- Public API -----------------------------------------------------------
+
+    def eval(self, sid, code, timeout=None):
+        """Evaluates ``code`` in session ``sid``: {"output": str, "layers": [...]}"""
+        worker = self._worker_for(sid)
+        try:
+            value = worker.call("eval", sid, code).result(timeout)
+        except RuntimeError as e:
+            return {"output": f"Error: {e}", "layers": []}
+        for evicted in value.pop("evicted", ()):
+            self._forget(evicted)
+        return value
+
+    def stream(self, sid, code):
+        """Evaluates ``code`` in session ``sid``, yielding the output so far.
+
+        Each item is {"output": str} with the text received up to then; the
+        last one is the full result, as from ``eval`` (it has "layers").
+        """
+        worker = self._worker_for(sid)
+        pieces = queue.SimpleQueue()
+        future = worker.call("stream", sid, code, on_piece=pieces.put)
+        future.add_done_callback(lambda _: pieces.put(None))
+        output = ""
+        for piece in iter(pieces.get, None):
+            output += piece
+            yield {"output": output}
+        try:
+            value = future.result()
+        except RuntimeError as e:
+            yield {"output": (output + "\n" if output else "") + f"Error: {e}", "layers": []}
+            return
+        for evicted in value.pop("evicted", ()):
+            self._forget(evicted)
+        yield value
+
+    def close_session(self, sid):
+        with self._lock:
+            if sid in self._sessions:
+                self._evict(sid)
+
+    def session_stats(self, sid, timeout=5):
+        """Worker-side stats for ``sid``'s worker, including its scheduler."""
+        with self._lock:
+            entry = self._sessions.get(sid)
+        if entry is None:
+            return None
+        return entry[0].call("stats", sid).result(timeout)
+
+    def stats(self):
+        with self._lock:
+            self._sweep(time.monotonic())
+            return {"workers": len(self._workers),
+                    "alive": sum(w.alive for w in self._workers),
+                    "sessions": len(self._sessions),
+                    "per_worker": [len(w.sessions) for w in self._workers],
+                    "evictions": self.evictions, "restarts": self.restarts}
+
+    def shutdown(self):
+        for worker in self._workers:
+            worker.stop()
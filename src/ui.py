@@ -1,37 +1,124 @@
+from textual import work
 from textual.app import App, ComposeResult
 from textual.containers import Container, Horizontal, Vertical
 from textual.widgets import Header, Footer, Input, Log, Static, Button, Tree, TabbedContent, TabPane
-from textual.widgets.tree import Tree
 try:
-    from .interpreter import APLInterpreter
+    from .interpreter import APLInterpreter, Interrupted
 except ImportError:
-    from src.interpreter import APLInterpreter
+    from src.interpreter import APLInterpreter, Interrupted
 import os
+import queue
 import random
 
+class _ShowMore:
+    """Data of the node that stands in for a directory's unshown entries."""
+
+    def __init__(self, entries, offset):
+        self.entries = entries
+        self.offset = offset
+
+
 class FileTree(Tree):
+    """Explorer tree that lists a directory only when it is expanded.
+
+    Listings are read on a background thread and added in batches, so a
+    huge directory never blocks the UI. They are cached per directory until
+    its mtime changes, and at most PAGE_SIZE entries are shown at a time,
+    followed by a "more" node that shows the next page when selected.
+    """
+
+    PAGE_SIZE = 500
+    BATCH_SIZE = 100
+    CACHED_LISTINGS = 256
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._listings = {}  # path -> (mtime_ns, [(name, path, is_dir), ...])
+        self._scans = {}     # node id -> (mtime_ns, token) of its current listing
+
     def on_mount(self):
         self.root.expand()
         
     def load_directory(self, path: str):
         self.clear()
+        self._scans.clear()
         self.root.label = os.path.basename(path) or path
         self.root.data = path
-        self._add_children(self.root, path)
-        
-    def _add_children(self, node, path):
+        self._list_node(self.root)
+
+    def on_tree_node_expanded(self, event: Tree.NodeExpanded) -> None:
+        if isinstance(event.node.data, str):
+            self._list_node(event.node)
+
+    def on_tree_node_selected(self, event: Tree.NodeSelected) -> None:
+        more = event.node.data
+        if isinstance(more, _ShowMore):
+            parent = event.node.parent
+            event.node.data = None  # a repeated selection event is a no-op
+            event.node.remove()
+            self._add_page(parent, more.entries, more.offset)
+
+    def _list_node(self, node):
+        """(Re)lists a directory node unless its listing is current."""
+        path = node.data
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        current = self._scans.get(node.id)
+        if current is not None and current[0] == mtime:
+            return
+        token = object()  # identifies this listing; stale batches are dropped
+        self._scans[node.id] = (mtime, token)
+        node.remove_children()
+        cached = self._listings.get(path)
+        if cached is not None and cached[0] == mtime:
+            self._add_page(node, cached[1], 0)
+        else:
+            self._scan(node, path, mtime, token)
+
+    @work(thread=True)
+    def _scan(self, node, path, mtime, token):
+        entries, batch = [], []
         try:
-            for entry in os.scandir(path):
-                if entry.is_dir():
-                    if not entry.name.startswith('.'):
-                        child = node.add(entry.name, expand=False, data=entry.path)
-                        child.allow_expand = True
-                        # Lazy loading could go here
-                        self._add_children(child, entry.path)
-                else:
-                    node.add_leaf(entry.name, data=entry.path)
-        except PermissionError:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+                    if is_dir and entry.name.startswith('.'):
+                        continue
+                    entries.append((entry.name, entry.path, is_dir))
+                    if len(entries) <= self.PAGE_SIZE:
+                        batch.append(entries[-1])
+                        if len(batch) == self.BATCH_SIZE:
+                            self.app.call_from_thread(self._add_entries, node, token, batch)
+                            batch = []
+        except OSError:
             pass
+        if len(self._listings) >= self.CACHED_LISTINGS:
+            self._listings.pop(next(iter(self._listings)))
+        self._listings[path] = (mtime, entries)
+        self.app.call_from_thread(self._add_entries, node, token, batch,
+                                  _ShowMore(entries, self.PAGE_SIZE))
+
+    def _add_entries(self, node, token, entries, more=None):
+        scan = self._scans.get(node.id)
+        if scan is None or scan[1] is not token:
+            return
+        for name, path, is_dir in entries:
+            if is_dir:
+                node.add(name, data=path, expand=False, allow_expand=True)
+            else:
+                node.add_leaf(name, data=path)
+        if more is not None and more.offset < len(more.entries):
+            node.add_leaf(f"... {len(more.entries) - more.offset} more", data=more)
+
+    def _add_page(self, node, entries, offset):
+        end = offset + self.PAGE_SIZE
+        self._add_entries(node, self._scans[node.id][1], entries[offset:end],
+                          _ShowMore(entries, end))
 
 class ModelVisualizer(Static):
     """Visualizes the AI model structure."""
@@ -53,6 +140,24 @@ class ModelVisualizer(Static):
         output += "[bold]Output[/]"
         self.update(output)
 
+class ProfilePanel(Static):
+    """Shows the interpreter's hottest statements and primitives."""
+
+    def update_hotspots(self, rows, profiling):
+        if rows is None:
+            self.update("[italic dim]Profiling is off. Type 'Profile on' to start.[/]")
+            return
+        state = "[green]on[/]" if profiling else "[yellow]off[/] (showing last profile)"
+        output = f"[bold underline]Hot spots by self time[/]  profiling {state}\n\n"
+        if not rows:
+            output += "[italic dim]No samples yet.[/]"
+        for r in rows:
+            name = r["name"].replace("[", "\\[")
+            output += (f"[bold cyan]{r['self_ms']:9.2f} ms[/]  {r['kind']:<9} {name}\n"
+                       f"           [dim]{r['count']} calls, {r['wall_ms']:.2f} ms total, "
+                       f"{r['sync_ms']:.2f} ms sync, {r['allocated_bytes'] / 2**20:.2f} MB[/]\n")
+        self.update(output)
+
 class AIAssistant(Static):
     """Provides suggestions and help."""
     
@@ -99,7 +204,7 @@ class APLStudio(App):
         color: $text;
     }
     
-    #viz-area {
+    #viz-area, #profile-area {
         height: 1fr;
         background: $surface;
         border: solid $accent;
@@ -128,12 +233,21 @@ class APLStudio(App):
     }
     """
 
+    BINDINGS = [
+        ("escape", "cancel", "Cancel"),
+        ("ctrl+g", "cancel_all", "Cancel all"),
+    ]
+
     TITLE = "AI-APL Studio"
     SUB_TITLE = "Powered by PyTorch & CUDA | 4-bit FPTQ Ready"
 
     def __init__(self):
         super().__init__()
         self.interpreter = APLInterpreter()
+        # Submitted commands run one at a time on a background thread, so
+        # the UI stays responsive and can queue more while one is running.
+        self._pending = queue.SimpleQueue()
+        self._current = None
 
     def compose(self) -> ComposeResult:
         yield Header()
@@ -147,9 +261,11 @@ class APLStudio(App):
         with Container(id="main-area"):
             with TabbedContent():
                 with TabPane("Console", id="console-tab"):
-                    yield Log(id="output-log", highlight=True, markup=True)
+                    yield Log(id="output-log", highlight=True)
                 with TabPane("Model Visualizer", id="viz-tab"):
                     yield ModelVisualizer(id="viz-area")
+                with TabPane("Profiler", id="profile-tab"):
+                    yield ProfilePanel(id="profile-area")
             
             with Container(id="input-area"):
                 yield Input(placeholder="Type APL code here... (e.g. Layer 'L1' 'Linear' 64)", id="apl-input")
@@ -157,35 +273,87 @@ class APLStudio(App):
         yield Footer()
 
     def on_mount(self) -> None:
+        # Log renders plain text, so no markup here.
+        log = self.query_one(Log)
         self.query_one(FileTree).load_directory(os.getcwd())
-        self.query_one(Log).write("[bold green]Welcome to AI-APL Studio![/]")
-        self.query_one(Log).write(f"Python: {self.interpreter.get_python_version()}")
-        self.query_one(Log).write(f"Device: [bold yellow]{self.interpreter.device}[/]")
-        self.query_one(Log).write("Type 'help' for commands.\n")
+        log.write("Welcome to AI-APL Studio!\n")
+        log.write(f"Python: {self.interpreter.get_python_version()}\n")
+        log.write("Type 'help' for commands.\n\n")
         self.query_one(ModelVisualizer).update_structure(self.interpreter.get_model_structure())
+        self.query_one(ProfilePanel).update_hotspots(None, False)
+        # Start the evaluator (and its torch import) once the first frame is
+        # up; commands typed before then wait in the queue.
+        self.set_timer(0.5, self.evaluate)
 
     def on_input_submitted(self, message: Input.Submitted) -> None:
         code = message.value
         if not code:
             return
             
+        busy = self._current is not None or not self._pending.empty()
+        self.query_one(Log).write(f"> {code}" + ("   (queued)\n" if busy else "\n"))
+        message.input.value = ""
+        self._pending.put(code)
+
+    def on_unmount(self) -> None:
+        self._drop_pending()
+        self.interpreter.cancel()
+        self._pending.put(None)
+
+    def action_cancel(self) -> None:
+        """Stops the running evaluation at its next statement, line or token."""
+        if self._current is not None:
+            self.interpreter.cancel()
+            self.query_one(Log).write("\n(cancelling...)\n")
+
+    def action_cancel_all(self) -> None:
+        """Drops the queued commands and cancels the running one."""
+        dropped = self._drop_pending()
+        if dropped:
+            self.query_one(Log).write(f"Dropped {dropped} queued commands.\n")
+        self.action_cancel()
+
+    def _drop_pending(self):
+        dropped = 0
+        try:
+            while True:
+                self._pending.get_nowait()
+                dropped += 1
+        except queue.Empty:
+            return dropped
+
+    @work(thread=True)
+    def evaluate(self) -> None:
+        """Runs queued commands, streaming their output into the log."""
         log = self.query_one(Log)
-        log.write(f"[bold blue]>[/] {code}")
+        # Picking the device imports torch: do it here, off the UI thread,
+        # while the user types the first command.
+        self.call_from_thread(log.write, f"Device: {self.interpreter.device}\n\n")
+        for code in iter(self._pending.get, None):
+            self.interpreter.interrupt.clear()
+            self._current = code
+            try:
+                for piece in self.interpreter.eval_stream(code):
+                    self.call_from_thread(log.write, piece)
+                self.call_from_thread(log.write, "\n\n")
+            except Interrupted as e:
+                self.call_from_thread(log.write, f"\n{e}\n\n")
+            except Exception as e:
+                self.call_from_thread(log.write, f"Error: {e}\n\n")
+            finally:
+                self._current = None
+            profiler = self.interpreter.profiler
+            hotspots = profiler.hotspots(10) if profiler is not None else None
+            self.call_from_thread(self.on_evaluated, self.interpreter.get_model_structure(),
+                                  hotspots, self.interpreter.profiling)
+
+    def on_evaluated(self, structure, hotspots=None, profiling=False) -> None:
+        # Update visualizer if structure changed
+        self.query_one(ModelVisualizer).update_structure(structure)
+        self.query_one(ProfilePanel).update_hotspots(hotspots, profiling)
         
-        try:
-            result = self.interpreter.eval(code)
-            log.write(f"[bold white]{result}[/]\n")
-            
-            # Update visualizer if structure changed
-            self.query_one(ModelVisualizer).update_structure(self.interpreter.get_model_structure())
-            
-            # Update assistant
-            self.query_one(AIAssistant).update_suggestion()
-            
-        except Exception as e:
-            log.write(f"[bold red]Error: {e}[/]\n")
-            
-        message.input.value = ""
+        # Update assistant
+        self.query_one(AIAssistant).update_suggestion()
 
 if __name__ == "__main__":
     app = APLStudio()
@@ -1,35 +1,52 @@
-import gradio as gr
 try:
-    from .interpreter import APLInterpreter
+    from .sessions import SessionPool
 except ImportError:
-    from interpreter import APLInterpreter
+    from sessions import SessionPool
 import json
+import os
 
-# Initialize interpreter
-interp = APLInterpreter()
+# Every browser session gets its own interpreter inside a worker process
+# (src/sessions.py). Run requests from all of a worker's sessions go through
+# its batch scheduler, and sessions on the same model share one Engine, so
+# concurrent users decode together. Configure with environment variables:
+#   APL_WORKERS, APL_MAX_SESSIONS, APL_SESSION_TTL (seconds),
+#   APL_WORKER_THREADS, APL_WORKER_MEMORY_MB, APL_PIN_CPUS=1
+_pool = None
 
-def execute_code(code, history):
+def get_pool():
+    """The session pool, started on first use (never at import: workers
+    are spawned and re-import this module)."""
+    global _pool
+    if _pool is None:
+        env = lambda name, default=None: int(os.environ.get(name, 0)) or default
+        _pool = SessionPool(workers=env("APL_WORKERS"),
+                            max_sessions=env("APL_MAX_SESSIONS", 64),
+                            idle_ttl=env("APL_SESSION_TTL", 30 * 60),
+                            worker_threads=env("APL_WORKER_THREADS"),
+                            worker_memory_mb=env("APL_WORKER_MEMORY_MB"),
+                            pin_cpus=bool(env("APL_PIN_CPUS")))
+    return _pool
+
+def session_id(request):
+    return getattr(request, "session_hash", None) or "default"
+
+def execute_code(code, history, sid="default"):
     """Executes APL code and returns output + updated history."""
     if not code.strip():
         return "", history, None
     
     try:
-        result = interp.eval(code)
-        # Format result
-        if hasattr(result, 'shape'):
-            output = f"Tensor Shape: {result.shape}\nData:\n{result}"
-        else:
-            output = str(result)
-            
-        history.append((code, output))
-        return "", history, get_structure_md()
+        value = get_pool().eval(sid, code)
+        history += [{"role": "user", "content": code},
+                    {"role": "assistant", "content": value["output"]}]
+        return "", history, get_structure_md(value["layers"])
     except Exception as e:
-        history.append((code, f"Error: {str(e)}"))
-        return "", history, get_structure_md()
+        history += [{"role": "user", "content": code},
+                    {"role": "assistant", "content": f"Error: {str(e)}"}]
+        return "", history, get_structure_md([])
 
-def get_structure_md():
+def get_structure_md(layers):
     """Returns markdown representation of the model structure."""
-    layers = interp.get_model_structure()
     if not layers:
         return "*No model defined.*"
     
@@ -43,9 +60,52 @@ def get_structure_md():
         
     return md
 
-def load_preset(model_name):
-    res = interp.eval(f"LoadModel '{model_name}'")
-    return res, get_structure_md()
+def get_stats_md(sid=None):
+    """Returns markdown with the session pool's and the session's worker's metrics."""
+    pool = get_pool()
+    ps = pool.stats()
+    md = (f"Workers: {ps['alive']}/{ps['workers']} | Sessions: {ps['sessions']} "
+          f"({' / '.join(map(str, ps['per_worker']))}) | Evicted: {ps['evictions']}\n\n")
+    try:
+        ws = pool.session_stats(sid) if sid else None
+    except Exception:
+        ws = None
+    if not ws or not ws["scheduler"]:
+        return md
+    st = ws["scheduler"]
+    lat, ttft = st["latency_ms"], st["ttft_ms"]
+    rss = f"{ws['rss_mb']:.0f} MB" if ws["rss_mb"] is not None else "n/a"
+    return md + (f"Worker RSS: {rss} | Models: {ws['engines']} | Sessions: {ws['sessions']}\n\n"
+            f"| Queue | In flight | Batch (last/mean) | Passes | Requests |\n"
+            f"|---|---|---|---|---|\n"
+            f"| {st['queue_depth']} | {st['active']} | {st['batch_size']} / "
+            f"{st['mean_batch_size']:.1f} | {st['forward_passes']} | {st['completed']} |\n\n"
+            f"Latency p50/p95/p99: {lat['p50']:.0f} / {lat['p95']:.0f} / {lat['p99']:.0f} ms  \n"
+            f"First token p50/p95/p99: {ttft['p50']:.0f} / {ttft['p95']:.0f} / {ttft['p99']:.0f} ms")
+
+def get_profile_md(sid=None):
+    """Returns markdown with the session's profiler hot spots."""
+    try:
+        profile = get_pool().session_stats(sid)["profile"] if sid else None
+    except Exception:
+        profile = None
+    if profile is None:
+        return "*Profiling is off. Run `Profile on` to start.*"
+    state = "on" if profile["on"] else "off (last profile)"
+    if not profile["hotspots"]:
+        return f"Profiling {state}: no samples yet."
+    md = (f"Profiling {state}\n\n"
+          "| Self ms | Calls | Total ms | Sync ms | Alloc MB | Kind | Name |\n"
+          "|---|---|---|---|---|---|---|\n")
+    for r in profile["hotspots"]:
+        name = r["name"].replace("|", "\\|")
+        md += (f"| {r['self_ms']:.2f} | {r['count']} | {r['wall_ms']:.2f} | {r['sync_ms']:.2f} "
+               f"| {r['allocated_bytes'] / 2**20:.2f} | {r['kind']} | `{name}` |\n")
+    return md
+
+def load_preset(model_name, sid="default"):
+    value = get_pool().eval(sid, f"LoadModel '{model_name}'")
+    return value["output"], get_structure_md(value["layers"])
 
 # Custom CSS for a darker, IDE-like feel
 custom_css = """
@@ -53,85 +113,131 @@ custom_css = """
 #code-input textarea { font-family: 'Consolas', 'Monaco', monospace; }
 """
 
-with gr.Blocks(title="AI-APL Studio") as demo:
-    demo.css = custom_css
-    demo.theme = gr.themes.Soft()
-    gr.Markdown("# 🧠 AI-APL Studio Web Interface")
+def build_demo():
+    """Builds the Gradio app (the only place gradio is imported)."""
+    # Spawned session workers re-import this module and never need gradio.
+    import gradio as gr
+
+    with gr.Blocks(title="AI-APL Studio") as demo:
+        demo.css = custom_css
+        demo.theme = gr.themes.Soft()
+        gr.Markdown("# 🧠 AI-APL Studio Web Interface")
     
-    with gr.Row():
-        with gr.Column(scale=2):
-            chatbot = gr.Chatbot(label="Interpreter Session", height=500)
-            code_input = gr.Textbox(
-                label="APL Code Input", 
-                placeholder="Type command here (e.g. Layer 'L1' 'Linear' 64)...",
-                lines=3,
-                elem_id="code-input"
-            )
-            with gr.Row():
-                run_btn = gr.Button("Run Code", variant="primary")
-                clear_btn = gr.Button("Clear Session")
-
-        with gr.Column(scale=1):
-            gr.Markdown("## 🏗️ Model Visualizer")
-            structure_view = gr.Markdown("*No model defined.*")
+        with gr.Row():
+            with gr.Column(scale=2):
+                chatbot = gr.Chatbot(label="Interpreter Session", height=500)
+                code_input = gr.Textbox(
+                    label="APL Code Input", 
+                    placeholder="Type command here (e.g. Layer 'L1' 'Linear' 64)...",
+                    lines=3,
+                    elem_id="code-input"
+                )
+                with gr.Row():
+                    run_btn = gr.Button("Run Code", variant="primary")
+                    clear_btn = gr.Button("Clear Session")
+
+            with gr.Column(scale=1):
+                gr.Markdown("## 🏗️ Model Visualizer")
+                structure_view = gr.Markdown("*No model defined.*")
             
-            gr.Markdown("### Quick Actions")
-            with gr.Row():
-                btn_tiny = gr.Button("Load TinyLlama")
-                btn_mistral = gr.Button("Load Mistral")
+                gr.Markdown("### Serving Metrics")
+                stats_view = gr.Markdown("*No requests yet.*")
+                stats_btn = gr.Button("Refresh Metrics")
+
+                gr.Markdown("### Profiler Hot Spots")
+                profile_view = gr.Markdown("*Profiling is off. Run `Profile on` to start.*")
+
+                gr.Markdown("### Quick Actions")
+                with gr.Row():
+                    btn_tiny = gr.Button("Load TinyLlama")
+                    btn_mistral = gr.Button("Load Mistral")
             
-            gr.Markdown("### Assistant Tips")
-            gr.Markdown("""
-            - Use `Layer 'Name' 'Type' Shape` to build.
-            - Use `LoadModel 'name'` for presets.
-            - Use `Run 'text'` to test inference.
-            """)
-
-    # Event Handlers
-    # Note: Chatbot expects list of [user, bot] messages for 'messages' type? 
-    # Actually for standard Chatbot it is list of tuples.
-    # Let's stick to standard list of tuples for history.
+                gr.Markdown("### Assistant Tips")
+                gr.Markdown("""
+                - Use `Layer 'Name' 'Type' Shape` to build.
+                - Use `LoadModel 'name'` for presets.
+                - Use `Run 'text'` to test inference.
+                """)
+
+        # Event Handlers
+        # Chatbot history is a list of {"role", "content"} messages.
     
-    # Wrapper to handle the history format for Gradio Chatbot
-    def run_wrapper(code, history):
-        # history is list of [msg, response]
-        if history is None: history = []
+        # Wrapper to handle the history format for Gradio Chatbot. It is a
+        # generator: Run output is streamed into the last message as tokens
+        # are decoded, and the side panels update once it is done.
+        def run_wrapper(code, history, request: gr.Request):
+            if history is None: history = []
+            sid = session_id(request)
         
-        if not code.strip():
-            return "", history, get_structure_md()
+            if not code.strip():
+                yield "", history, gr.update(), get_stats_md(sid), gr.update()
+                return
             
-        try:
-            result = interp.eval(code)
-            output = str(result)
-            history.append([code, output])
-        except Exception as e:
-            history.append([code, f"Error: {str(e)}"])
+            reply = {"role": "assistant", "content": ""}
+            history += [{"role": "user", "content": code}, reply]
+            value = {"output": "", "layers": []}
+            try:
+                for value in get_pool().stream(sid, code):
+                    reply["content"] = value["output"]
+                    yield "", history, gr.update(), gr.update(), gr.update()
+            except Exception as e:
+                reply["content"] = f"Error: {str(e)}"
             
-        return "", history, get_structure_md()
+            yield ("", history, get_structure_md(value.get("layers")), get_stats_md(sid),
+                   get_profile_md(sid))
 
-    run_btn.click(
-        run_wrapper, 
-        inputs=[code_input, chatbot], 
-        outputs=[code_input, chatbot, structure_view]
-    )
+        # No per-event concurrency limit: concurrent Run requests must reach
+        # the scheduler together to be batched.
+        run_btn.click(
+            run_wrapper, 
+            inputs=[code_input, chatbot], 
+            outputs=[code_input, chatbot, structure_view, stats_view, profile_view],
+            concurrency_limit=None
+        )
     
-    code_input.submit(
-        run_wrapper, 
-        inputs=[code_input, chatbot], 
-        outputs=[code_input, chatbot, structure_view]
-    )
+        code_input.submit(
+            run_wrapper, 
+            inputs=[code_input, chatbot], 
+            outputs=[code_input, chatbot, structure_view, stats_view, profile_view],
+            concurrency_limit=None
+        )
+
+        def stats_wrapper(request: gr.Request):
+            sid = session_id(request)
+            return get_stats_md(sid), get_profile_md(sid)
+
+        stats_btn.click(stats_wrapper, None, [stats_view, profile_view], queue=False)
     
-    clear_btn.click(lambda: None, None, chatbot, queue=False)
+        clear_btn.click(lambda: None, None, chatbot, queue=False)
     
-    # Preset buttons
-    def preset_wrapper(name, history):
-        if history is None: history = []
-        res, struct = load_preset(name)
-        history.append([f"LoadModel '{name}'", res])
-        return history, struct
+        # Preset buttons
+        def preset_wrapper(name, history, request):
+            if history is None: history = []
+            res, struct = load_preset(name, session_id(request))
+            history += [{"role": "user", "content": f"LoadModel '{name}'"},
+                        {"role": "assistant", "content": res}]
+            return history, struct
+
+        def load_tiny(history, request: gr.Request):
+            return preset_wrapper("tinyllama", history, request)
+
+        def load_mistral(history, request: gr.Request):
+            return preset_wrapper("mistral", history, request)
+
+        btn_tiny.click(load_tiny, inputs=[chatbot], outputs=[chatbot, structure_view])
+        btn_mistral.click(load_mistral, inputs=[chatbot], outputs=[chatbot, structure_view])
+    return demo
+
+_demo = None
 
-    btn_tiny.click(lambda h: preset_wrapper("tinyllama", h), inputs=[chatbot], outputs=[chatbot, structure_view])
-    btn_mistral.click(lambda h: preset_wrapper("mistral", h), inputs=[chatbot], outputs=[chatbot, structure_view])
+def __getattr__(name):
+    # `from src.web_ui import demo` builds the app on first use.
+    global _demo
+    if name == "demo":
+        if _demo is None:
+            _demo = build_demo()
+        return _demo
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
-    demo.launch()
+    build_demo().launch()
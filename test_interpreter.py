@@ -22,9 +22,655 @@ def test_interpreter():
     print(f"Test 3 (A): {res}")
     assert res == 10
 
+def test_scalar_functions():
+    interp = APLInterpreter()
+    interp.eval("A <- 2 3 ⍴ ⍳6")
+
+    # Scalar extension and right-to-left evaluation
+    assert interp.eval("A × 2").tolist() == [[0, 2, 4], [6, 8, 10]]
+    assert interp.eval("2 × 3 + 4") == 14
+    assert interp.eval("-⍳3").tolist() == [0, -1, -2]
+    assert interp.eval("3 | ⍳5").tolist() == [0, 1, 2, 0, 1]
+    assert interp.eval("1 2 3 = 1 5 3").tolist() == [True, False, True]
+
+    # Shapes must agree unless one side is a single element
+    assert interp.eval("A + 1 2").startswith("RANK ERROR")
+    assert interp.eval("1 2 3 + 1 2").startswith("LENGTH ERROR")
+
+def test_lazy_fusion():
+    eager, lazy = APLInterpreter(), APLInterpreter(lazy=True)
+    for name in "ABCD":
+        eager.variables[name] = lazy.variables[name] = torch.rand(4, 5)
+    a_before = lazy.variables["A"].clone()
+
+    for expr in ["A × B + C - D", "(A + 1) × (A + 1)", "+A × 2", "2 5 ⍴ A - B"]:
+        assert torch.equal(eager.eval(expr), lazy.eval(expr)), expr
+
+    # Inputs are never overwritten by in-place fused steps
+    assert torch.equal(lazy.variables["A"], a_before)
+
+    # The chain reuses one buffer, and the plan is cached per graph shape
+    misses = lazy.fusion.misses
+    lazy.eval("A × B + C - D")
+    assert lazy.fusion.misses == misses
+    plan = list(lazy.fusion._plans.values())[-1]
+    assert plan.allocations == 1
+
+    # Assignment materializes
+    lazy.eval("X <- A × 2")
+    assert isinstance(lazy.variables["X"], torch.Tensor)
+
+def test_quantized_matmul():
+    interp = APLInterpreter()
+    interp.eval("M <- 64 128 ⍴ ÷ 1 + ⍳ 64")
+    interp.eval("W <- ⎕Q4 M")
+    assert interp.eval("⍴ W").tolist() == [64, 128]
+    # ⎕Q4 runs on the loaded kernels, in the PackedTensor.quantize format
+    from src.packed import PackedTensor
+    expected = PackedTensor.quantize(interp.variables["M"], bits=4)
+    assert (interp.variables["W"].data == expected.data).all()
+    calls = []
+    quantize = interp.kernels.kernels.quantize_rows
+    interp.kernels.kernels.quantize_rows = lambda *args: calls.append(1) or quantize(*args)
+    interp.eval("⎕Q4 M")
+    assert calls
+    del interp.kernels.kernels.quantize_rows
+
+    # With Threads > 1, ⎕Q4 is quantized in row shards on the pool
+    sharded = APLInterpreter(threads=4, max_threads=4)
+    sharded.variables["M"] = torch.randn(512, 64)
+    calls = []
+    quantize = sharded.kernels.kernels.quantize_rows
+    sharded.kernels.kernels.quantize_rows = lambda x, *args: calls.append(len(x)) or quantize(x, *args)
+    sharded.eval("W <- ⎕Q4 M")
+    assert len(calls) > 1 and sum(calls) == 512
+    expected = PackedTensor.quantize(sharded.variables["M"], bits=4)
+    assert (sharded.variables["W"].data == expected.data).all()
+    # Threads is clamped to the interpreter's limit
+    assert sharded.eval("Threads 100").startswith("Using 4 threads")
+    sharded.kernels.shutdown()
+
+    # Dequantize-on-the-fly matmul against one column and a batch of columns
+    w = interp.variables["W"].to_torch()
+    x = torch.arange(128, dtype=torch.float32)
+    assert torch.allclose(interp.eval("W ⎕QMM ⍳128"), w @ x, rtol=1e-4, atol=1e-3)
+    xs = x[:15].repeat(26)[:384].reshape(128, 3)
+    assert torch.allclose(interp.eval("W ⎕QMM 128 3 ⍴ ⍳15"), w @ xs, rtol=1e-4, atol=1e-3)
+    assert interp.eval("W ⎕QMM ⍳5").startswith("LENGTH ERROR")
+
+def test_parser():
+    from src.apl_parser import Assign, Command, Dyadic, Monadic, Num, parse
+
+    # Right-to-left: 2 3 ⍴ (⍳6)
+    prog = parse("2 3 ⍴ ⍳6")
+    node = prog.statements[0]
+    assert isinstance(node, Dyadic) and node.fn.glyph == "⍴"
+    assert node.left == Num((2.0, 3.0), scalar=False)
+    assert isinstance(node.right, Monadic) and node.right.fn.glyph == "⍳"
+
+    assert isinstance(parse("A ← ¯1.5").statements[0], Assign)
+    assert parse("A ← ¯1.5").statements[0].value == Num((-1.5,))
+    assert parse("Layer 'L 1' 'Linear' 64 3").statements[0] == \
+        Command("Layer", ("L 1", "Linear", "64", "3"))
+
+    # Repeated statements come from the cache
+    before = parse.cache_info().hits
+    parse("2 3 ⍴ ⍳6")
+    assert parse.cache_info().hits == before + 1
+
+    interp = APLInterpreter()
+    assert interp.eval("X ← ⍳3 ⋄ X").tolist() == [0, 1, 2]
+    assert interp.eval("2 3 ⍴").startswith("Syntax error")
+    assert interp.eval("Missing") == "Unknown expression: Missing"
+
+    # Parenthesised vectors are not merged into a flat strand
+    assert parse("1 (2) 3").statements[0] == Num((1.0, 2.0, 3.0), scalar=False)
+    assert interp.eval("(1 2) (3 4)") == "Nested arrays are not supported"
+
+    # Bad arguments are errors, with or without profiling
+    for _ in range(2):
+        assert interp.eval("⍳ 1 2").startswith("RANK ERROR")
+        assert interp.eval("⍳ ¯1").startswith("DOMAIN ERROR")
+        assert interp.eval("2 3 ⍴ 'abc'").startswith("DOMAIN ERROR")
+        assert interp.eval("¯2 ⍴ 1").startswith("DOMAIN ERROR")
+        assert interp.eval("2 3 ⍴ ⍳6 ∘.× 1 2").startswith("RANK ERROR")
+        assert interp.eval("⍳ 0 ÷ 0").startswith("DOMAIN ERROR")
+        assert interp.eval("(0 ÷ 0) ○ 1").startswith("DOMAIN ERROR")
+        assert interp.eval("(2 3 ⍴ ⍳6) ⎕QMM ⍳2").startswith("LENGTH ERROR")
+        assert interp.eval("⎕Q4 2 0 ⍴ 1").startswith("LENGTH ERROR")
+        interp.eval("Profile on")
+    interp.eval("Profile off")
+    # A bug in a primitive is not reported as an APL error
+    interp._monadic_fns["⍳"] = lambda n: torch.zeros(2) + torch.zeros(3)
+    try:
+        interp.eval("⍳ 2")
+        assert False, "expected RuntimeError"
+    except RuntimeError:
+        pass
+
+def test_forward_engine():
+    interp = APLInterpreter()
+    interp.eval("Source 'models/demo.apl'")
+    report = interp.eval("Run 'x'")
+    assert "Output: [32, 10]" in report and "samples/sec" in report
+
+    # Activation buffers are allocated once and reused by later runs
+    engine = interp.get_engine()
+    allocations = engine.scratch.allocations
+    interp.eval("Run 'x'")
+    assert engine.scratch.allocations == allocations
+
+    # Layers compute the real thing: compare a small MLP with torch
+    interp = APLInterpreter()
+    interp.eval("Layer 'A' 'Linear' 8 16")
+    interp.eval("Layer 'R' 'ReLU'")
+    interp.eval("Layer 'B' 'QuantLinear' 16 4")
+    engine = interp.get_engine()
+    a, b = engine.modules[0].weight, engine.modules[2].weight
+    x = torch.randn(3, 8)
+    expected = torch.relu(x @ a.T) @ b.to_torch().T
+    assert torch.allclose(engine.forward(x), expected, atol=1e-4)
+
+    # Token models generate and report throughput
+    interp.layers = []
+    interp.eval("Layer 'E' 'Embedding' 256 64")
+    interp.eval("Layer 'T' 'QuantTransformerBlock' 64")
+    interp.eval("Layer 'H' 'Linear' 64 256")
+    interp.eval("MaxTokens <- 3")
+    report = interp.eval("Run 'hi'")
+    assert "generated 3" in report and "tokens/sec" in report
+
+    # Streamed: the header and first token, one piece per token, the stats
+    pieces = list(interp.eval_stream("Run 'hi'"))
+    assert len(pieces) == 4
+    assert pieces[0].startswith("Running inference on 'hi'") and "Output: " in pieces[0]
+    tokens = [int(t) for t in report.split("generated 3: [")[1].split("]")[0].split(",")]
+    assert "".join(pieces).split("\nPrompt:")[0] == report.split("\nPrompt:")[0]
+    assert f"generated 3: {tokens}" in pieces[-1]
+    assert list(interp.eval_stream("X ← 2")) == ["X assigned."]
+
+    # Cancelling stops a stream at the next token, and eval at the next statement
+    from src.interpreter import Interrupted
+    stream = interp.eval_stream("Run 'hi'")
+    next(stream)
+    interp.cancel()
+    try:
+        next(stream)
+        assert False, "expected Interrupted"
+    except Interrupted:
+        pass
+    assert interp.eval("X ← 3") == "Interrupted."
+    interp.interrupt.clear()
+    assert interp.eval("X ← 3") == "X assigned."
+    pieces = list(APLInterpreter().eval_stream("Source 'models/demo.apl'"))
+    assert pieces[0].startswith("[1] ") and pieces[-1].startswith("Executed")
+
+    interp.eval("Layer 'Bad' 'Linear' 10 2")
+    assert interp.eval("Run 'hi'").startswith("Error: Layer Bad (Linear): expects 10 features")
+
+def test_kv_cache():
+    from src.kv_cache import CacheFull, PagedKVCache
+
+    # Two layers, 2 heads of 4: each page holds 4 tokens
+    page_bytes = 2 * 2 * 4 * 2 * 4 * 4
+    cache = PagedKVCache(2, 2, 4, budget_bytes=3 * page_bytes, page_size=4)
+    assert cache.num_pages == 3
+    assert cache.reserve("a", [1, 2, 3]) == 0
+    assert cache.reserve("a", [4, 5]) == 3
+    assert cache.stats()["pages_used"] == 2
+    rows = cache.slots("a", 0, 5)
+    k = torch.randn(5, 2, 4)
+    cache.write(1, rows, k, -k)
+    keys, values = cache.read(1, rows)
+    assert torch.equal(keys, k) and torch.equal(values, -k)
+
+    # A full pool evicts the least recently used sequence, never a protected one
+    cache.reserve("b", [7] * 4)
+    cache.reserve("c", [8] * 4, protect=("b",))
+    assert "a" not in cache and "b" in cache and cache.evictions == 1
+    try:
+        cache.reserve("d", [9] * 8, protect=("b", "c"))
+        assert False, "expected CacheFull"
+    except CacheFull:
+        pass
+    # A reserve that fails leaves no entry behind and evicts nothing
+    try:
+        cache.reserve("d", [9] * 12, protect=("b",))
+        assert False, "expected CacheFull"
+    except CacheFull:
+        pass
+    assert "d" not in cache and "c" in cache and cache.evictions == 1
+
+    # Cached decoding matches recomputing the whole sequence every step
+    interp = APLInterpreter()
+    interp.eval("Layer 'E' 'Embedding' 256 64")
+    interp.eval("Layer 'T0' 'TransformerBlock' 64")
+    interp.eval("Layer 'T1' 'QuantTransformerBlock' 64")
+    interp.eval("Layer 'H' 'Linear' 64 256")
+    engine = interp.get_engine()
+    ids, expected = list(b"paged"), []
+    for _ in range(6):
+        logits = engine.forward(torch.tensor([ids + expected]))
+        expected.append(int(torch.argmax(logits[0, -1])))
+    assert list(engine.generate(ids, 6)) == expected
+    assert engine.kv_stats()["sequences"] == 0
+
+    # Run keeps its sequence cached; a repeated prompt reuses the prefix
+    interp.eval("MaxTokens <- 4")
+    interp.eval("Run 'paged'")
+    assert engine.kv_stats()["tokens"] == 5 + 3
+    assert "1 sequences" in interp.eval("KVCache")
+
+    # A batched step that does not fit reserves nothing for any sequence
+    engine.set_kv_budget(2 * engine.cache.page_bytes)
+    engine.forward(torch.tensor([[1]]), seq_ids=["x"])
+    page = engine.cache.page_size
+    try:
+        engine.forward(torch.tensor([[2] * page, [3] * page]), seq_ids=["x", "y"])
+        assert False, "expected CacheFull"
+    except CacheFull:
+        pass
+    assert engine.cache.tokens("x") == [1] and "y" not in engine.cache
+
+    # A cache that fills partway through a Run ends the output with an error
+    engine.set_kv_budget(2 * engine.cache.page_bytes)
+    interp.eval("MaxTokens <- 40")
+    pieces = list(interp.eval_stream("Run 'Hi'"))
+    assert pieces[0].startswith("Running inference on 'Hi'") and len(pieces) > 2
+    assert "\nError: " in pieces[-1] and "do not fit" in pieces[-1]
+    assert "\nError: " in interp.eval("Run 'Hi'")
+
+def test_batch_scheduler():
+    import threading
+    from src.engine import encode
+    from src.scheduler import BatchScheduler
+
+    interp = APLInterpreter()
+    interp.eval("Layer 'E' 'Embedding' 256 64")
+    interp.eval("Layer 'T' 'QuantTransformerBlock' 64")
+    interp.eval("Layer 'H' 'Linear' 64 256")
+    scheduler = BatchScheduler(interp)
+    try:
+        assert scheduler.eval("MaxTokens <- 5") == "MaxTokens assigned."
+
+        # Concurrent users share decode passes and get the same tokens as
+        # running alone
+        requests = []
+        threads = [threading.Thread(target=lambda i=i: requests.append(scheduler.submit(f"q{i}")))
+                   for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        reports = [r.result(timeout=30) for r in requests]
+        assert all("generated 5" in r for r in reports)
+        engine = interp.get_engine()
+        for r in requests:
+            assert r.tokens == list(engine.generate(encode(r.text, 256), 5))
+
+        st = scheduler.stats()
+        assert st["completed"] == 6 and st["queue_depth"] == 0
+        assert st["forward_passes"] < 6 * 5
+        assert st["latency_ms"]["p50"] > 0
+        assert engine.kv_stats()["sequences"] == 0
+
+        assert "tokens/sec" in scheduler.eval("Run 'hello'")
+
+        # Streaming yields each token as its decode step finishes
+        pieces = list(scheduler.stream("Run 'hello'"))
+        assert len(pieces) == 6 and pieces[0].startswith("Running inference")
+        assert "".join(pieces).split("\nPrompt:")[0] == \
+            scheduler.eval("Run 'hello'").split("\nPrompt:")[0]
+
+        # When the cache cannot grow both sequences, the newer one is
+        # preempted and resumed later; neither fails and the tokens match
+        expected = {t: list(engine.generate(encode(t, 256), 20)) for t in ("q0", "q1")}
+        engine.set_kv_budget(3 * engine.cache.page_bytes)
+        with scheduler.lock:
+            requests = [scheduler.submit(t, max_tokens=20) for t in ("q0", "q1")]
+        assert all("generated 20" in r.result(timeout=30) for r in requests)
+        assert all(r.tokens == expected[r.text] for r in requests)
+        assert scheduler.stats()["preemptions"] > 0
+    finally:
+        scheduler.close()
+
+def test_session_pool():
+    from src.sessions import SessionPool
+
+    pool = SessionPool(workers=2, max_sessions=3)
+    try:
+        # Sessions are isolated and spread over both workers
+        assert pool.eval("a", "x <- 1")["output"] == "x assigned."
+        assert pool.eval("b", "x <- 2")["output"] == "x assigned."
+        assert pool.eval("a", "x")["output"] == "tensor(1.)"
+        assert pool.eval("b", "x")["output"] == "tensor(2.)"
+        assert pool.stats()["per_worker"] == [1, 1]
+        value = pool.eval("a", "Layer 'L1' 'Linear' 8 4")
+        assert [l["name"] for l in value["layers"]] == ["L1"]
+        assert pool.eval("b", "Layer 'L2' 'Linear' 8 4")["layers"][0]["name"] == "L2"
+        assert pool.session_stats("a")["sessions"] == 1
+
+        # Beyond max_sessions the least recently used session is dropped
+        pool.eval("c", "y <- 3")
+        pool.eval("d", "y <- 4")
+        assert pool.stats()["sessions"] == 3 and pool.evictions == 1
+        assert "Unknown" in pool.eval("a", "x")["output"]
+
+        # Idle sessions expire
+        pool.idle_ttl = 0
+        assert pool.stats()["sessions"] == 0
+        pool.idle_ttl = 60
+
+        # Run output streams from the worker
+        pool.eval("e", "Layer 'E' 'Embedding' 256 64")
+        pool.eval("e", "MaxTokens <- 3")
+        values = list(pool.stream("e", "Run 'hi'"))
+        assert len(values) == 5 and "layers" in values[-1]
+        assert values[-1]["output"] == values[-2]["output"]
+        assert values[0]["output"].startswith("Running inference on 'hi'")
+    finally:
+        pool.shutdown()
+    assert pool.stats()["alive"] == 0
+
+    # A worker's sessions share its scheduler, and one Engine per model, so
+    # concurrent Runs from different sessions decode in the same passes
+    import gc
+    import threading
+    from src.sessions import SessionHost
+    host = SessionHost()
+    try:
+        for sid in "abcd":
+            for line in ("Layer 'E' 'Embedding' 256 64", "Layer 'T' 'TransformerBlock' 64",
+                         "MaxTokens <- 4"):
+                host.handle("eval", sid, line, None)
+        engines = {id(host.sessions[sid].interp.get_engine()) for sid in "abcd"}
+        assert len(engines) == 1 and len(host.engines) == 1
+        outputs = {}
+        threads = [threading.Thread(target=lambda sid=sid: outputs.update(
+            {sid: host.handle("eval", sid, f"Run 'q{sid}'", None)["output"]})) for sid in "abcd"]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert all("generated 4" in outputs[sid] for sid in "abcd")
+        st = host.handle("stats", "a", None, None)
+        assert st["scheduler"]["completed"] == 4 and st["scheduler"]["forward_passes"] < 4 * 4
+        # Another model (or KV budget) gets its own Engine; sessions stay isolated
+        host.handle("eval", "d", "KVCache 64", None)
+        host.handle("eval", "d", "Run 'x'", None)
+        assert len(host.engines) == 2
+        assert host.handle("eval", "a", "MaxTokens", None)["output"] == "tensor(4.)"
+        # torch's thread count is the worker's cap; a session cannot resize it
+        torch_threads = torch.get_num_threads()
+        assert host.handle("eval", "a", "Threads 4", None)["output"].startswith("Using 1 threads")
+        assert torch.get_num_threads() == torch_threads
+        host.close("d")
+        gc.collect()
+        assert len(host.engines) == 1
+    finally:
+        host.shutdown()
+
+def test_program_cache():
+    import os
+    import tempfile
+    from src.programs import ProgramCache
+
+    with tempfile.TemporaryDirectory() as tmp:
+        script = os.path.join(tmp, "model.apl")
+        with open(script, "w", encoding="utf-8") as f:
+            f.write("# comment\nLayer 'A' 'Linear' 8 4\n\nX <- 2 3\n2 3 ⍴\nY <- X + 1\n")
+        cache = ProgramCache("test", os.path.join(tmp, "cache"))
+        program = cache.load(script)
+        assert [l.source for l in program.lines][0] == "Layer 'A' 'Linear' 8 4"
+        assert program.lines[0].layer == ("A", "Linear", ("8", "4"))
+        assert program.lines[2].error.startswith("Syntax error")
+        assert cache.misses == 1 and os.listdir(cache.directory)
+
+        # Another process (a fresh cache) loads it from disk; edits recompile
+        fresh = ProgramCache("test", cache.directory)
+        assert fresh.load(script) == program and fresh.disk_hits == 1
+        assert fresh.load(script) == program and fresh.hits == 1
+        assert ProgramCache("other", cache.directory).load(script).digest != program.digest
+        with open(script, "a", encoding="utf-8") as f:
+            f.write("Z <- 1\n")
+        assert len(fresh.load(script).lines) == 5 and fresh.misses == 1
+
+        interp = APLInterpreter()
+        assert interp.eval(f"Source '{script}'") == f"Executed 5 commands from {script}"
+        assert interp.layers[0]["name"] == "A"
+        assert interp.eval("Y").tolist() == [3.0, 4.0]
+
+def test_deferred_imports():
+    import os
+    import subprocess
+    import sys
+
+    # help, Layer and Lazy work without importing torch
+    code = ("import sys; from src.interpreter import APLInterpreter; i = APLInterpreter(); "
+            "i.eval('help'); i.eval(\"Layer 'A' 'QuantLinear' 8 4\"); i.eval('Lazy on'); "
+            "assert 'torch' not in sys.modules, 'torch imported'; "
+            "assert i.eval('1 + 2').item() == 3; assert 'torch' in sys.modules")
+    subprocess.run([sys.executable, "-c", code], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+
+def test_daemon():
+    import asyncio
+    import os
+    import tempfile
+    import threading
+    import time
+    from src.daemon import Daemon, DaemonClient
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "apl.sock")
+        assert DaemonClient.connect(path) is None
+        daemon = Daemon(path, max_sessions=2)
+        thread = threading.Thread(target=asyncio.run, args=(daemon.run(),), daemon=True)
+        thread.start()
+        for _ in range(200):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+        # Only the owner can connect
+        assert os.stat(path).st_mode & 0o077 == 0
+        client = DaemonClient.connect(path)
+        other = DaemonClient.connect(path)
+        try:
+            # Setup runs once per session; sessions are isolated
+            reply = client.eval("x", session="a", setup="x <- 1")
+            assert reply["setup"] == "x assigned." and reply["output"] == "tensor(1.)"
+            assert client.eval("x", session="a", setup="x <- 5")["setup"] is None
+            assert other.eval("x <- 2", session="b")["output"] == "x assigned."
+            assert client.eval("x", session="a")["output"] == "tensor(1.)"
+            assert other.eval("x", session="b")["output"] == "tensor(2.)"
+
+            # Run output streams piece by piece
+            client.eval("Layer 'E' 'Embedding' 256 64", session="a")
+            client.eval("MaxTokens <- 3", session="a")
+            pieces = []
+            reply = client.eval("Run 'hi'", session="a", on_piece=pieces.append)
+            assert len(pieces) == 4 and "".join(pieces) == reply["output"]
+            assert reply["layers"][0]["name"] == "E"
+
+            # Least recently used sessions are dropped beyond max_sessions
+            other.eval("y <- 3", session="c")
+            assert sorted(client.request(op="stats")["sessions"]) == ["a", "c"]
+            client.request(op="close", session="a")
+            assert client.request(op="stats")["sessions"] == ["c"]
+            try:
+                client.request(op="bogus")
+                assert False, "unknown op accepted"
+            except RuntimeError as e:
+                assert "unknown op" in str(e)
+            assert client.request(op="shutdown")["stopping"]
+        finally:
+            client.close()
+            other.close()
+        thread.join(30)
+        assert not thread.is_alive() and not os.path.exists(path)
+
+def test_bench_suite():
+    from scripts.bench_suite import CASES, compare, run
+
+    cases = [c for c in CASES if c.name in ("eval.scalar", "ui.structure_md")]
+    results = run(cases, quick=True, repeat=2, min_time=0.001, log=lambda _: None)
+    assert results["eval.scalar"]["median_ms"] > 0 and results["eval.scalar"]["stmt/s"] > 0
+    assert results["ui.structure_md"]["params"] == {"layers": 200}
+
+    slower = {name: dict(entry, median_ms=entry["median_ms"] * 1.5)
+              for name, entry in results.items()}
+    baseline = {"results": results}
+    assert {s for _, s, _ in compare(slower, baseline)} == {"regression"}
+    rows = compare(slower, baseline, 0.1, [("ui.*", 0.6)])
+    assert dict((n, s) for n, s, _ in rows) == {"eval.scalar": "regression", "ui.structure_md": "ok"}
+    assert compare(results, {"results": {}})[0][1] == "new"
+    changed = {"results": {"eval.scalar": dict(results["eval.scalar"], params={"stmt": "2"})}}
+    assert compare({"eval.scalar": results["eval.scalar"]}, changed)[0][1] == "changed"
+
+def test_profiler():
+    import json
+    import os
+    import tempfile
+    from src.apl_parser import Dyadic
+
+    interp = APLInterpreter()
+    assert interp.eval("Profile").startswith("Profile: not started")
+    plain = interp._node_handlers[Dyadic]
+    assert interp.eval("Profile on") == "Profiling on."
+    for _ in range(3):
+        interp.eval("A <- (⍳100) × 2 + 1")
+    interp.eval("W <- ⎕Q4 10 10 ⍴ A")
+    profiler = interp.profiler
+    stats = {name: s for (kind, name), s in profiler.stats.items()}
+    assert stats["A <- (⍳100) × 2 + 1"].count == 3 and stats["⍳"].count == 3
+    assert stats["×"].wall >= stats["×"].self_time >= 0
+    assert stats["⍳"].allocated == 3 * 100 * 8  # int64 result bytes on CPU
+    assert profiler.hotspots(2)[0]["self_ms"] >= profiler.hotspots(2)[1]["self_ms"]
+    assert "W <- ⎕Q4 10 10 ⍴ A" in interp.eval("Profile report 20")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "trace.json")
+        assert interp.eval(f"Profile trace '{path}'").startswith("Wrote")
+        with open(path, encoding="utf-8") as f:
+            events = json.load(f)["traceEvents"]
+        assert {e["cat"] for e in events} >= {"statement", "monadic", "dyadic"}
+        assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+
+    # Off restores the original handlers and keeps the profile
+    assert interp.eval("Profile off") == "Profiling off."
+    assert interp._node_handlers[Dyadic] == plain and "_exec" not in vars(interp)
+    count = stats["⍳"].count
+    interp.eval("⍳5")
+    assert stats["⍳"].count == count and "⍳" in interp.eval("Profile")
+    interp.eval("Profile reset")
+    assert interp.eval("Profile") == "Profile: no samples yet."
+
+def test_products():
+    from src.apl_parser import Derived, Prim, parse
+
+    node = parse("A +.× B").statements[0]
+    assert node.fn == Derived(".", Prim("+"), Prim("×")) and node.fn.glyph == "+.×"
+    assert parse("A ∘.= B").statements[0].fn.glyph == "∘.="
+
+    interp = APLInterpreter()
+    a, b = torch.rand(3, 4), torch.rand(4, 5)
+    interp.variables.update(A=a, B=b, V=torch.rand(4))
+
+    # +.× is a matrix product for any ranks; scalars extend
+    assert torch.allclose(interp.eval("A +.× B"), a @ b)
+    assert torch.allclose(interp.eval("A +.× V"), a @ interp.variables["V"])
+    assert interp.eval("1 2 3 +.× 4 5 6") == 32
+    assert interp.eval("2 +.× 1 2 3") == 12
+    assert interp.eval("(2 3 ⍴ ⍳6) +.× 3 2 ⍴ ⍳6").tolist() == [[10, 13], [28, 40]]
+    assert interp.eval("A +.× A").startswith("LENGTH ERROR")
+
+    # Other pairs broadcast and reduce; non-reducible f folds right to left
+    assert torch.allclose(interp.eval("A ⌈.+ B"), (a[:, :, None] + b[None]).amax(1))
+    assert torch.allclose(interp.eval("A ⌊.- B"), (a[:, :, None] - b[None]).amin(1))
+    assert interp.eval("(2 2 ⍴ 1 2 3 4) ∧.= 2 2 ⍴ 1 3 2 4").tolist() == [[True, False], [False, True]]
+    assert interp.eval("(1 3 ⍴ 8 4 2) -.÷ 3 1 ⍴ 2 2 2").tolist() == [[4 - (2 - 1)]]
+
+    # ∘.g: every pair, shape ⍴A, ⍴B
+    assert interp.eval("(⍳3) ∘.× ⍳4").tolist() == [[i * j for j in range(4)] for i in range(3)]
+    assert torch.equal(interp.eval("(⍳3) ∘.= ⍳3"), torch.eye(3, dtype=torch.bool))
+    assert interp.eval("A ∘.- B").shape == (3, 4, 4, 5)
+    assert interp.eval("A ∘.⍴ B").startswith("DOMAIN ERROR")
+    assert interp.eval("+.× A").startswith("VALENCE ERROR")
+    assert interp.eval("7 +.× ⍳0") == 0 and interp.eval("(2 0 ⍴ 0) ⌈.+ 0 3 ⍴ 0").shape == (2, 3)
+
+    # Packed weights go to the quantized kernels, on either side
+    interp.eval("W <- ⎕Q4 B")
+    w = interp.variables["W"].to_torch()
+    assert torch.allclose(interp.eval("A +.× W"), a @ w, atol=1e-5)
+    assert torch.allclose(interp.eval("W +.× ⍳5"), w @ torch.arange(5.0), atol=1e-4)
+    assert interp.eval("W ⌈.+ ⍳5").startswith("DOMAIN ERROR")
+
+def test_reduce_scan():
+    from src.apl_parser import Derived, Prim, parse
+    from src.operators import tree_reduce, tree_scan
+
+    assert parse("+/[1] A").statements[0].fn == Derived("/", Prim("+"), axis=1)
+    assert parse("+⍀ A").statements[0].fn.glyph == "+⍀"
+
+    interp = APLInterpreter()
+    m = torch.rand(3, 4, 5)
+    interp.variables.update(M=m, B=torch.rand(6, 7) > 0.5)
+
+    # Known functions: one torch kernel along the last, first or any axis
+    assert torch.allclose(interp.eval("+/ M"), m.sum(2))
+    assert torch.allclose(interp.eval("+⌿ M"), m.sum(0))
+    assert torch.allclose(interp.eval("⌈/[1] M"), m.amax(1))
+    assert torch.allclose(interp.eval("+\\ M"), m.cumsum(2))
+    assert torch.allclose(interp.eval("×⍀ M"), m.cumprod(0))
+    assert torch.allclose(interp.eval("⌊\\[1] M"), m.cummin(1).values)
+    assert interp.eval("+/ ⍳5") == 10 and interp.eval("+/ 7") == 7
+    assert interp.eval("+/ ⍳0") == 0 and interp.eval("×/ ⍳0") == 1
+
+    # APL folds right to left: -/ is an alternating sum, ÷/ an alternating product
+    assert interp.eval("-/ 1 2 3 4") == 1 - (2 - (3 - 4))
+    assert interp.eval("-\\ 1 2 3 4").tolist() == [1, -1, 2, -2]
+    assert interp.eval("÷/ 8 4 2") == 8 / (4 / 2)
+    assert interp.eval("|/ 3 5 7") == (7 % 5) % 3
+    assert interp.eval("*\\ 2 3 2").tolist() == [2, 8, 512]
+
+    # Associative functions without a kernel reduce as a tree
+    b = interp.variables["B"]
+    assert torch.equal(interp.eval("≠/ B"), b.sum(1) % 2 == 1)
+    assert torch.equal(interp.eval("≠\\ B"), b.cumsum(1) % 2 == 1)
+    assert torch.equal(interp.eval("=⌿ B"), tree_reduce(torch.eq, b, 0))
+    x = torch.arange(1, 12)
+    assert tree_reduce(torch.add, x, 0) == 66
+    assert torch.equal(tree_scan(torch.add, x, 0), x.cumsum(0))
+
+    assert interp.eval("+/[3] M").startswith("AXIS ERROR")
+    assert interp.eval("2 +/ M").startswith("NONCE ERROR")
+    assert interp.eval("⌈/ ⍳0") == -float("inf")
+    assert interp.eval("⍳/ M").startswith("DOMAIN ERROR")
+
+    # Lazy mode fuses the reduction with the chain that feeds it
+    lazy = APLInterpreter(lazy=True)
+    lazy.variables["M"] = m
+    assert torch.allclose(lazy.eval("+/ M × 2 + M"), (m * (2 + m)).sum(2))
+    assert torch.equal(lazy.variables["M"], m)
+
 if __name__ == "__main__":
     try:
         test_interpreter()
+        test_scalar_functions()
+        test_lazy_fusion()
+        test_quantized_matmul()
+        test_parser()
+        test_forward_engine()
+        test_kv_cache()
+        test_batch_scheduler()
+        test_session_pool()
+        test_program_cache()
+        test_deferred_imports()
+        test_daemon()
+        test_bench_suite()
+        test_profiler()
+        test_products()
+        test_reduce_scan()
         print("All backend tests passed!")
     except Exception as e:
         print(f"Tests failed: {e}")
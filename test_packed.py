@@ -0,0 +1,287 @@
+import numpy as np
+import torch
+
+from src.packed import PackedTensor
+
+def test_packed_storage():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((16, 128)).astype(np.float32)
+
+    # Two values per byte for INT4, eight for BIT1
+    q4 = PackedTensor.quantize(x, bits=4, group_size=64)
+    q1 = PackedTensor.quantize(x, bits=1, group_size=64)
+    assert q4.data.nbytes == x.size // 2
+    assert q1.data.nbytes == x.size // 8
+    assert q4.scales.shape == (16, 2)
+
+    # Round trip error is bounded by half a quantization step
+    step = q4.scales.max()
+    assert np.abs(q4.numpy() - x).max() <= step / 2 + 1e-6
+
+    # NumPy and torch dequantization agree
+    assert np.allclose(q4.to_torch().numpy(), q4.numpy())
+    assert q4.to_torch(torch.float16).dtype == torch.float16
+
+    # Leading-axis indexing returns packed views over the same bytes
+    rows = q4[2:5]
+    assert isinstance(rows, PackedTensor) and rows.shape == (3, 128)
+    assert np.shares_memory(rows.data, q4.data)
+    assert np.allclose(rows.numpy(), q4.numpy()[2:5])
+    assert np.allclose(q4[3, 10:20], q4.numpy()[3, 10:20])
+
+    # Ragged groups and higher-rank shapes
+    y = rng.standard_normal((2, 3, 70)).astype(np.float32)
+    q = PackedTensor.from_torch(torch.from_numpy(y), bits=4, group_size=32)
+    assert q.numpy().shape == y.shape
+    assert np.allclose(q[1].numpy(), q.numpy()[1])
+    assert np.abs(q.numpy() - y).max() <= q.scales.max() / 2 + 1e-6
+
+def test_prototype_tensor():
+    from prototype import DataType, Tensor
+
+    t = Tensor((8, 64), DataType.INT4)
+    assert t.nbytes < 8 * 64
+    assert np.all(t.numpy() == 0)
+
+    q = Tensor.quantize(np.ones((4, 64)), DataType.BIT1)
+    assert q.data.data.nbytes == 4 * 64 // 8
+
+def test_backend_kernels():
+    from src.native import TorchBackend, load_backend
+
+    fallback = TorchBackend()
+    backend = load_backend() or fallback
+    w = torch.randn(24, 37)
+
+    # Native and fallback produce the ⎕Q4 format, byte for byte
+    for x, group_size in ((w, 128), (torch.randn(5, 300) * 3, 64), (torch.ones(2, 9), 4)):
+        expected = PackedTensor.quantize(x, bits=4, group_size=group_size)
+        for q in (backend.quantize_4bit(x, group_size), fallback.quantize_4bit(x, group_size)):
+            assert np.array_equal(q.data, expected.data)
+            assert np.array_equal(q.scales, expected.scales)
+            assert np.array_equal(q.zero_points, expected.zero_points)
+    a = backend.quantize_4bit(w)
+    assert a.data.shape == (24, 19)
+
+    x = torch.randn(37, 3)
+    expected = a.to_torch() @ x
+    assert torch.allclose(backend.matmul_4bit(a, x), expected, atol=1e-4)
+    assert torch.allclose(backend.matmul_4bit(a, x[:, 0]), expected[:, 0], atol=1e-4)
+
+    # Group-wise asymmetric weights, decode (K=1) and prefill (K>1) shapes
+    g = PackedTensor.quantize(torch.randn(21, 200), bits=4, group_size=64)
+    for k in (1, 5, 20):
+        x = torch.randn(200, k)
+        expected = g.to_torch() @ x
+        assert torch.allclose(backend.matmul_4bit(g, x), expected, atol=1e-3)
+        assert torch.allclose(fallback.matmul_4bit(g, x), expected, atol=1e-3)
+
+    # Long per-row groups (zero point 8) keep fp32 accuracy: an input with a
+    # large mean must not cancel in the zero point term
+    w = PackedTensor.quantize(torch.randn(16, 4096) * 0.02, bits=4, group_size=4096,
+                              symmetric=True)
+    for k in (1, 8):
+        x = torch.randn(4096, k) + 1
+        expected = w.to_torch().double() @ x.double()
+        error = (backend.matmul_4bit(w, x).double() - expected).norm() / expected.norm()
+        assert error < 1e-5
+
+def test_row_sharded_kernels():
+    from src.native import TorchBackend, load_backend
+    from src.parallel import ParallelKernels, cpu_count, shard_ranges
+
+    # Shards are aligned, cover every row once, and respect the minimum size
+    ranges = shard_ranges(1000, 4)
+    assert ranges[0][0] == 0 and ranges[-1][1] == 1000
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    assert all(r0 % 4 == 0 for r0, _ in ranges)
+    assert shard_ranges(100, 8) == [(0, 100)]
+
+    backend = load_backend() or TorchBackend()
+    serial, pool = ParallelKernels(backend, 1), ParallelKernels(backend, 4, max_threads=4)
+    try:
+        x = torch.randn(700, 96)
+        assert np.array_equal(pool.quantize_4bit(x).data, serial.quantize_4bit(x).data)
+
+        w = PackedTensor.quantize(x, bits=4)
+        cols = torch.randn(96, 3)
+        assert torch.allclose(pool.matmul_4bit(w, cols), serial.matmul_4bit(w, cols), atol=1e-5)
+    finally:
+        pool.shutdown()
+
+    # Without an explicit limit the pool is at most one thread per core
+    threads = torch.get_num_threads()
+    pool = ParallelKernels(backend, 10**6)
+    assert pool.threads == cpu_count()
+    pool.shutdown()
+    assert torch.get_num_threads() == threads
+
+def _write_safetensors(path, tensors):
+    import json, struct
+    header, blobs, offset = {}, [], 0
+    for name, t in tensors.items():
+        raw = t.contiguous().view(torch.uint8).numpy().tobytes()
+        dtype = {torch.float32: "F32", torch.bfloat16: "BF16"}[t.dtype]
+        header[name] = {"dtype": dtype, "shape": list(t.shape),
+                        "data_offsets": [offset, offset + len(raw)]}
+        blobs.append(raw)
+        offset += len(raw)
+    meta = json.dumps(header).encode()
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(meta)) + meta + b"".join(blobs))
+
+def test_convert_model(tmp_path):
+    import json
+    from scripts.convert_model import convert
+
+    weights = {"fc.weight": torch.randn(40, 96), "fc.bias": torch.randn(40),
+               "emb.weight": torch.randn(10, 70).to(torch.bfloat16)}
+    source = tmp_path / "model.safetensors"
+    _write_safetensors(source, weights)
+    torch.save({"state_dict": weights}, tmp_path / "model.pt")
+
+    for src, workers in ((source, 1), (tmp_path / "model.pt", 2)):
+        out = str(tmp_path / f"{src.stem}_{workers}.apl_bin")
+        manifest = convert(str(src), out, bits=4, group_size=32, workers=workers, log=lambda _: None)
+        with open(out + ".json") as f:
+            assert json.load(f) == manifest
+        layers = {e["name"]: e for e in manifest["layers"]}
+        assert set(layers) == set(weights)
+        assert layers["fc.bias"]["dtype"] == "float32"
+
+        # Blobs are aligned and decode back to the source weights
+        raw = np.fromfile(out, dtype=np.uint8)
+        def blob(rec):
+            assert rec["offset"] % 64 == 0
+            chunk = raw[rec["offset"]:rec["offset"] + rec["nbytes"]]
+            return chunk.view(rec["dtype"]).reshape(rec["shape"])
+        for name, e in layers.items():
+            expected = weights[name].float().numpy()
+            if "bits" not in e:
+                assert np.array_equal(blob(e["data"]), expected)
+                continue
+            assert e["dtype"] == "int4" and e["shape"] == list(expected.shape)
+            q = PackedTensor(blob(e["data"]), e["shape"], e["bits"], blob(e["scales"]),
+                             blob(e["zeros"]), e["group_size"], e["symmetric"])
+            assert np.abs(q.numpy() - expected).max() <= q.scales.max() / 2 + 1e-5
+
+def test_apl_bin_loader(tmp_path):
+    from scripts.convert_model import convert
+    from src.apl_bin import AplBinFile
+    from src.interpreter import APLInterpreter
+
+    weights = {"embed.weight": torch.randn(16, 64), "fc.weight": torch.randn(8, 64),
+               "fc.bias": torch.randn(8)}
+    source = tmp_path / "model.safetensors"
+    _write_safetensors(source, weights)
+    out = str(tmp_path / "model.apl_bin")
+    convert(str(source), out, bits=2, group_size=32, log=lambda _: None)
+
+    # Tensors are views over the mapping, created on first access
+    f = AplBinFile(out)
+    assert len(f) == 3 and not f._tensors
+    w = f["fc.weight"]
+    assert isinstance(w, PackedTensor) and w.bits == 2 and w.shape == (8, 64)
+    assert np.shares_memory(w.data, f._buffer)
+    assert np.shares_memory(f["fc.bias"], f._buffer)
+    assert np.array_equal(f["fc.bias"], weights["fc.bias"].numpy())
+    assert f["fc.weight"] is w
+    assert torch.allclose(w.to_torch(), torch.from_numpy(w.numpy()))
+
+    interp = APLInterpreter()
+    assert "3 tensors in 2 layers" in interp.eval(f"LoadModel '{out}'")
+    assert [(l["name"], l["type"]) for l in interp.layers] == [("embed", "Embedding"), ("fc", "Linear")]
+    assert interp.layers[1]["params"] == {"weight": "fc.weight", "bias": "fc.bias"}
+    assert interp.layers[1]["quantization"].startswith("2-bit packed")
+    assert interp.eval("LoadModel 'missing.apl_bin'") == "File not found: missing.apl_bin"
+    (tmp_path / "bad.apl_bin").write_bytes(b"\0" * 100)
+    assert "not an .apl_bin file" in interp.eval(f"LoadModel '{tmp_path / 'bad.apl_bin'}'")
+
+def test_calibrated_quantization(tmp_path):
+    from scripts.convert_model import convert
+    from src.calibration import (ErrorStats, column_weights, dequantize_groups,
+                                 quantize_calibrated, search_clipping)
+
+    rng = np.random.default_rng(1)
+    w = rng.standard_normal((64, 256)).astype(np.float32)
+    acts = (rng.standard_normal((128, 256)) * np.exp(rng.standard_normal(256))).astype(np.float32)
+    weights = column_weights(acts, 256)
+    assert np.allclose(weights, (acts ** 2).mean(axis=0), rtol=1e-4)
+
+    def errors(bits, group_size, calibrate, sample_weights=None):
+        codes, scales, zeros = quantize_calibrated(w, bits, group_size, bits == 1,
+                                                   sample_weights, calibrate)
+        stats = ErrorStats()
+        stats.add(w, dequantize_groups(codes, scales, zeros, group_size), weights)
+        return stats.summary(0)
+
+    # Clipping never loses to the full range, and wins clearly at 2 bits;
+    # weighting by activations lowers the expected output error
+    for bits in (1, 2, 4, 8):
+        for group_size in (32, 64, 128):
+            plain, clipped = errors(bits, group_size, False), errors(bits, group_size, True)
+            assert clipped["relative_error"] <= plain["relative_error"] + 1e-6
+    assert errors(2, 64, True)["relative_error"] < 0.8 * errors(2, 64, False)["relative_error"]
+    assert errors(2, 64, True, weights)["output_error"] < errors(2, 64, True)["output_error"]
+    clip = search_clipping(w, 2, 64)
+    assert clip.shape == (64, 4) and clip.min() >= 0.5 and clip.max() <= 1.0
+
+    # The converter calibrates from samples and reports bytes/param per tensor
+    torch.save({"fc.weight": torch.from_numpy(w), "fc.bias": torch.zeros(64)},
+               tmp_path / "model.pt")
+    out = str(tmp_path / "model.apl_bin")
+    lines = []
+    manifest = convert(str(tmp_path / "model.pt"), out, bits=2, group_size=32, log=lines.append,
+                       calibrate=True, activations={"fc": acts}, report=True)
+    row = manifest["report"]["fc.weight"]
+    assert list(manifest["report"]) == ["fc.weight"] and row["params"] == w.size
+    assert abs(row["bytes_per_param"] - (2 / 8 + 8 / 32)) < 1e-9
+    assert row["output_error"] < row["relative_error"]
+    assert "total" in lines[-1]
+
+def test_bitplane_matmul():
+    from src.bitplanes import BitPlanes, popcount_dot
+    from src.interpreter import APLInterpreter
+    from src.native import TorchBackend, load_backend
+    from src.parallel import ParallelKernels
+
+    rng = np.random.default_rng(2)
+    backend, fallback = load_backend() or TorchBackend(), TorchBackend()
+    x = torch.randn(200, 5)
+    for bits, symmetric in ((1, True), (2, False), (2, True)):
+        w = PackedTensor.quantize(rng.standard_normal((96, 200)), bits=bits, group_size=64,
+                                  symmetric=symmetric)
+        # 8-bit activations: close to the dequantized product
+        planes = BitPlanes.from_packed(w, act_bits=8)
+        expected = w.to_torch() @ x
+        y = fallback.matmul_bits(planes, x)
+        assert (y - expected).norm() / expected.norm() < 0.02
+        # Native and NumPy popcounts agree exactly, so do the row shards
+        acts = planes.activations(x.numpy())
+        assert np.array_equal(backend.bit_dot(planes.planes, acts.planes),
+                              popcount_dot(planes.planes, acts.planes))
+        pool = ParallelKernels(backend, 3)
+        try:
+            assert torch.allclose(pool.matmul_bits(planes, x), y, atol=1e-4)
+        finally:
+            pool.shutdown()
+        assert backend.matmul_bits(planes, x[:, 0]).shape == (96,)
+
+    # 1-bit weights and activations: XNOR-Net, sign(w) . sign(x) scaled by mean |.|
+    w, x = rng.standard_normal((8, 64)).astype(np.float32), rng.standard_normal((64, 3)).astype(np.float32)
+    planes = BitPlanes.from_packed(PackedTensor.quantize(w, bits=1, group_size=64, symmetric=True))
+    expected = (np.sign(w) * np.abs(w).mean(1, keepdims=True)) @ (np.sign(x) * np.abs(x).mean(0))
+    assert np.allclose(backend.matmul_bits(planes, torch.from_numpy(x)).numpy(), expected, atol=1e-5)
+    assert planes.planes.dtype == np.uint64 and planes.planes.nbytes == w.size // 8
+
+    # Selected per layer with the Layer command
+    interp = APLInterpreter()
+    interp.eval("Layer 'FC1' 'Linear' 128 64 bits=1 kernel=xnor")
+    interp.eval("Layer 'FC2' 'Linear' 64 10 bits=2")
+    assert interp.layers[0]["kernel"] == "xnor" and "xnor" in interp.layers[0]["quantization"]
+    engine = interp.get_engine()
+    assert isinstance(engine.modules[0].weight, BitPlanes)
+    assert isinstance(engine.modules[1].weight, PackedTensor)
+    assert "samples/sec" in interp.eval("Run '2'")
+    assert interp.eval("Layer 'X' 'Linear' 4 4 bits=4 kernel=xnor").startswith("The xnor kernel")
+    assert interp.eval("Layer 'X' 'Linear' 4 4 kernel=lut").startswith("Unknown kernel")